@@ -0,0 +1,244 @@
+"""Benchmarks del proceso de generación de recibís sin interfaz gráfica.
+
+Genera listados sintéticos con el mismo formato que espera load_excel_file
+(4 filas de preámbulo, cabecera en la fila 5 y la hoja 'LISTADOS (no tocar)')
+y mide cada etapa: lectura del Excel, instantánea, índices, validación, búsqueda por SIRIA y por texto,
+construcción del contexto, render de la plantilla y guardado del DOCX.
+
+Cada ejecución se añade a benchmarks/resultados.jsonl; con --comparar se
+compara con la ejecución anterior en la misma máquina y se avisa de las
+regresiones.
+
+    python benchmarks/bench_recibi.py --tamanos 1000 10000 100000 --comparar
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import openpyxl  # noqa: E402
+import pandas as pd  # noqa: E402
+import recibi_motor as motor  # noqa: E402
+from recibi_render import get_template_cache  # noqa: E402
+
+DATOS_DIR = os.path.join(BENCH_DIR, "datos")
+RESULTADOS = os.path.join(BENCH_DIR, "resultados.jsonl")
+
+# Columnas que el programa no usa pero que tienen los listados reales
+COLUMNAS_EXTRA = ['TELÉFONO', 'DIRECCIÓN', 'NACIONALIDAD', 'SEXO', 'FECHA ALTA', 'OBSERVACIONES']
+SITUACIONES = [situacion for situaciones in motor.TIPOS_PROTECCION.values() for situacion in situaciones]
+
+def synthetic_roster(path: str, filas: int, seed: int = 1):
+    """Write a roster workbook with families of one titular and up to four minors."""
+    rnd = random.Random(seed)
+    hoy = datetime.now()
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet("LISTADO")
+    for i in range(4):
+        hoja.append([f"Preámbulo {i + 1}"])
+    hoja.append(list(motor.COLUMNAS_ROSTER) + COLUMNAS_EXTRA)
+
+    siria = 1000000
+    escritas = 0
+    while escritas < filas:
+        titular = siria
+        uc = 5000000 + titular
+        miembros = min(filas - escritas, 1 + rnd.randint(0, 4))
+        for miembro in range(miembros):
+            if miembro == 0:
+                nacimiento = hoy - timedelta(days=rnd.randint(19 * 365, 70 * 365))
+            else:
+                nacimiento = hoy - timedelta(days=rnd.randint(0, 17 * 365))
+            hoja.append([
+                f"Nombre{siria}",
+                f"Apellido{siria} Segundo{siria % 97}",
+                f"X{siria:07d}{'TRWAGMYFPDXBNJZSQVHLCKE'[siria % 23]}",
+                hoy + timedelta(days=rnd.randint(-100, 700)),
+                siria,
+                uc,
+                None if miembro == 0 else titular,
+                f"OAR-{siria}",
+                nacimiento,
+                rnd.choice(SITUACIONES),
+                f"6{siria % 100000000:08d}",
+                f"Calle {siria % 500}, {siria % 90 + 1}",
+                rnd.choice(['Ucrania', 'Siria', 'Venezuela', 'Mali', 'Colombia']),
+                rnd.choice(['M', 'H']),
+                hoy - timedelta(days=rnd.randint(0, 900)),
+                None,
+            ])
+            siria += 1
+            escritas += 1
+
+    oculta = libro.create_sheet(motor.HOJA_OCULTA)
+    for fila in range(1, 10):
+        oculta.append([None, f"Profesional B{fila}" if 4 <= fila <= 7 else None, f"Profesional C{fila}" if 4 <= fila <= 5 else None])
+    libro.save(path)
+
+def roster_path(filas: int) -> str:
+    """Return the synthetic roster for the given size, creating it the first time."""
+    os.makedirs(DATOS_DIR, exist_ok=True)
+    path = os.path.join(DATOS_DIR, f"listado_{filas}.xlsx")
+    if not os.path.exists(path):
+        print(f"Generando listado sintético de {filas} filas...", file=sys.stderr)
+        synthetic_roster(path, filas)
+    return path
+
+def timed(func, repeticiones: int = 1) -> float:
+    """Return the median seconds of running func."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+def bench_size(filas: int, recibos: int, repeticiones: int) -> dict:
+    """Measure every stage for one roster size; return times in milliseconds and memory per structure in MB."""
+    path = roster_path(filas)
+    resultados = {}
+
+    # Lectura completa del Excel, sin instantánea
+    resultados['lectura_excel'] = timed(lambda: motor.read_roster_workbook(path), repeticiones)
+
+    # Carga con instantánea ya creada
+    if os.path.exists(motor.snapshot_path(path)):
+        os.remove(motor.snapshot_path(path))
+    motor.load_roster(path)
+    resultados['carga_instantanea'] = timed(lambda: motor.load_roster(path), repeticiones)
+
+    app = motor.ReceiptEngine()
+    app.load_excel_file(path)
+    listado = motor.load_roster(path)[0]
+    resultados['preparacion_indice'] = timed(lambda: app.build_beneficiary_index(
+        motor.prepare_roster(listado, app.EDAD_MAYORIA)), repeticiones)
+    preparado = motor.prepare_roster(listado, app.EDAD_MAYORIA)
+    resultados['validacion'] = timed(lambda: motor.validate_roster(preparado), repeticiones)
+    del listado, preparado
+
+    rnd = random.Random(2)
+    sirias = list(app.beneficiarios)
+    muestra = [rnd.choice(sirias) for _ in range(10000)]
+    resultados['busqueda_siria'] = timed(lambda: [app.is_minor(s) for s in muestra], repeticiones) / len(muestra)
+
+    resultados['indice_busqueda'] = timed(lambda: (setattr(app, 'buscador', None), app.search_index()), repeticiones)
+
+    # Búsqueda mientras se escribe: parte del apellido, del NIE o del SIRIA
+    consultas = []
+    for s in muestra[:1000]:
+        persona = app.find_beneficiary(s)
+        consultas += [str(persona.apellidos)[:6], str(persona.nie)[:5], s[-4:]]
+    resultados['busqueda_texto'] = timed(lambda: [app.search_beneficiaries(c) for c in consultas], repeticiones) / len(consultas)
+    memoria = app.memory_report()
+
+    # Contextos de recibí de adultos y menores, como en el modo por lotes
+    personas = [app.find_beneficiary(s) for s in muestra[:recibos]]
+
+    def build_contexts():
+        contextos = []
+        for persona in personas:
+            titular = persona.siria_titular if persona.es_menor else None
+            contexto, _ = app.build_context(persona.numero_siria, titular, "1FGBI", "56", "Profesional B4", "Efectivo")
+            contextos.append(contexto)
+        return contextos
+    contextos = build_contexts()
+    resultados['contexto'] = timed(build_contexts, repeticiones) / len(personas)
+
+    cache = get_template_cache(app.template_path)
+    cache.load()
+    plantillas = []
+
+    def render():
+        plantillas.clear()
+        for contexto in contextos:
+            plantilla = cache.new_template()
+            plantilla.render(contexto)
+            plantillas.append(plantilla)
+    resultados['render'] = timed(render, repeticiones) / len(contextos)
+
+    def save():
+        for plantilla in plantillas:
+            plantilla.save(io.BytesIO())
+    resultados['guardado_docx'] = timed(save, repeticiones) / len(plantillas)
+
+    tiempos = {etapa: round(segundos * 1000, 4) for etapa, segundos in resultados.items()}
+    return tiempos, {estructura: round(bytes_usados / 1024 / 1024, 2) for estructura, bytes_usados in memoria.items()}
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def previous_run(maquina: str) -> dict:
+    """Return the last recorded run on the same machine, or {}."""
+    anterior = {}
+    if os.path.exists(RESULTADOS):
+        with open(RESULTADOS, encoding='utf-8') as f:
+            for linea in f:
+                ejecucion = json.loads(linea)
+                if ejecucion.get('maquina') == maquina:
+                    anterior = ejecucion
+    return anterior
+
+def compare(actual: dict, anterior: dict, umbral: float) -> int:
+    """Print the change of every stage against the previous run; return the number of regressions."""
+    regresiones = 0
+    print(f"\nComparación con {anterior['revision'] or 'sin revisión'} del {anterior['fecha']}:")
+    for filas, etapas in actual['resultados'].items():
+        for etapa, ms in etapas.items():
+            previo = anterior['resultados'].get(filas, {}).get(etapa)
+            if not previo:
+                continue
+            cambio = (ms - previo) / previo
+            marca = "  REGRESIÓN" if cambio > umbral else ""
+            regresiones += bool(marca)
+            print(f"  {filas:>7} filas  {etapa:<20} {previo:>10.3f} -> {ms:>10.3f} ms ({cambio:+.0%}){marca}")
+    return regresiones
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks del motor de recibís sin interfaz gráfica.")
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 100000], help="Filas de los listados sintéticos.")
+    parser.add_argument('--recibos', type=int, default=50, help="Recibís a renderizar por tamaño.")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Repeticiones por medida (se usa la mediana).")
+    parser.add_argument('--comparar', action='store_true', help="Comparar con la ejecución anterior en esta máquina.")
+    parser.add_argument('--umbral', type=float, default=0.2, help="Empeoramiento relativo que se considera regresión.")
+    args = parser.parse_args(argv)
+
+    maquina = f"{platform.node()} {platform.machine()} {os.cpu_count()} CPU"
+    anterior = previous_run(maquina) if args.comparar else {}
+
+    ejecucion = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'maquina': maquina,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'resultados': {},
+        'memoria': {},
+    }
+    for filas in args.tamanos:
+        ejecucion['resultados'][str(filas)], ejecucion['memoria'][str(filas)] = bench_size(filas, args.recibos, args.repeticiones)
+        print(f"{filas:>7} filas: " + ", ".join(f"{etapa} {ms:.3f} ms" for etapa, ms in ejecucion['resultados'][str(filas)].items()))
+        print(f"{'':>7}  memoria: " + ", ".join(f"{estructura} {mb:.1f} MB" for estructura, mb in ejecucion['memoria'][str(filas)].items()))
+
+    with open(RESULTADOS, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(ejecucion, ensure_ascii=False) + "\n")
+
+    if anterior:
+        return 1 if compare(ejecucion, anterior, args.umbral) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,26 @@
 import os
 import sys
-import pandas as pd
-from docxtpl import DocxTemplate
+import argparse
+import time
+import logging
+import cProfile
+import pstats
+import queue
+import threading
+import multiprocessing
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
-import locale
-from typing import Tuple, Dict, Optional
-from dateutil.relativedelta import relativedelta
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Dict, Optional, List
 from tkinter import PhotoImage
 
+from recibi_motor import ReceiptEngine, Hogar, instrumentation, preload_dependencies, write_batch_summary
+from recibi_salida import OutputSink
+
+logger = logging.getLogger("generar_recibi")
+
 def resource_path(relative_path):
     """Obtener la ruta absoluta al recurso, funciona tanto en el script como en el ejecutable."""
     try:
@@ -20,245 +31,54 @@ def resource_path(relative_path):
 
     return os.path.join(base_path, relative_path)
 
-class DocumentGenerator:
-    def __init__(self):
-        try:
-            locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
-        except locale.Error:
-            try:
-                locale.setlocale(locale.LC_TIME, 'spanish')
-            except locale.Error:
-                messagebox.showwarning("Advertencia", "No se pudo configurar el idioma español para las fechas.")
+class DocumentGenerator(ReceiptEngine):
+    """Tk front end of the receipt engine."""
 
-        self.df = None
-        self.df_oculta = None
-        self.setup_constants()
+    def __init__(self):
+        super().__init__()
         self.init_ui()
 
+    def show_error(self, title: str, message: str):
+        messagebox.showerror(title, message)
+
+    def show_warning(self, title: str, message: str):
+        messagebox.showwarning(title, message)
+
     def setup_constants(self):
         """Initialize constant values and mappings used in the application."""
+        super().setup_constants()
         self.WIDGET_WIDTH = 40
-        self.EDAD_MAYORIA = 18
-        
-        self.codigos_ayuda_descripcion = {
-            "1FGBI": "Gastos de bolsillo",
-            "1FGBM": "Gastos de bolsillo menores 18 años",
-            "1FMI": "Manutención UC 1",
-            "1FMUC2": "Manutención UC 2",
-            "1FMUC3": "Manutención UC 3",
-            "1FMUC4": "Manutención UC 4",
-            "1FMUC5": "Manutención UC 5",
-            "1FMUC6": "Manutención UC 6",
-            "1FMUC7": "Manutención UC 7",
-            "1FMUC8": "Manutención UC 8",
-            "1FMUC9": "Manutención UC 9 o más",
-            "ATNH": "Nacimiento hijos/as",
-            "ATSANMED": "Medicamentos",
-            "ATSANGA": "Gafas",
-            "ATSANMO": "Material ortoprotésico",
-            "ATSANTDE": "Tratamientos dentales",
-            "ATSANPR": "Prótesis dentales removibles",
-            "ATVES": "Adquisición vestuario",
-            "ATTPINCO": "Transporte Incorporación dispositivo",
-            "ATTPTIN": "Transporte Intraprovincial",
-            "ATTPTEXT": "Transporte Intraprovincial",
-            "ATTPTEXA": "Transporte Intraprovincial",
-            "ATTPTEXM": "Transporte Intraprovincial",
-            "ATEDUGUME": "Guardería Mensualidad",
-            "ATEDUGUMA": "Guardería Matrícula",
-            "ATEDURMA": "Educación reglada Matrícula",
-            "ATEDURMATE": "Educación reglada Material escolar",
-            "ATEDURUNI": "Educación reglada Uniformes escolares",
-            "ATEDURCOM": "Educación reglada Comedor escolar",
-            "ATEDUREXTR": "Educación reglada Actividades extraescolares",
-            "ATEDURTPT": "Educación reglada Transporte escolar",
-            "ATEDURSEO": "Educación reglada Seguro escolar obligatorio",
-            "ATEDURAMPA": "Educación reglada AMPA",
-            "ATCONMM": "Contextualiz y habilidades sociales Matrícula y/o mensualidades",
-            "ATCONMAT": "Contextualiz y habilidades sociales Material didáctico",
-            "ATOCCAMP": "Campamentos de verano infantil y juvenil",
-            "ATDOCU": "Obtención de documentos",
-            "ATREADOCU": "Reagrupación familiar Obtención de documentos",
-            "ATREALLEG": "Reagrupación familiar Viajes, traslados, estancias para llegar a España",
-            "ATREAESTA": "Reagrupación familiar Viajes, traslados, estancias en España",
-            "ATEMPEDUGUME": "Empleo Facilitar formación Mensualidad guardería",
-            "ATEMPEDUGUMA": "Empleo Facilitar formación Matrícula de guardería",
-            "ATEMPEDUCOM": "Empleo Facilitar formación Comedor escolar",
-            "ATPREMAME": "Empleo Preformación Matrícula y/o mensualidades",
-            "ATPREMAT": "Empleo Preformación Material didáctico",
-            "ATFORMAME": "Empleo Formación ocupacional Matrícula y/o mensualidades",
-            "ATFORMAT": "Empleo Formación ocupacional Material didáctico para la formación",
-            "ATTPT": "Empleo Transporte asistencia cursos o búsqueda empleo",
-            "ATEHT": "Empleo Obtención documentos (expedición, homologación, tramitación…)",
-            "2FNB1": "Necesidades básicas UC1",
-            "2FNB2": "Necesidades básicas UC2",
-            "2FNB3": "Necesidades básicas UC3",
-            "2FNB4": "Necesidades básicas UC4",
-            "2FNB5": "Necesidades básicas UC5",
-            "2FNB6": "Necesidades básicas UC6",
-            "2FNB7": "Necesidades básicas UC7",
-            "2FNB8": "Necesidades básicas UC8",
-            "2FNB9": "Necesidades básicas UC9 o más",
-            "2FAV1": "Alquiler UC1",
-            "2FAV2": "Alquiler UC2",
-            "2FAV3": "Alquiler UC3",
-            "2FAV4": "Alquiler UC4",
-            "2FAV5": "Alquiler UC5",
-            "2FAV6": "Alquiler UC6",
-            "2FAV7": "Alquiler UC7",
-            "2FAV8": "Alquiler UC8",
-            "2FAV9": "Alquiler UC9 o más"
-        }
-        
-        # Diccionario de cuantías predefinidas
-        self.cuantias_predefinidas = {
-            "1FGBI": 56,
-            "1FGBM": 22,
-            "1FMI": 226,
-            "1FMUC2": 338,
-            "1FMUC3": 362,
-            "1FMUC4": 386,
-            "1FMUC5": 454,
-            "1FMUC6": 504,
-            "1FMUC7": 555,
-            "1FMUC8": 604,
-            "1FMUC9": 654,
-            "ATNH": 201,
-            "ATSANGA": 200,
-            "ATVES": 100,      
-            "ATSANTDE": 400,
-            "ATEDURMATE": 279,
-            "ATEDUREXTR": 33,
-            "ATCONMM": 600,
-            "ATCONMAT": 100,
-            "ATOCCAMP": 223,
-            "ATPREMAME": 1364,
-            "ATPREMAT": 250,
-            "ATFORMAME": 1364,
-            "ATFORMAT": 250,
-            "2FNB1": 466,
-            "2FNB2": 692,
-            "2FNB3": 758,
-            "2FNB4": 825,
-            "2FNB5": 891,
-            "2FNB6": 958,
-            "2FNB7": 1024,
-            "2FNB8": 1091,
-            "2FNB9": 1157,
-            "2FAV1": 445,
-            "2FAV2": 578,
-            "2FAV3": 668,
-            "2FAV4": 758,
-            "2FAV5": 848,
-            "2FAV6": 848,
-            "2FAV7": 848,
-            "2FAV8": 923,
-            "2FAV9": 923,
-        }
-
-        # Imprimir las cuantías predefinidas y sus valores
-        print("Cuantías predefinidas:")
-        for codigo, cuantia in self.cuantias_predefinidas.items():
-            print(f"Código: {codigo}, Cuantía: {cuantia}")
-
-        self.maximos_ayuda = {
-            "1FGBI": 56,
-            "1FGBM": 22,
-            "1FMI": 226,
-            "1FMUC2": 338,
-            "1FMUC3": 362,
-            "1FMUC4": 386,
-            "1FMUC5": 454,
-            "1FMUC6": 504,
-            "1FMUC7": 555,
-            "1FMUC8": 604,
-            "1FMUC9": 654,
-            "ATNH": 201,
-            "ATSANGA": 200,
-            "ATVES": 100,      
-            "ATSANTDE": 400,
-            "ATEDURMATE": 279,
-            "ATEDUREXTR": 33,
-            "ATCONMM": 600,
-            "ATCONMAT": 100,
-            "ATOCCAMP": 223,
-            "ATPREMAME": 1364,
-            "ATPREMAT": 250,
-            "ATFORMAME": 1364,
-            "ATFORMAT": 250,
-            "2FNB1": 466,
-            "2FNB2": 692,
-            "2FNB3": 758,
-            "2FNB4": 825,
-            "2FNB5": 891,
-            "2FNB6": 958,
-            "2FNB7": 1024,
-            "2FNB8": 1091,
-            "2FNB9": 1157,
-            "2FAV1": 445,
-            "2FAV2": 578,
-            "2FAV3": 668,
-            "2FAV4": 758,
-            "2FAV5": 848,
-            "2FAV6": 848,
-            "2FAV7": 848,
-            "2FAV8": 923,
-            "2FAV9": 923,
-        }
-
-    def load_excel_file(self) -> bool:
-        """Load Excel file and return success status."""
-        archivo = filedialog.askopenfilename(filetypes=[("Archivos Excel", "*.xlsx")])
-        if not archivo:
-            messagebox.showerror("Error", "No se seleccionó ningún archivo.")
-            return False
-
-        try:
-            self.df = pd.read_excel(archivo, header=4)
-            self.df_oculta = pd.read_excel(archivo, sheet_name='LISTADOS (no tocar)', header=None)
-            self.df['Nº SIRIA BENEFICIARIA/O'] = self.df['Nº SIRIA BENEFICIARIA/O'].astype(str)
-            self.load_professional_values()
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo cargar el archivo Excel: {str(e)}")
+        self.RELOAD_INTERVAL_MS = 5000  # Cada cuánto se comprueba si el Excel ha cambiado
+        self.SEARCH_DELAY_MS = 150  # Pausa al escribir antes de buscar, para no buscar en cada tecla
+
+    def load_excel_file(self, archivo: Optional[str] = None) -> bool:
+        """Ask for the Excel file if none is given, then load it."""
+        if archivo is None:
+            archivo = filedialog.askopenfilename(filetypes=[("Archivos Excel", "*.xlsx")])
+        if not super().load_excel_file(archivo):
             return False
-
-    def load_professional_values(self):
-        """Load professional values from hidden sheet."""
-        valores_b = self.df_oculta.iloc[3:7, 1].dropna().tolist()
-        valores_c = self.df_oculta.iloc[3:7, 2].dropna().tolist()
-        self.valores_combined = valores_b + valores_c
-        self.valor_combobox['values'] = self.valores_combined
-        
-        # Imprimir para depuración
-        print(f"Valores de profesionales cargados: {self.valores_combined}")
-
-    def calculate_age(self, birthdate) -> Optional[int]:
-        """Calculate age from birthdate."""
-        if pd.isna(birthdate):
-            return None
-        try:
-            return relativedelta(datetime.now(), pd.to_datetime(birthdate)).years
-        except:
-            return None
-
-    def is_minor(self, numero_siria: str) -> Tuple[bool, Optional[pd.Timestamp], Optional[str]]:
-        """Check if a person is a minor and return their titular's SIRIA number if available."""
-        persona = self.df[self.df['Nº SIRIA BENEFICIARIA/O'] == numero_siria]
-        if persona.empty:
-            return False, None, None
-        
-        fecha_nacimiento = persona.iloc[0]['FECHA NACIMIENTO']
-        siria_titular = persona.iloc[0]['Nº DE SIRIA TITULAR UNIDAD FAMILIAR']
-        
-        if pd.isna(fecha_nacimiento):
-            return False, None, None
-            
-        age = self.calculate_age(fecha_nacimiento)
-        return (age is not None and age < self.EDAD_MAYORIA), fecha_nacimiento, siria_titular
+        # El índice de búsqueda se prepara en segundo plano mientras se rellena el formulario
+        self.reload_executor.submit(self.search_index)
+        self.excel_status_label.config(text=self.problems_summary())
+        return True
+
+    def problems_summary(self) -> str:
+        """Status line with how many people have incomplete roster data, or ''."""
+        if not self.problemas:
+            return ""
+        return f"{len(self.problemas)} beneficiarias/os con datos incompletos en el Excel (se avisa al generar su recibí)"
+
+    def load_professional_values(self, df_oculta) -> bool:
+        cambiados = super().load_professional_values(df_oculta)
+        if cambiados:
+            # Cambiar la lista no altera el profesional ya seleccionado
+            self.valor_combobox['values'] = self.valores_combined
+        return cambiados
 
     def init_ui(self):
         """Initialize the user interface."""
+        # pandas, openpyxl y docxtpl se importan mientras se construye la ventana y se elige el Excel
+        threading.Thread(target=preload_dependencies, daemon=True).start()
         self.root = tk.Tk()
         self.root.title("Generador de Documentos")
         
@@ -268,8 +88,22 @@ class DocumentGenerator:
         main_frame = ttk.Frame(self.root, padding="10")
         main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
+        # Los recibís se generan en segundo plano; la ventana consulta la cola de estados
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.job_queue = queue.Queue()
+        self.jobs = {}
+        self.por_guardar = []
+        self.por_convertir = []
+        self.pdf_converter = None
+        self.salida = OutputSink(os.getcwd())
+        self.reload_executor = ThreadPoolExecutor(max_workers=1)
+        self.reload_future = None
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
         self.create_input_fields(main_frame)
         self.create_buttons(main_frame)
+        self.root.after(100, self.poll_jobs)
+        self.root.after(self.RELOAD_INTERVAL_MS, self.watch_excel_file)
 
         if not self.load_excel_file():
             self.root.quit()
@@ -279,17 +113,28 @@ class DocumentGenerator:
 
     def create_input_fields(self, parent):
         """Create input fields for the form."""
-        print("Método create_input_fields llamado.")  # Mensaje de depuración
-        # SIRIA number input
-        ttk.Label(parent, text="Número de SIRIA:").grid(column=0, row=0, sticky=tk.W)
-        self.numero_siria_entry = ttk.Entry(parent, width=self.WIDGET_WIDTH)
-        self.numero_siria_entry.grid(column=1, row=0, padx=5, pady=5)
+        logger.debug("Método create_input_fields llamado.")
+        # SIRIA number input; también busca por nombre, apellidos, NIE o parte del SIRIA mientras se escribe
+        ttk.Label(parent, text="Número de SIRIA:").grid(column=0, row=0, sticky=(tk.W, tk.N), pady=5)
+        siria_frame = ttk.Frame(parent)
+        siria_frame.grid(column=1, row=0, padx=5, pady=5)
+        self.numero_siria_entry = ttk.Entry(siria_frame, width=self.WIDGET_WIDTH)
+        self.numero_siria_entry.pack()
+        self.search_listbox = tk.Listbox(siria_frame, height=6, width=self.WIDGET_WIDTH + 20)
+        self.search_after_id = None
+        self.search_results = []
+        self.numero_siria_entry.bind("<KeyRelease>", self.schedule_search)
+        self.numero_siria_entry.bind("<Down>", self.focus_search_results)
+        self.numero_siria_entry.bind("<Escape>", lambda e: self.hide_search_results())
+        self.search_listbox.bind("<Return>", self.choose_search_result)
+        self.search_listbox.bind("<Double-Button-1>", self.choose_search_result)
+        self.search_listbox.bind("<Escape>", lambda e: self.hide_search_results())
 
         # Ayuda code selection
         ttk.Label(parent, text="Código de ayuda:").grid(column=0, row=1, sticky=tk.W)
         self.codigo_ayuda_combobox = ttk.Combobox(
             parent, 
-            values=list(self.codigos_ayuda_descripcion.keys()), 
+            values=self.catalogo.codes(), 
             state="readonly", 
             width=self.WIDGET_WIDTH-2
         )
@@ -344,10 +189,87 @@ class DocumentGenerator:
             value="Banco"
         ).pack(side=tk.LEFT)
 
+        # Output format
+        ttk.Label(parent, text="Formato:").grid(column=0, row=6, sticky=tk.W)
+        self.output_format_var = tk.StringVar(value="docx")
+        format_frame = ttk.Frame(parent)
+        format_frame.grid(column=1, row=6, padx=5, pady=5)
+        ttk.Radiobutton(format_frame, text="Word", variable=self.output_format_var, value="docx").pack(side=tk.LEFT)
+        ttk.Radiobutton(format_frame, text="PDF", variable=self.output_format_var, value="pdf").pack(side=tk.LEFT)
+
+        # Carpeta de salida (p. ej., la carpeta compartida de la red) y apertura al terminar
+        ttk.Label(parent, text="Guardar en:").grid(column=0, row=7, sticky=tk.W)
+        output_frame = ttk.Frame(parent)
+        output_frame.grid(column=1, row=7, padx=5, pady=5)
+        self.output_dir_var = tk.StringVar(value=self.salida.directorio)
+        ttk.Label(output_frame, textvariable=self.output_dir_var, width=self.WIDGET_WIDTH - 12).pack(side=tk.LEFT)
+        ttk.Button(output_frame, text="Cambiar...", command=self.choose_output_dir).pack(side=tk.LEFT)
+        self.open_after_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(parent, text="Abrir al generar", variable=self.open_after_var).grid(
+            column=1, row=8, padx=5, sticky=tk.W)
+
+    def choose_output_dir(self):
+        """Ask for the folder where the next receipts are saved."""
+        directorio = filedialog.askdirectory(initialdir=self.salida.directorio, mustexist=True)
+        if directorio:
+            # Los recibís ya en cola se guardan en la carpeta que había al pedirlos
+            self.salida = OutputSink(directorio)
+            self.output_dir_var.set(directorio)
+
+    def schedule_search(self, event=None):
+        """Search again once the user stops typing for a moment."""
+        if event is not None and event.keysym in ("Down", "Up", "Return", "Escape", "Tab"):
+            return
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(self.SEARCH_DELAY_MS, self.run_search)
+
+    def run_search(self):
+        """Show the beneficiaries matching what has been typed in the SIRIA field."""
+        self.search_after_id = None
+        consulta = self.numero_siria_entry.get().strip()
+        personas = self.search_beneficiaries(consulta, construir=False) if len(consulta) >= 2 else []
+        if personas is None:
+            # El índice aún se está construyendo en segundo plano; no se espera por él aquí
+            self.search_after_id = self.root.after(self.SEARCH_DELAY_MS, self.run_search)
+            return
+        # Si ya se ha escrito un SIRIA completo no hace falta la lista
+        if not personas or (len(personas) == 1 and personas[0].numero_siria == consulta.replace(" ", "")):
+            self.hide_search_results()
+            return
+
+        self.search_results = [persona.numero_siria for persona in personas]
+        self.search_listbox.delete(0, tk.END)
+        for persona in personas:
+            menor = " (menor)" if persona.es_menor else ""
+            self.search_listbox.insert(tk.END, f"{persona.numero_siria}  {persona.apellidos}, {persona.nombre}  {persona.nie}{menor}")
+        if not self.search_listbox.winfo_ismapped():
+            self.search_listbox.pack(fill=tk.X, pady=(2, 0))
+
+    def focus_search_results(self, event=None):
+        if self.search_listbox.winfo_ismapped():
+            self.search_listbox.focus_set()
+            self.search_listbox.selection_clear(0, tk.END)
+            self.search_listbox.selection_set(0)
+            self.search_listbox.activate(0)
+
+    def choose_search_result(self, event=None):
+        """Put the selected beneficiary's SIRIA number in the field."""
+        seleccion = self.search_listbox.curselection()
+        if not seleccion:
+            return
+        self.numero_siria_entry.delete(0, tk.END)
+        self.numero_siria_entry.insert(0, self.search_results[seleccion[0]])
+        self.hide_search_results()
+        self.numero_siria_entry.focus_set()
+
+    def hide_search_results(self):
+        self.search_listbox.pack_forget()
+
     def create_buttons(self, parent):
         """Create action buttons."""
         button_frame = ttk.Frame(parent)
-        button_frame.grid(column=0, row=6, columnspan=2, pady=10)
+        button_frame.grid(column=0, row=9, columnspan=2, pady=10)
         
         ttk.Button(
             button_frame,
@@ -355,6 +277,186 @@ class DocumentGenerator:
             command=self.generate_document
         ).pack(expand=True)
 
+        ttk.Button(
+            button_frame,
+            text="Generar recibís de la familia",
+            command=self.generate_household
+        ).pack(expand=True, pady=(5, 0))
+
+        ttk.Button(
+            button_frame,
+            text="Recargar Excel",
+            command=self.reload_from_ui
+        ).pack(expand=True, pady=(5, 0))
+        self.excel_status_label = ttk.Label(button_frame, text="")
+        self.excel_status_label.pack(fill=tk.X, pady=(5, 0))
+
+        # Estado de los recibís en cola, generándose y terminados
+        self.status_label = ttk.Label(button_frame, text="")
+        self.status_label.pack(fill=tk.X, pady=(10, 0))
+        self.progress_bar = ttk.Progressbar(button_frame, mode="determinate", length=self.WIDGET_WIDTH * 10)
+        self.progress_bar.pack(fill=tk.X, pady=5)
+        self.jobs_listbox = tk.Listbox(button_frame, height=5, width=self.WIDGET_WIDTH * 2)
+        self.jobs_listbox.pack(fill=tk.X)
+
+    def watch_excel_file(self):
+        """Reload the workbook when its modification time changes, then reschedule itself."""
+        try:
+            if self.archivo and os.path.getmtime(self.archivo) != self.archivo_mtime:
+                self.reload_from_ui()
+        except OSError:
+            # El Excel puede no estar accesible un momento (p. ej., mientras se guarda en la red)
+            pass
+        self.root.after(self.RELOAD_INTERVAL_MS, self.watch_excel_file)
+
+    def reload_from_ui(self):
+        """Start reading the workbook in the background; the form is left as it is."""
+        if not self.archivo or self.reload_future is not None:
+            return
+        self.excel_status_label.config(text="Recargando Excel...")
+        self.reload_future = self.reload_executor.submit(self.read_roster_changes)
+        self.root.after(100, self.finish_reload)
+
+    def finish_reload(self):
+        """Apply the background reload once it has finished, and show what changed."""
+        if not self.reload_future.done():
+            self.root.after(100, self.finish_reload)
+            return
+
+        future, self.reload_future = self.reload_future, None
+        try:
+            cambios = self.apply_roster_changes(*future.result())
+        except Exception as e:
+            self.excel_status_label.config(text=f"No se pudo recargar el Excel: {str(e)}")
+            return
+        self.reload_executor.submit(self.search_index)
+        self.excel_status_label.config(
+            text=f"Excel recargado a las {datetime.now().strftime('%H:%M')}: {cambios['nuevas']} nuevas, "
+                 f"{cambios['modificadas']} modificadas, {cambios['eliminadas']} eliminadas\n{self.problems_summary()}".strip()
+        )
+
+    def submit_job(self, context: Dict, output_filename: str) -> str:
+        """Queue a receipt to be rendered in the background; save_jobs then writes and opens it.
+
+        Returns the error message if the receipt cannot be queued (no PDF converter), or ''.
+        """
+        formato = self.output_format_var.get()
+        if formato == 'pdf' and self.pdf_converter is None:
+            from recibi_render import PdfConverter
+            try:
+                self.pdf_converter = PdfConverter()
+            except RuntimeError as e:
+                return str(e)
+
+        job_id = len(self.jobs)
+        self.jobs[job_id] = "En cola"
+        nombre = output_filename if formato == 'docx' else str(Path(output_filename).with_suffix('.pdf'))
+        self.jobs_listbox.insert(tk.END, f"{nombre}: En cola")
+        self.jobs_listbox.see(tk.END)
+        self.executor.submit(self.run_job, job_id, context, output_filename, formato, self.salida)
+        self.update_job_status()
+        return ""
+
+    def save_jobs(self):
+        """Queue the writing, recording and opening of the receipts submitted so far."""
+        self.executor.submit(self.finish_jobs, self.open_after_var.get())
+
+    def run_job(self, job_id: int, context: Dict, output_filename: str, formato: str, salida: OutputSink):
+        """Render a queued receipt into the output sink; runs in the worker thread and must not touch Tk widgets."""
+        self.job_queue.put((job_id, "Generando", "", ""))
+        try:
+            documento = self.render_bytes(context)
+            if formato == 'pdf':
+                # Los PDF se piden todos juntos en finish_jobs, para arrancar LibreOffice una sola vez
+                self.por_convertir.append((job_id, context, output_filename, documento, salida))
+                return
+            ruta = salida.add(output_filename, documento)
+            self.por_guardar.append((job_id, context, ruta, salida))
+            self.job_queue.put((job_id, "Guardando", "", os.path.basename(ruta)))
+        except Exception as e:
+            self.job_queue.put((job_id, "Error", f"Error al generar el documento: {str(e)}", ""))
+
+    def finish_jobs(self, abrir: bool):
+        """Convert the rendered receipts that go as PDF, write them all, then record and open them; runs in the worker thread."""
+        convertir, self.por_convertir = self.por_convertir, []
+        if convertir:
+            # La conversión se hace en una carpeta temporal local, no en la de salida
+            conversiones = self.pdf_converter.submit_documents(
+                [(documento, output_filename) for _, _, output_filename, documento, _ in convertir])
+            for (job_id, context, output_filename, _, salida), conversion in zip(convertir, conversiones):
+                try:
+                    pdf_path = conversion.result()
+                    with open(pdf_path, 'rb') as f:
+                        documento = f.read()
+                    os.remove(pdf_path)
+                    ruta = salida.add(str(Path(output_filename).with_suffix('.pdf')), documento)
+                    self.por_guardar.append((job_id, context, ruta, salida))
+                    self.job_queue.put((job_id, "Guardando", "", os.path.basename(ruta)))
+                except Exception as e:
+                    self.job_queue.put((job_id, "Error", f"Error al generar el documento: {str(e)}", ""))
+        guardar, self.por_guardar = self.por_guardar, []
+        for salida in {salida for *_, salida in guardar}:
+            salida.flush()
+        for job_id, context, ruta, salida in guardar:
+            error = salida.errores.pop(ruta, None)
+            if error:
+                self.job_queue.put((job_id, "Error", f"No se pudo guardar {ruta}: {error}", ""))
+                continue
+            # Si otro puesto guardó entretanto un recibí con el mismo nombre, el nuevo se guardó con otro
+            final = salida.final_path(ruta)
+            try:
+                self.record_receipt(context, final)
+
+                # Abrir el documento generado
+                if abrir:
+                    with instrumentation.stage('apertura'):
+                        os.startfile(final)
+                self.job_queue.put((job_id, "Terminado", "", os.path.basename(final) if final != ruta else ""))
+            except Exception as e:
+                self.job_queue.put((job_id, "Error", f"Error al generar el documento: {str(e)}", ""))
+
+    def poll_jobs(self):
+        """Apply the status updates sent by the worker thread and reschedule itself."""
+        while True:
+            try:
+                job_id, estado, error, nombre = self.job_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.jobs[job_id] = estado
+            # El nombre cambia si ya había otro recibí distinto con el mismo nombre
+            nombre = nombre or self.jobs_listbox.get(job_id).rsplit(": ", 1)[0]
+            self.jobs_listbox.delete(job_id)
+            self.jobs_listbox.insert(job_id, f"{nombre}: {estado}")
+            if error:
+                self.jobs_listbox.itemconfig(job_id, foreground="red")
+                messagebox.showerror("Error", error)
+            self.update_job_status()
+        self.root.after(100, self.poll_jobs)
+
+    def update_job_status(self):
+        """Refresh the counters and progress bar of the status area."""
+        estados = list(self.jobs.values())
+        terminados = estados.count("Terminado") + estados.count("Error")
+        self.status_label.config(
+            text=f"En cola: {estados.count('En cola')}   Generando: {estados.count('Generando')}   "
+                 f"Guardando: {estados.count('Guardando')}   "
+                 f"Terminados: {estados.count('Terminado')}   Errores: {estados.count('Error')}"
+        )
+        self.progress_bar.config(maximum=max(len(estados), 1), value=terminados)
+
+    def on_close(self):
+        """Close the window, asking first if receipts are still being generated."""
+        pendientes = sum(1 for estado in self.jobs.values() if estado in ("En cola", "Generando", "Guardando"))
+        if pendientes and not messagebox.askyesno(
+                "Recibís pendientes",
+                f"Todavía se están generando {pendientes} recibís.\n¿Salir igualmente?"):
+            return
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.reload_executor.shutdown(wait=False, cancel_futures=True)
+        if self.pdf_converter:
+            threading.Thread(target=self.pdf_converter.close, daemon=True).start()
+        self.root.destroy()
+
     def prompt_for_titular(self) -> Optional[str]:
         """Prompt user for titular's SIRIA number."""
         dialog = tk.Toplevel(self.root)
@@ -390,70 +492,51 @@ class DocumentGenerator:
         dialog.wait_window()
         return result.get()
 
-    def get_person_data(self, numero_siria: str, is_titular: bool = True) -> Optional[Dict]:
-        """Retrieve person data from DataFrame with role-specific field names."""
-        personas_filtradas = self.df[self.df['Nº SIRIA BENEFICIARIA/O'] == numero_siria]
-        if personas_filtradas.empty:
-            return None
-        
-        persona = personas_filtradas.iloc[0]
-        prefix = 'titular_' if is_titular else 'menor_'
-        
-        # Formatear la fecha de nacimiento
-        fecha_nacimiento = persona['FECHA NACIMIENTO']
-        if pd.notna(fecha_nacimiento):
-            fecha_nacimiento = pd.to_datetime(fecha_nacimiento).strftime('%d-%m-%Y')
-        
-        # Determinar el tipo de protección
-        tipo_proteccion = persona['SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL']
-        
-        # Imprimir para depuración
-        print(f"\nTipo de protección encontrado: '{tipo_proteccion}'")
-        
-        data = {
-            f'{prefix}nombre': persona['NOMBRE'],
-            f'{prefix}apellidos': persona['APELLIDOS'],
-            f'{prefix}nie': persona['NÚMERO NIE'],
-            f'{prefix}caducidad_nie': persona['CADUCIDAD NIE '],
-            f'{prefix}numero_siria_beneficiaria': persona['Nº SIRIA BENEFICIARIA/O'],
-            f'{prefix}numero_siria_uc': persona['Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)'],
-            f'{prefix}numero_siria_uf': persona['Nº DE SIRIA TITULAR UNIDAD FAMILIAR'],
-            f'{prefix}oar': persona['Nº EXPEDIENTE OAR'],
-            f'{prefix}fecha_nacimiento': fecha_nacimiento,
-            
-            # Campos para la tabla de tipo de protección
-            'sol_pi': 'X' if tipo_proteccion == 'Solicitante Protección Internacional' else '',
-            'ben_pi': 'X' if tipo_proteccion == 'Beneficiario/a Estatuto Refugiado/a' else '',
-            'ben_ps': 'X' if tipo_proteccion == 'Beneficiario/a Protección Subsidiaria' else '',
-            'sol_ap': 'X' if tipo_proteccion == 'Solicitante Estatuto de Apátrida' else '',
-            'apatrida': 'X' if tipo_proteccion == 'Apátrida' else '',
-            'sol_ben_pt': 'X' if (tipo_proteccion == 'Solicitante Protección Temporal' or 
-                                 tipo_proteccion == 'Beneficiario/a Protección Temporal') else ''
-        }
-        
-        # Añadir el placeholder "Hijo/a" si es menor
-        if not is_titular:
-            data['relacion_familiar'] = "Hijo/a"
-        
-        return data
+    def choose_household_members(self, hogar: Hogar) -> List[str]:
+        """Show a household and let the user untick members; return the SIRIA numbers chosen."""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Unidad familiar")
+        dialog.transient(self.root)
+        dialog.grab_set()
 
-    def validate_input(self) -> Tuple[bool, str]:
-        """Validate user input and return (is_valid, error_message)."""
-        numero_siria = self.numero_siria_entry.get()
-        codigo_ayuda = self.codigo_ayuda_combobox.get()
-        cuantia_str = self.cuantia_ayuda_entry.get().replace(',', '.')
+        uc = f"Unidad convivencial {hogar.numero_siria_uc}" if hogar.numero_siria_uc else "Sin unidad convivencial"
+        ttk.Label(
+            dialog,
+            text=f"{uc} ({len(hogar.miembros)} miembros). Titular: {hogar.numero_siria_titular or 'desconocido'}\n"
+                 "Se generará un recibí para cada persona marcada:"
+        ).pack(pady=10, padx=10, anchor=tk.W)
+
+        marcados = []
+        for numero_siria in hogar.miembros:
+            persona = self.find_beneficiary(numero_siria)
+            menor = " (menor)" if persona.es_menor else ""
+            marcado = tk.BooleanVar(value=True)
+            ttk.Checkbutton(
+                dialog,
+                text=f"{numero_siria}  {persona.apellidos}, {persona.nombre}{menor}",
+                variable=marcado
+            ).pack(padx=20, anchor=tk.W)
+            marcados.append((numero_siria, marcado))
+
+        result = []
 
-        if not all([numero_siria, codigo_ayuda, cuantia_str]):
-            return False, "Por favor, introduce todos los datos necesarios."
+        def on_ok():
+            result.extend(numero_siria for numero_siria, marcado in marcados if marcado.get())
+            dialog.destroy()
 
-        try:
-            cuantia = float(cuantia_str)
-            if codigo_ayuda in self.maximos_ayuda and cuantia > self.maximos_ayuda[codigo_ayuda]:
-                return False, f"La cuantía para la ayuda {codigo_ayuda} no puede superar los {self.maximos_ayuda[codigo_ayuda]} euros."
-        except ValueError:
-            return False, "Por favor, introduce una cuantía válida en euros."
+        ttk.Button(dialog, text="Aceptar", command=on_ok).pack(side=tk.LEFT, padx=10, pady=10)
+        ttk.Button(dialog, text="Cancelar", command=dialog.destroy).pack(side=tk.RIGHT, padx=10, pady=10)
 
-        return True, ""
+        dialog.wait_window()
+        return result
+
+    def validate_input(self) -> Tuple[bool, str]:
+        """Validate user input and return (is_valid, error_message)."""
+        return self.validate_values(
+            self.numero_siria_entry.get(),
+            self.codigo_ayuda_combobox.get(),
+            self.cuantia_ayuda_entry.get()
+        )
 
     def generate_document(self):
         """Generate the document based on user input."""
@@ -464,16 +547,19 @@ class DocumentGenerator:
 
         # Obtener el número de SIRIA y eliminar espacios
         numero_siria = self.numero_siria_entry.get().strip().replace(" ", "")  # Ignorar espacios
+
+        # Avisar de los datos que faltan en el Excel; el titular de un menor se puede indicar a mano
+        problemas = self.roster_problems(numero_siria, con_titular=True)
+        if problemas and not messagebox.askyesno(
+                "Datos incompletos", f"En el Excel {problemas}.\n¿Generar el recibí igualmente?"):
+            return
+
         is_minor, fecha_nacimiento, siria_titular = self.is_minor(numero_siria)
-        
-        # Preparar los datos del contexto
-        context = {}
-        
+
+        numero_siria_titular = None
         if is_minor:
-            numero_siria_titular = None
-            
             # Si hay un número de SIRIA del titular en el Excel
-            if pd.notna(siria_titular):
+            if siria_titular:
                 # Preguntar al usuario si el número es correcto
                 if messagebox.askyesno("Confirmar titular", 
                     f"Esta persona es menor de edad.\nSe ha encontrado el número de SIRIA de la titular: {siria_titular}\n¿Es correcto?"):
@@ -486,132 +572,362 @@ class DocumentGenerator:
             if not numero_siria_titular:
                 messagebox.showerror("Error", "Se requiere el número SIRIA del titular para menores de edad.")
                 return
-                
-            # Obtener datos del titular
-            datos_titular = self.get_person_data(numero_siria_titular, is_titular=True)
-            if not datos_titular:
-                messagebox.showerror("Error", "No se encontraron los datos del titular.")
-                return
-                
-            # Obtener datos del menor
-            datos_menor = self.get_person_data(numero_siria, is_titular=False)
-            if not datos_menor:
-                messagebox.showerror("Error", "No se encontraron los datos del menor.")
-                return
-                
-            # Combinar datos en el contexto
-            context.update(datos_titular)
-            context.update(datos_menor)
-            context['relacion_familiar'] = "Hijo/a"
-        else:
-            # Si es adulto
-            datos_persona = self.get_person_data(numero_siria, is_titular=True)
-            if not datos_persona:
-                messagebox.showerror("Error", "No se encontraron los datos de la persona.")
-                return
-            context.update(datos_persona)
-            context['relacion_familiar'] = ""
-
-        # Añadir datos adicionales al contexto
-        context.update({
-            'codigo_ayuda': self.codigo_ayuda_combobox.get(),
-            'descripcion_ayuda': self.codigos_ayuda_descripcion[self.codigo_ayuda_combobox.get()],
-            'cuantia': self.cuantia_ayuda_entry.get(),
-            'profesional': self.valor_combobox.get(),
-            'metodo_pago': self.payment_method_var.get(),
-            'fecha_actual': datetime.now().strftime("%d de %B de %Y")
-        })
-
-        # Calcular el copago si es necesario
-        codigo_ayuda = self.codigo_ayuda_combobox.get()
-        if codigo_ayuda in ["ATSANGA", "ATSANTDE"]:  # Verifica si la ayuda requiere copago
-            try:
-                cuantia = float(self.cuantia_ayuda_entry.get().replace(',', '.'))
-                copago = cuantia * 0.15
-                cuantia_final = cuantia - copago
-                context['cuantia'] = f"{cuantia_final:.2f}"  # Actualizar la cuantía en el contexto sin el símbolo 
-            except ValueError:
-                context['cuantia'] = self.cuantia_ayuda_entry.get()  # Mantener la cuantía original si hay error
-        else:
-            context['cuantia'] = self.cuantia_ayuda_entry.get()  # Mantener la cuantía original
 
-        # Definir la fecha actual
-        fecha_actual = datetime.now().strftime("%Y.%m.%d")  # Formato: YYYY.MM.DD
+        # Preparar los datos del contexto
+        context, error_message = self.build_context(
+            numero_siria,
+            numero_siria_titular,
+            self.codigo_ayuda_combobox.get(),
+            self.cuantia_ayuda_entry.get(),
+            self.valor_combobox.get(),
+            self.payment_method_var.get()
+        )
+        if context is None:
+            messagebox.showerror("Error", error_message)
+            return
 
-        # Crear el nombre del archivo usando las dos primeras letras del nombre y apellido del menor
-        nombre = context['menor_nombre'][:2].upper()  # Dos primeras letras del nombre del menor
-        apellido = context['menor_apellidos'][:2].upper()  # Dos primeras letras del apellido del menor
-        output_filename = f"{nombre}.{apellido}_{numero_siria}_{fecha_actual}.docx"
+        # Avisar si la ayuda ya se dio este mes o si se superaría su máximo; reimprimir el mismo recibí no avisa
+        aviso = self.ledger_warnings(numero_siria, context['codigo_ayuda'], context['cuantia_bruta'], context)
+        if aviso and not messagebox.askyesno("Ayuda ya emitida", f"{aviso}\n¿Generar el recibí igualmente?"):
+            return
 
-        try:
-            # Obtener la ruta del directorio actual donde está el script
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            template_path = os.path.join(script_dir, "plantilla_recibo.docx")
-            
-            # Verificar si existe la plantilla
-            if not os.path.exists(template_path):
-                messagebox.showerror("Error", "No se encuentra el archivo de plantilla 'plantilla_recibo.docx'")
-                return
-            
-            # Cargar la plantilla
-            template = DocxTemplate(template_path)
-            
-            # Renderizar el documento
-            template.render(context)
-            
-            # Guardar el documento generado
-            template.save(output_filename)
-            
-            messagebox.showinfo("Éxito", f"Documento generado correctamente: {output_filename}")
-            
-            # Abrir el documento generado
-            os.startfile(output_filename)
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al generar el documento: {str(e)}")
+        output_filename = self.build_output_filename(context, numero_siria)
+
+        # El renderizado, el guardado y la apertura se hacen en segundo plano
+        error_message = self.submit_job(context, output_filename)
+        if error_message:
+            messagebox.showerror("Error", error_message)
+            return
+        self.save_jobs()
+
+    def generate_household(self):
+        """Generate the receipt of every chosen member of the household of the SIRIA number entered."""
+        is_valid, error_message = self.validate_input()
+        if not is_valid:
+            messagebox.showerror("Error", error_message)
+            return
+
+        hogar = self.find_household(self.numero_siria_entry.get())
+        if hogar is None:
+            messagebox.showerror("Error", "No se encontró la unidad familiar de este número de SIRIA.")
+            return
+        miembros = self.choose_household_members(hogar)
+        if not miembros:
+            return
+
+        codigo_ayuda = self.codigo_ayuda_combobox.get()
+        cuantia = self.cuantia_ayuda_entry.get()
+        contextos = self.build_household_contexts(
+            hogar, codigo_ayuda, cuantia, self.valor_combobox.get(), self.payment_method_var.get(), miembros)
+        # Un único aviso para toda la familia en lugar de uno por persona
+        avisos = []
+        for numero_siria, context, _ in contextos:
+            problemas = self.roster_problems(numero_siria, con_titular=True)
+            if problemas:
+                avisos.append(f"{numero_siria}: en el Excel {problemas}.")
+            aviso = self.ledger_warnings(numero_siria, codigo_ayuda, cuantia, context) if context else ""
+            if aviso:
+                avisos.append(f"{numero_siria}: {aviso}")
+        if avisos and not messagebox.askyesno("Avisos", "\n".join(avisos) + "\n¿Generar los recibís igualmente?"):
+            return
+
+        errores = []
+        for numero_siria, context, error_message in contextos:
+            if context is None:
+                errores.append(f"{numero_siria}: {error_message}")
+                continue
+            error_message = self.submit_job(context, self.build_output_filename(context, numero_siria))
+            if error_message:
+                # Sin conversor de PDF no se puede generar ningún recibí de la familia: se avisa una sola vez
+                errores.append(error_message)
+                break
+        # Los recibís de la familia se escriben juntos al terminar de renderizarlos
+        self.save_jobs()
+        if errores:
+            messagebox.showerror("Error", "\n".join(errores))
 
     def calculate_copago(self, event=None):
         """Calculate the copago if applicable."""
-        codigo_ayuda = self.codigo_ayuda_combobox.get()
+        ayuda = self.catalogo.get(self.codigo_ayuda_combobox.get())
         
         # Verifica si la ayuda requiere copago
-        if codigo_ayuda in ["ATSANGA", "ATSANTDE"]:  # Añadido ATSANTDE aquí
+        if ayuda and ayuda.copago:
             try:
                 cuantia = float(self.cuantia_ayuda_entry.get().replace(',', '.'))
-                copago = cuantia * 0.15  # Porcentaje del copago
-                self.copago_label.config(text=f"Copago (15%): {copago:.2f}€. Introduce total factura.")
+                copago = self.catalogo.copago(ayuda.codigo, cuantia)
+                self.copago_label.config(text=f"Copago ({ayuda.copago:.0%}): {copago:.2f}€. Introduce total factura.")
             except ValueError:
                 self.copago_label.config(text="")
         else:
             # Mostrar la descripción de la ayuda si no hay copago
-            descripcion = self.codigos_ayuda_descripcion.get(codigo_ayuda, "")
-            self.copago_label.config(text=descripcion if descripcion else "")
+            self.copago_label.config(text=ayuda.descripcion if ayuda else "")
 
     def update_cuantia(self, event=None):
         """Update the cuantía entry based on the selected ayuda."""
-        print("Método update_cuantia llamado.")  # Mensaje de depuración
+        logger.debug("Método update_cuantia llamado.")
         codigo_ayuda = self.codigo_ayuda_combobox.get()
-        print(f"Seleccionado: {codigo_ayuda}")  # Para depuración
-        if codigo_ayuda in self.cuantias_predefinidas:
+        logger.debug("Seleccionado: %s", codigo_ayuda)
+        ayuda = self.catalogo.get(codigo_ayuda)
+        if ayuda and ayuda.cuantia is not None:
             self.cuantia_ayuda_entry.delete(0, tk.END)  # Limpiar el campo
-            self.cuantia_ayuda_entry.insert(0, self.cuantias_predefinidas[codigo_ayuda])  # Insertar la cuantía predefinida
-            print(f"Cuantía autocompletada: {self.cuantias_predefinidas[codigo_ayuda]}")  # Mensaje de depuración
+            self.cuantia_ayuda_entry.insert(0, ayuda.cuantia)  # Insertar la cuantía predefinida
+            logger.debug("Cuantía autocompletada: %s", ayuda.cuantia)
         else:
             self.cuantia_ayuda_entry.delete(0, tk.END)  # Limpiar el campo si no hay cuantía predefinida
-            print("No se encontr cuantía predefinida para el código de ayuda seleccionado.")  # Mensaje de depuración
+            logger.debug("No se encontró cuantía predefinida para el código de ayuda seleccionado.")
 
     def set_max_cuantia(self):
         """Set the maximum cuantía based on the selected ayuda code."""
-        codigo_ayuda = self.codigo_ayuda_combobox.get()
-        if codigo_ayuda in self.maximos_ayuda:
-            max_cuantia = self.maximos_ayuda[codigo_ayuda]
+        ayuda = self.catalogo.get(self.codigo_ayuda_combobox.get())
+        if ayuda and ayuda.maximo is not None:
+            max_cuantia = ayuda.maximo
             self.cuantia_ayuda_entry.delete(0, tk.END)  # Limpiar el campo
             self.cuantia_ayuda_entry.insert(0, max_cuantia)  # Insertar la cuantía máxima
-            print(f"Cuantía máxima autocompletada: {max_cuantia}")  # Mensaje de depuración
+            logger.debug("Cuantía máxima autocompletada: %s", max_cuantia)
             
             # Llamar a calculate_copago después de establecer la cuantía máxima
             self.calculate_copago()
 
-if __name__ == "__main__":
+def run_batch(args) -> int:
+    """Run the headless batch mode and print a summary report."""
+    inicio = time.perf_counter()
+    app = ReceiptEngine()
+    if not app.load_excel_file(args.excel):
+        return 1
+
+    try:
+        resultados = app.generate_batch(args.lote, args.salida, args.procesos, args.formato, args.combinado, args.zip,
+                                        args.omitir_incompletos)
+    except Exception as e:
+        print(f"Error: No se pudo procesar la hoja de órdenes: {str(e)}", file=sys.stderr)
+        return 1
+
+    # Resumen del lote
+    errores = print_batch_results(resultados)
+    resumen_path = write_batch_summary(resultados, args.salida)
+    if args.combinado:
+        print(f"Documento combinado para imprimir: {args.combinado}")
+    if args.zip:
+        print(f"Recibís individuales comprimidos en: {args.zip}")
+    print(f"Tiempo total: {time.perf_counter() - inicio:.1f} s")
+    print(f"Resumen guardado en: {resumen_path}")
+    return 0 if not errores else 2
+
+def print_batch_results(resultados: List[Dict]) -> int:
+    """Print how many receipts were generated, the errors and the warnings; return the number of errors."""
+    generados = [r for r in resultados if r['estado'] == 'OK']
+    errores = [r for r in resultados if r['estado'] != 'OK']
+    print(f"Recibos generados: {len(generados)} de {len(resultados)}")
+    for r in errores:
+        print(f"  Fila {r['fila']} (SIRIA {r['numero_siria']}, {r['codigo_ayuda']}): {r['error']}")
+    for r in generados:
+        if r['aviso']:
+            print(f"  Aviso fila {r['fila']} (SIRIA {r['numero_siria']}, {r['codigo_ayuda']}): {r['aviso']}")
+    return len(errores)
+
+def run_schedule(args) -> int:
+    """Generate the receipts of a recurring schedule still missing this month, resuming an interrupted run."""
+    from recibi_programacion import ScheduleRunner, load_schedules, SCHEDULES_FILENAME
+
+    inicio = time.perf_counter()
+    try:
+        programaciones = load_schedules()
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Error: No se pudo leer {SCHEDULES_FILENAME}: {str(e)}", file=sys.stderr)
+        return 1
+    if args.programacion not in programaciones:
+        print(f"Error: No existe la programación '{args.programacion}'. "
+              f"Programaciones en {SCHEDULES_FILENAME}: {', '.join(programaciones) or 'ninguna'}", file=sys.stderr)
+        return 1
+
+    app = ReceiptEngine()
+    if not app.load_excel_file(args.excel):
+        return 1
+
+    runner = ScheduleRunner(app, programaciones[args.programacion], args.periodo)
+    pendientes, cuentas = runner.plan()
+    print(f"Programación {args.programacion} ({runner.periodo}): {cuentas['elegibles']} beneficiarias/os, "
+          f"{cuentas['hechas']} ya hechos, {cuentas['emitidas_aparte']} con la ayuda ya emitida aparte, "
+          f"{cuentas['nuevas']} nuevos y {cuentas['cambiadas']} con datos cambiados")
+    if not pendientes:
+        print("No hay recibís pendientes.")
+        return 0
+
+    try:
+        resultados = runner.run(pendientes, args.salida, args.procesos, args.formato, args.omitir_incompletos,
+                                progreso=lambda hechos, total: print(f"  {hechos} de {total}", flush=True))
+    except Exception as e:
+        print(f"Error: La programación se detuvo; al volver a lanzarla seguirá donde se quedó: {str(e)}", file=sys.stderr)
+        return 1
+
+    errores = print_batch_results(resultados)
+    resumen_path = write_batch_summary(resultados, args.salida)
+    print(f"Tiempo total: {time.perf_counter() - inicio:.1f} s")
+    print(f"Resumen guardado en: {resumen_path}")
+    return 0 if not errores else 2
+
+def run_preflight(args) -> int:
+    """Print the pre-flight report of a roster workbook."""
+    app = ReceiptEngine()
+    if not app.load_excel_file(args.excel):
+        return 1
+
+    titulos = {
+        'cumplen_mayoria_este_mes': "Cumplen 18 años este mes",
+        'sin_fecha_nacimiento': "Sin fecha de nacimiento válida",
+        'titular_inexistente': "SIRIA de titular que no está en el listado",
+    }
+    for clave, filas in app.preflight_report().items():
+        print(f"{titulos[clave]}: {len(filas)}")
+        if not filas.empty:
+            print(filas.to_string(index=False))
+        print()
+
+    print(f"Con datos incompletos para el recibí: {len(app.problemas)}")
+    for numero_siria in app.problemas:
+        print(f"  {numero_siria}: {app.roster_problems(numero_siria)}")
+    return 0
+
+def run_memory_report(args) -> int:
+    """Print the memory held by each in-memory structure once the roster is loaded."""
+    app = ReceiptEngine()
+    if not app.load_excel_file(args.excel):
+        return 1
+
+    app.search_index()
+    memoria = app.memory_report()
+    print(f"Memoria con {len(app.beneficiarios)} beneficiarias/os:")
+    for estructura, bytes_usados in memoria.items():
+        print(f"  {estructura:<15} {bytes_usados / 1024 / 1024:>8.1f} MB")
+    print(f"  {'total':<15} {sum(memoria.values()) / 1024 / 1024:>8.1f} MB")
+    return 0
+
+def run_server(args) -> int:
+    """Serve receipts over HTTP until interrupted with Ctrl+C."""
+    from recibi_servidor import create_server
+
+    app = ReceiptEngine()
+    if not app.load_excel_file(args.excel):
+        return 1
+
+    server = create_server(app, args.host, args.puerto)
+    host, puerto = server.server_address[:2]
+    print(f"Servidor de recibís en http://{host}:{puerto} ({len(app.beneficiarios)} beneficiarias/os). Ctrl+C para terminar.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.service.stop()
+        server.server_close()
+    return 0
+
+def run_ledger_report(args) -> int:
+    """Print the totals per aid code of the receipts issued in a month."""
+    app = ReceiptEngine()
+    totales = app.registro.month_totals(args.registro_mes)
+    print(f"Recibís emitidos en {args.registro_mes}: {sum(t.recibos for t in totales)}")
+    for t in totales:
+        print(f"  {t.codigo_ayuda:<10} {t.recibos:>5} recibís  {t.cuantia:>10.2f} € (copago {t.copago:.2f} €, neto {t.neto:.2f} €)")
+    return 0
+
+def run_command(args, parser) -> int:
+    """Run the mode selected on the command line."""
+    if args.unir:
+        from recibi_render import merge_documents
+        if not args.archivos:
+            parser.error("--unir necesita la lista de recibís .docx a unir")
+        print(f"Recibís unidos en {args.unir}: {merge_documents(args.archivos, args.unir)}")
+        return 0
+
+    if args.informe_previo:
+        if not args.excel:
+            parser.error("--excel es obligatorio con --informe-previo")
+        return run_preflight(args)
+
+    if args.memoria:
+        if not args.excel:
+            parser.error("--excel es obligatorio con --memoria")
+        return run_memory_report(args)
+
+    if args.registro_mes:
+        return run_ledger_report(args)
+
+    if args.servidor:
+        if not args.excel:
+            parser.error("--excel es obligatorio con --servidor")
+        return run_server(args)
+
+    if args.lote:
+        if not args.excel:
+            parser.error("--excel es obligatorio con --lote")
+        return run_batch(args)
+
+    if args.programacion:
+        if not args.excel:
+            parser.error("--excel es obligatorio con --programacion")
+        return run_schedule(args)
+
     app = DocumentGenerator()
-    app.root.mainloop()
\ No newline at end of file
+    app.root.mainloop()
+    return 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generador de recibís a partir del Excel de beneficiarias/os.")
+    parser.add_argument('--lote', metavar='ORDEN', help="Hoja de órdenes (CSV o Excel) para generar recibís sin interfaz gráfica.")
+    parser.add_argument('--excel', metavar='LISTADO', help="Excel de beneficiarias/os (obligatorio con --lote).")
+    parser.add_argument('--salida', metavar='DIRECTORIO', default='.', help="Directorio donde guardar los recibís del lote.")
+    parser.add_argument('--procesos', metavar='N', type=int, default=os.cpu_count() or 1,
+                        help="Número de procesos para generar los recibís del lote (por defecto, uno por núcleo).")
+    parser.add_argument('--formato', choices=['docx', 'pdf'], default='docx',
+                        help="Formato de los recibís del lote. PDF requiere LibreOffice (o docx2pdf con Word).")
+    parser.add_argument('--combinado', metavar='DOCX',
+                        help="Además de los recibís sueltos, guardar todos los del lote en un único documento para imprimir.")
+    parser.add_argument('--zip', metavar='ZIP', help="Además, guardar los recibís del lote en un archivo ZIP.")
+    parser.add_argument('--omitir-incompletos', action='store_true',
+                        help="No generar los recibís de personas con datos incompletos en el Excel (por defecto solo se avisa).")
+    parser.add_argument('--programacion', metavar='NOMBRE',
+                        help="Generar los recibís de una ayuda periódica de programaciones.json que falten este mes.")
+    parser.add_argument('--periodo', metavar='AAAA-MM',
+                        help="Mes de la programación (por defecto, el actual).")
+    parser.add_argument('--unir', metavar='DOCX',
+                        help="Unir en un único documento los recibís .docx indicados a continuación, sin generar nada.")
+    parser.add_argument('archivos', nargs='*', help=argparse.SUPPRESS)
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='WARNING',
+                        help="Nivel de detalle de los mensajes de registro (DEBUG muestra el tiempo de cada etapa).")
+    parser.add_argument('--metricas', metavar='JSON',
+                        help="Guardar al terminar un resumen de tiempos por etapa (p50/p95), recuentos y bytes escritos.")
+    parser.add_argument('--perfil', metavar='ARCHIVO',
+                        help="Perfilar la ejecución con cProfile y guardar las estadísticas en ARCHIVO.")
+    parser.add_argument('--informe-previo', action='store_true',
+                        help="Mostrar las filas del Excel que requieren atención (mayoría de edad, fechas, titulares, datos incompletos).")
+    parser.add_argument('--memoria', action='store_true',
+                        help="Mostrar la memoria que ocupan el listado, los índices y la caché una vez cargado el Excel.")
+    parser.add_argument('--servidor', action='store_true',
+                        help="Servir los recibís por HTTP (POST /recibi con JSON) con el Excel y la plantilla cargados una vez.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Dirección donde escucha el servidor (por defecto, solo este equipo).")
+    parser.add_argument('--puerto', type=int, default=8765, help="Puerto del servidor (por defecto, 8765).")
+    parser.add_argument('--registro-mes', metavar='AAAA-MM',
+                        help="Mostrar los totales por código de ayuda de los recibís emitidos ese mes.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s %(message)s")
+
+    perfil = cProfile.Profile() if args.perfil else None
+    if perfil:
+        perfil.enable()
+    try:
+        return run_command(args, parser)
+    finally:
+        if perfil:
+            perfil.disable()
+            perfil.dump_stats(args.perfil)
+            pstats.Stats(perfil).sort_stats('cumulative').print_stats(20)
+        if args.metricas:
+            instrumentation.export_json(args.metricas)
+
+if __name__ == "__main__":
+    # En el ejecutable de PyInstaller los procesos de render vuelven a lanzar el programa
+    multiprocessing.freeze_support()
+    sys.exit(main())
\ No newline at end of file
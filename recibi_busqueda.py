@@ -0,0 +1,419 @@
+"""In-memory search over the roster by SIRIA, NIE, NOMBRE and APELLIDOS, for search-as-you-type."""
+import re
+import math
+import bisect
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Los grupos de cifras se indexan de 4 en 4 (0000-9999) y el resto de caracteres en trigramas
+CIFRAS_GRUPO = 4
+GRUPOS_CIFRAS = 10 ** CIFRAS_GRUPO
+TRAMOS = re.compile(r'([0-9]+)')
+LETRAS = re.compile(r'[^0-9]{3,}')
+# Con los trigramas del principio y del final de la palabra (con espacios, que no aparecen en ninguna palabra)
+# una errata al principio o al final cuenta igual que una en medio
+MARGEN = '  '
+
+def fold(texto) -> str:
+    """Uppercase text without accents, as used for both the index and the queries."""
+    texto = str(texto)
+    if texto.isascii():
+        return texto.upper()
+    texto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in texto if not unicodedata.combining(c)).upper()
+
+def as_text(valor) -> str:
+    """Roster cell as text; empty cells (None or NaN) become ''."""
+    if valor is None or (isinstance(valor, float) and math.isnan(valor)):
+        return ''
+    return str(valor)
+
+def trigrams(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def edge_trigrams(palabra: str) -> Set[str]:
+    """Trigrams of the word with the start and end marked, for the typo search."""
+    return trigrams(f"{MARGEN}{palabra}{MARGEN}")
+
+def substring_grams(texto: str) -> Tuple[Set[str], Set[int]]:
+    """Trigrams of the runs without digits and groups of CIFRAS_GRUPO digits (as numbers) of the runs of digits.
+
+    Every word that contains texto has all of them.
+    """
+    if texto.isdigit() and texto.isascii():
+        return set(), {int(texto[i:i + CIFRAS_GRUPO]) for i in range(len(texto) - CIFRAS_GRUPO + 1)}
+    # Con paréntesis en la expresión, split alterna los tramos sin cifras (pares) y los de cifras (impares)
+    tramos = TRAMOS.split(texto)
+    letras = {tramo[i:i + 3] for tramo in tramos[::2] for i in range(len(tramo) - 2)}
+    cifras = {int(tramo[i:i + CIFRAS_GRUPO]) for tramo in tramos[1::2] for i in range(len(tramo) - CIFRAS_GRUPO + 1)}
+    return letras, cifras
+
+def edit_distance(a: str, b: str, maximo: int) -> int:
+    """Insertions, deletions, substitutions and swaps of adjacent letters to turn a into b; maximo + 1 if more."""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    anterior2: List[int] = []
+    anterior = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        fila = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            fila[j] = min(anterior[j] + 1, fila[j - 1] + 1, anterior[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                fila[j] = min(fila[j], anterior2[j - 2] + 1)
+        if min(fila) > maximo:
+            return maximo + 1
+        anterior2, anterior = anterior, fila
+    return min(anterior[-1], maximo + 1)
+
+def sorted_contains(lista: array, valor: int) -> bool:
+    i = bisect.bisect_left(lista, valor)
+    return i < len(lista) and lista[i] == valor
+
+class Words:
+    """Sorted words stored in one string separated by newlines, with the offset where each one starts.
+
+    Works as a read-only list of the words for bisect, without one Python
+    string per word.
+    """
+
+    def __init__(self, palabras: List[str]):
+        self.texto = '\n'.join(palabras)
+        self.inicios = array('i')
+        inicio = 0
+        for palabra in palabras:
+            self.inicios.append(inicio)
+            inicio += len(palabra) + 1
+        self.inicios.append(inicio)
+
+    def __len__(self) -> int:
+        return len(self.inicios) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.texto[self.inicios[i]:self.inicios[i + 1] - 1]
+
+    def position(self, offset: int) -> int:
+        """Index of the word that contains the character at offset of self.texto."""
+        return bisect.bisect_right(self.inicios, offset) - 1
+
+class SearchIndex:
+    """Prefix, substring and typo index over the words of each beneficiary.
+
+    Every distinct word (SIRIA, NIE, each word of the name and surnames) is
+    stored once, sorted, in a single string (Words) and keeps the rows it
+    appears in. Words starting with a term are a bisect range. Words
+    containing it come from n-gram postings: the trigrams of the runs
+    without digits and the groups of 4 digits of each word, so a term is
+    only compared with the words that have its rarest n-gram; only terms
+    too short to have one (2 letters, 3 digits) are looked for with
+    str.find over that string. Words of letters only (names) also have the
+    trigrams of their start and end, so a surname typed with a typo still
+    finds the person.
+
+    The rows of each word, the words of each row and the words of each
+    n-gram are kept in flat arrays of integers, with the offsets where each
+    list starts, instead of one Python list per word, row or n-gram.
+    """
+
+    # Los demás términos de la consulta se comprueban con un conjunto de sus filas si no tienen más de
+    # este número de veces las filas que se espera que queden con los anteriores; si no, fila a fila
+    FILAS_POR_FILA_PREVISTA = 16
+
+    def __init__(self, filas: Iterable[Tuple[str, str, str, str]]):
+        """Build the index from (numero_siria, nombre, apellidos, nie) rows of text."""
+        self.sirias: List[str] = []
+        palabras_de_fila: List[Set[str]] = []
+        palabras: Dict[str, List[int]] = {}
+        for numero_siria, nombre, apellidos, nie in filas:
+            fila = len(self.sirias)
+            self.sirias.append(numero_siria)
+            palabras_de_fila.append(set(f"{numero_siria} {fold(nie).replace(' ', '')} {fold(nombre)} {fold(apellidos)}".split()))
+            for palabra in palabras_de_fila[-1]:
+                palabras.setdefault(palabra, []).append(fila)
+
+        ordenadas = sorted(palabras)
+
+        # Filas de la palabra i: filas_palabra[inicio_filas[i]:inicio_filas[i + 1]]
+        self.filas_palabra = array('i')
+        self.inicio_filas = array('i', [0])
+        for palabra in ordenadas:
+            self.filas_palabra.extend(palabras[palabra])
+            self.inicio_filas.append(len(self.filas_palabra))
+        del palabras
+
+        # Palabras de la fila f: palabras_fila[inicio_palabras[f]:inicio_palabras[f + 1]]
+        posicion = {palabra: i for i, palabra in enumerate(ordenadas)}
+        self.palabras_fila = array('i')
+        self.inicio_palabras = array('i', [0])
+        for fila in palabras_de_fila:
+            self.palabras_fila.extend([posicion[palabra] for palabra in fila])
+            self.inicio_palabras.append(len(self.palabras_fila))
+        del palabras_de_fila, posicion
+
+        self.palabras = Words(ordenadas)
+
+        # Palabras de cada trigrama, en orden
+        por_trigrama: Dict[str, List[int]] = defaultdict(list)
+        for i, palabra in enumerate(ordenadas):
+            if palabra.isalpha():
+                # Incluyen todos los trigramas de dentro de la palabra
+                letras = edge_trigrams(palabra)
+            else:
+                letras = {tramo[j:j + 3] for tramo in LETRAS.findall(palabra) for j in range(len(tramo) - 2)}
+            for trigrama in letras:
+                por_trigrama[trigrama].append(i)
+
+        # Palabras del trigrama t: palabras_trigrama[inicio_trigrama[k]:inicio_trigrama[k + 1]], k = trigramas[t]
+        self.trigramas: Dict[str, int] = {}
+        self.palabras_trigrama = array('i')
+        self.inicio_trigrama = array('i', [0])
+        for trigrama, lista in por_trigrama.items():
+            self.trigramas[trigrama] = len(self.trigramas)
+            self.palabras_trigrama.extend(lista)
+            self.inicio_trigrama.append(len(self.palabras_trigrama))
+        del por_trigrama
+
+        # Palabras del grupo de cifras g: palabras_grupo[inicio_grupo[g]:inicio_grupo[g + 1]]
+        self.palabras_grupo, self.inicio_grupo = self.digit_groups(self.palabras)
+
+    @staticmethod
+    def digit_groups(palabras: Words) -> Tuple[array, array]:
+        """Words of each group of CIFRAS_GRUPO consecutive digits, computed with numpy over the whole text at once."""
+        import numpy as np
+
+        caracteres = np.frombuffer(palabras.texto.encode('utf-32-le'), dtype='<u4')
+        cifras = caracteres.astype(np.int64) - ord('0')
+        es_cifra = (cifras >= 0) & (cifras <= 9)
+        n = max(len(caracteres) - CIFRAS_GRUPO + 1, 0)
+        completo = np.ones(n, dtype=bool)
+        grupos = np.zeros(n, dtype=np.int64)
+        for k in range(CIFRAS_GRUPO):
+            completo &= es_cifra[k:k + n]
+            grupos = grupos * 10 + cifras[k:k + n]
+        posiciones = np.flatnonzero(completo)
+        inicios = np.frombuffer(palabras.inicios, dtype=np.intc)
+        de_palabra = np.searchsorted(inicios, posiciones, side='right') - 1
+        # Cada palabra una sola vez por grupo, ordenadas por grupo y después por palabra
+        claves = np.sort(grupos[posiciones] * len(inicios) + de_palabra)
+        claves = claves[np.diff(claves, prepend=-1) != 0]
+        grupo, palabra = np.divmod(claves, len(inicios))
+        inicio_grupo = np.searchsorted(grupo, np.arange(GRUPOS_CIFRAS + 1))
+        return array('i', palabra.astype(np.intc).tobytes()), array('i', inicio_grupo.astype(np.intc).tobytes())
+
+    @classmethod
+    def from_roster(cls, filas) -> 'SearchIndex':
+        """Build the index from (SIRIA, nombre, apellidos, NIE) roster values; like the roster store, a repeated SIRIA keeps its first row."""
+        vistas = set()
+        textos = []
+        for siria, nombre, apellidos, nie in filas:
+            if siria and siria not in vistas:
+                vistas.add(siria)
+                textos.append((siria, as_text(nombre), as_text(apellidos), as_text(nie)))
+        return cls(textos)
+
+    def __len__(self) -> int:
+        return len(self.sirias)
+
+    def word_rows(self, i: int) -> array:
+        return self.filas_palabra[self.inicio_filas[i]:self.inicio_filas[i + 1]]
+
+    def row_words(self, fila: int) -> array:
+        return self.palabras_fila[self.inicio_palabras[fila]:self.inicio_palabras[fila + 1]]
+
+    def trigram_words(self, trigrama: str) -> array:
+        k = self.trigramas.get(trigrama)
+        if k is None:
+            return array('i')
+        return self.palabras_trigrama[self.inicio_trigrama[k]:self.inicio_trigrama[k + 1]]
+
+    def group_words(self, grupo: int) -> array:
+        return self.palabras_grupo[self.inicio_grupo[grupo]:self.inicio_grupo[grupo + 1]]
+
+    def prefix_words(self, termino: str) -> range:
+        """Positions in self.palabras of the words that start with termino."""
+        inicio = bisect.bisect_left(self.palabras, termino)
+        fin = bisect.bisect_left(self.palabras, termino + '\uffff', inicio)
+        return range(inicio, fin)
+
+    def gram_candidates(self, termino: str) -> Optional[array]:
+        """Words that have the rarest n-gram of termino, in order; None if termino is too short to have one."""
+        letras, cifras = substring_grams(termino)
+        listas = [self.trigram_words(trigrama) for trigrama in letras] + [self.group_words(grupo) for grupo in cifras]
+        if not listas:
+            return None
+        return min(listas, key=len)
+
+    def containing_words(self, termino: str) -> Iterator[int]:
+        """Yield, lazily and in order, the words that contain termino without starting with it."""
+        candidatas = self.gram_candidates(termino)
+        if candidatas is not None:
+            for i in candidatas:
+                palabra = self.palabras[i]
+                if termino in palabra and not palabra.startswith(termino):
+                    yield i
+            return
+
+        texto, inicios = self.palabras.texto, self.palabras.inicios
+        posicion = texto.find(termino)
+        while posicion != -1:
+            i = self.palabras.position(posicion)
+            if inicios[i] != posicion:
+                yield i
+            # Seguir a partir de la palabra siguiente
+            posicion = texto.find(termino, inicios[i + 1])
+
+    def similar_words(self, termino: str) -> List[int]:
+        """Words of letters only at most 1 edit away from termino (2 from 8 letters on), closest first.
+
+        A word k edits away still shares all but 3k of the start and end
+        marked trigrams, so it is in one of the rarest of their lists: only
+        the words of those are counted in the others and compared.
+        """
+        maximo = 1 if len(termino) < 8 else 2
+        listas = sorted((self.trigram_words(trigrama) for trigrama in edge_trigrams(termino)), key=len)
+        minimo = max(1, len(listas) - 3 * maximo)
+        raras, comunes = listas[:len(listas) - minimo + 1], listas[len(listas) - minimo + 1:]
+        votos = Counter(chain.from_iterable(raras))
+        for lista in comunes:
+            if len(votos) * 16 < len(lista):
+                # Pocas palabras que contar: se buscan en la lista, que está ordenada
+                votos.update([i for i in votos if sorted_contains(lista, i)])
+            else:
+                votos.update(votos.keys() & lista)
+        distancias = []
+        for i, n in votos.items():
+            if n >= minimo:
+                distancia = edit_distance(termino, self.palabras[i], maximo)
+                if distancia <= maximo:
+                    distancias.append((distancia, i))
+        return [i for _, i in sorted(distancias)]
+
+    def fallback_words(self, termino: str) -> Optional[List[int]]:
+        """None if some word starts with or contains termino; otherwise the words similar to it, maybe none."""
+        if self.prefix_words(termino) or next(self.containing_words(termino), None) is not None:
+            return None
+        return self.similar_words(termino) if len(termino) >= 4 and termino.isalpha() else []
+
+    def candidate_words(self, termino: str, similares: Optional[List[int]]) -> Iterator[int]:
+        """Yield the words matching termino, best first: starting with it, containing it, then similar to it.
+
+        When a word is exactly termino (e.g. a full SIRIA number) the words
+        that only contain it are left out, and similar words are only used
+        when no word contains termino.
+        """
+        if similares is not None:
+            yield from similares
+            return
+        prefijo = self.prefix_words(termino)
+        yield from prefijo
+        if not prefijo or self.palabras[prefijo[0]] != termino:
+            yield from self.containing_words(termino)
+
+    def estimate_rows(self, termino: str, similares: Optional[List[int]]) -> int:
+        """Rows of the words starting with termino, or of its similar words; if only other words contain it,
+        the words with its rarest n-gram, or all rows when it has none."""
+        if similares is not None:
+            return sum(self.inicio_filas[i + 1] - self.inicio_filas[i] for i in similares)
+        prefijo = self.prefix_words(termino)
+        filas = self.inicio_filas[prefijo.stop] - self.inicio_filas[prefijo.start]
+        if filas:
+            return filas
+        candidatas = self.gram_candidates(termino)
+        return len(self.sirias) if candidatas is None else len(candidatas)
+
+    def term_words(self, termino: str, similares: Optional[List[int]], tope: int) -> Optional[Set[int]]:
+        """Words that contain termino or, when similares is given, those words.
+
+        None if finding them would mean comparing termino with more than
+        tope words, or with every word (termino has no n-gram).
+        """
+        if similares is not None:
+            return set(similares)
+        candidatas = self.gram_candidates(termino)
+        if candidatas is None or len(candidatas) > tope:
+            return None
+        return {i for i in candidatas if termino in self.palabras[i]}
+
+    def term_rows(self, palabras: Set[int], tope: int) -> Optional[Set[int]]:
+        """Rows with one of the words; None if there are more than tope of them."""
+        filas: Set[int] = set()
+        for i in palabras:
+            filas.update(self.word_rows(i))
+            if len(filas) > tope:
+                return None
+        return filas
+
+    def row_matches(self, fila: int, termino: str, palabras: Optional[Set[int]]) -> bool:
+        """Whether the row has one of the words of termino (see term_words), or a word that contains it if unknown."""
+        if palabras is None:
+            return any(termino in self.palabras[i] for i in self.row_words(fila))
+        return not palabras.isdisjoint(self.row_words(fila))
+
+    def new_rows(self, i: int, vistas: Set[int], conjuntos: List[Set[int]]) -> Iterator[int]:
+        """Yield in order the rows of word i not in vistas that are in every set of conjuntos, adding them to vistas."""
+        if conjuntos:
+            # Se cruzan de una vez con los conjuntos de los demás términos
+            filas = set(self.word_rows(i))
+            filas -= vistas
+            vistas |= filas
+            yield from sorted(filas.intersection(*conjuntos))
+            return
+        for fila in self.word_rows(i):
+            if fila not in vistas:
+                vistas.add(fila)
+                yield fila
+
+    def search(self, consulta: str, limite: int = 10) -> List[str]:
+        """Return up to limite SIRIA numbers whose words match every word of the query.
+
+        Rows come from the most selective term, in the order of
+        candidate_words, and are kept if every other term is part of one of
+        their words: the rows of each candidate word are intersected at once
+        with the sets of rows of the terms that have few compared with the
+        rows expected to be left by the terms before them, and only the
+        other terms are checked against the words of the row. The search
+        stops as soon as limite rows are found.
+        """
+        terminos = fold(consulta).replace(',', ' ').split()
+        if not terminos:
+            return []
+
+        similares = {termino: self.fallback_words(termino) for termino in terminos}
+        if any(palabras is not None and not palabras for palabras in similares.values()):
+            return []
+
+        estimaciones = {termino: self.estimate_rows(termino, similares[termino]) for termino in terminos}
+        terminos.sort(key=estimaciones.get)
+        principal = terminos[0]
+        conjuntos: List[Set[int]] = []
+        fila_a_fila = []
+        # Filas del término principal que se espera recorrer hasta encontrar limite, como si los términos
+        # fuesen independientes; cada término las deja en la parte de las filas que tiene
+        total = max(len(self.sirias), 1)
+        previstas = float(limite)
+        for termino in terminos[1:]:
+            previstas *= total / max(estimaciones[termino], 1)
+        previstas = min(previstas, estimaciones[principal])
+        for termino in terminos[1:]:
+            tope = int(max(limite, previstas) * self.FILAS_POR_FILA_PREVISTA)
+            palabras = self.term_words(termino, similares[termino], tope)
+            filas = None
+            if palabras is not None and estimaciones[termino] <= tope:
+                filas = self.term_rows(palabras, tope)
+            if filas is None:
+                fila_a_fila.append((termino, palabras))
+            else:
+                conjuntos.append(filas)
+            previstas = previstas * estimaciones[termino] / total
+
+        encontradas = []
+        vistas: Set[int] = set()
+        for i in self.candidate_words(principal, similares[principal]):
+            for fila in self.new_rows(i, vistas, conjuntos):
+                if all(self.row_matches(fila, termino, palabras) for termino, palabras in fila_a_fila):
+                    encontradas.append(self.sirias[fila])
+                    if len(encontradas) == limite:
+                        return encontradas
+        return encontradas
@@ -0,0 +1,1747 @@
+"""Receipt engine without GUI: roster store, aid catalog, context builder and render entry points.
+
+pandas, openpyxl and the docxtpl renderer (recibi_render) are imported the
+first time they are needed, so importing this module is cheap.
+"""
+from __future__ import annotations
+
+import os
+import re
+import io
+import sys
+import json
+import math
+import calendar
+import time
+import locale
+import pickle
+import random
+import logging
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import unicodedata
+from array import array
+from datetime import datetime
+from types import MappingProxyType
+from functools import lru_cache
+from itertools import accumulate
+from contextlib import contextmanager
+from collections import OrderedDict, Counter
+from typing import Tuple, Dict, Optional, List, NamedTuple, Any, TYPE_CHECKING
+
+from recibi_registro import ReceiptLedger, LEDGER_FILENAME
+from recibi_busqueda import SearchIndex
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger("generar_recibi")
+
+def preload_dependencies():
+    """Import the heavy dependencies ahead of time, e.g. in a background thread while the GUI starts."""
+    import pandas  # noqa: F401
+    import openpyxl  # noqa: F401
+    import recibi_render  # noqa: F401
+
+# Columnas aceptadas en la hoja de órdenes del modo por lotes (sin tildes ni mayúsculas)
+COLUMNAS_ORDEN = {
+    'numero_siria': ('N SIRIA', 'SIRIA', 'N SIRIA BENEFICIARIA/O'),
+    'codigo_ayuda': ('CODIGO AYUDA', 'CODIGO DE AYUDA', 'CODIGO'),
+    'cuantia': ('CUANTIA', 'CUANTIA AYUDA', 'CUANTIA DE AYUDA', 'IMPORTE'),
+    'profesional': ('PROFESIONAL',),
+    'metodo_pago': ('METODO PAGO', 'METODO DE PAGO'),
+    'numero_siria_titular': ('N SIRIA TITULAR', 'SIRIA TITULAR'),
+}
+
+def normalize_header(header) -> str:
+    """Normalizar una cabecera: mayúsculas, sin tildes y sin espacios repetidos."""
+    texto = unicodedata.normalize('NFKD', str(header).replace('º', ''))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.upper().split())
+
+def normalize_siria(value) -> str:
+    """Normalize a SIRIA number read from Excel or typed by the user ('12345.0', ' 12 345' -> '12345')."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    texto = str(value).strip().replace(" ", "")
+    if re.fullmatch(r"\d+\.0+", texto):
+        texto = texto.split('.')[0]
+    return texto
+
+class Beneficiario(NamedTuple):
+    """Compact record of a roster row with the values needed to build a receipt."""
+    nombre: Any
+    apellidos: Any
+    nie: Any
+    caducidad_nie: Any
+    numero_siria: str
+    numero_siria_uc: Any
+    numero_siria_uf: Any
+    siria_titular: Optional[str]
+    oar: Any
+    fecha_nacimiento: Any
+    fecha_nacimiento_str: Any
+    edad: Optional[int]
+    es_menor: bool
+    tipo_proteccion: Any
+
+class Hogar(NamedTuple):
+    """Family unit of the roster: everyone sharing a unidad convivencial or, failing that, a titular."""
+    clave: str
+    numero_siria_uc: str
+    numero_siria_titular: Optional[str]
+    miembros: Tuple[str, ...]  # SIRIA del titular primero, después los adultos y por último los menores
+
+@contextmanager
+def measure(tiempos: Dict[str, float], etapa: str):
+    """Store in tiempos[etapa] the seconds spent in the block."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tiempos[etapa] = time.perf_counter() - inicio
+
+class StageStats:
+    """Count, total and maximum of a stage's timings, with a bounded random sample of them for percentiles.
+
+    The sample is a reservoir: every timing has the same chance of being in
+    it, so memory stays fixed however long the window or the server runs.
+    """
+    __slots__ = ('n', 'total', 'maximo', 'muestra')
+
+    MUESTRA_MAX = 1024
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.muestra: List[float] = []
+
+    def add(self, segundos: float, azar: random.Random):
+        self.n += 1
+        self.total += segundos
+        self.maximo = max(self.maximo, segundos)
+        if len(self.muestra) < self.MUESTRA_MAX:
+            self.muestra.append(segundos)
+        else:
+            posicion = azar.randrange(self.n)
+            if posicion < self.MUESTRA_MAX:
+                self.muestra[posicion] = segundos
+
+class Instrumentation:
+    """Per-stage timers, counters and bytes written during a run of the program."""
+
+    def __init__(self):
+        self.inicio = datetime.now()
+        self.tiempos: Dict[str, StageStats] = {}
+        self.azar = random.Random()
+        self.bytes_escritos = 0
+        self.documentos = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, etapa: str):
+        """Time a block of code under the given stage name."""
+        tiempos = {}
+        try:
+            with measure(tiempos, etapa):
+                yield
+        finally:
+            self.add(tiempos)
+
+    def add(self, tiempos: Dict[str, float], bytes_escritos: int = 0):
+        """Record stage timings measured elsewhere (e.g. in a worker process)."""
+        with self.lock:
+            for etapa, segundos in tiempos.items():
+                if etapa not in self.tiempos:
+                    self.tiempos[etapa] = StageStats()
+                self.tiempos[etapa].add(segundos, self.azar)
+                logger.debug("%s: %.1f ms", etapa, segundos * 1000)
+            if bytes_escritos:
+                self.bytes_escritos += bytes_escritos
+                self.documentos += 1
+
+    @staticmethod
+    def percentile(valores: List[float], p: float) -> float:
+        """Nearest-rank percentile of a non-empty list."""
+        ordenados = sorted(valores)
+        return ordenados[max(0, math.ceil(p * len(ordenados)) - 1)]
+
+    def summary(self) -> Dict:
+        """Return counts, totals and p50/p95/max latencies per stage; p50/p95 are estimated from a sample (StageStats)."""
+        with self.lock:
+            etapas = {
+                etapa: {
+                    'n': stats.n,
+                    'total_s': round(stats.total, 4),
+                    'p50_ms': round(self.percentile(stats.muestra, 0.50) * 1000, 3),
+                    'p95_ms': round(self.percentile(stats.muestra, 0.95) * 1000, 3),
+                    'max_ms': round(stats.maximo * 1000, 3),
+                }
+                for etapa, stats in self.tiempos.items()
+            }
+            return {
+                'inicio': self.inicio.isoformat(timespec='seconds'),
+                'duracion_s': round((datetime.now() - self.inicio).total_seconds(), 3),
+                'documentos': self.documentos,
+                'bytes_escritos': self.bytes_escritos,
+                'etapas': etapas,
+            }
+
+    def export_json(self, path: str):
+        """Write the run summary to a JSON file."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+# Métricas del proceso actual
+instrumentation = Instrumentation()
+
+# Catálogo de ayudas por defecto: código, descripción, cuantía predefinida, máximo y porcentaje de copago.
+# Se puede sustituir con un archivo ayudas.json junto al programa (ver AidCatalog.from_file).
+class Ayuda(NamedTuple):
+    """Aid catalog entry."""
+    codigo: str
+    descripcion: str
+    cuantia: Optional[float]
+    maximo: Optional[float]
+    copago: float
+
+AYUDAS_PREDEFINIDAS = (
+    Ayuda("1FGBI", "Gastos de bolsillo", 56, 56, 0),
+    Ayuda("1FGBM", "Gastos de bolsillo menores 18 años", 22, 22, 0),
+    Ayuda("1FMI", "Manutención UC 1", 226, 226, 0),
+    Ayuda("1FMUC2", "Manutención UC 2", 338, 338, 0),
+    Ayuda("1FMUC3", "Manutención UC 3", 362, 362, 0),
+    Ayuda("1FMUC4", "Manutención UC 4", 386, 386, 0),
+    Ayuda("1FMUC5", "Manutención UC 5", 454, 454, 0),
+    Ayuda("1FMUC6", "Manutención UC 6", 504, 504, 0),
+    Ayuda("1FMUC7", "Manutención UC 7", 555, 555, 0),
+    Ayuda("1FMUC8", "Manutención UC 8", 604, 604, 0),
+    Ayuda("1FMUC9", "Manutención UC 9 o más", 654, 654, 0),
+    Ayuda("ATNH", "Nacimiento hijos/as", 201, 201, 0),
+    Ayuda("ATSANMED", "Medicamentos", None, None, 0),
+    Ayuda("ATSANGA", "Gafas", 200, 200, 0.15),
+    Ayuda("ATSANMO", "Material ortoprotésico", None, None, 0),
+    Ayuda("ATSANTDE", "Tratamientos dentales", 400, 400, 0.15),
+    Ayuda("ATSANPR", "Prótesis dentales removibles", None, None, 0),
+    Ayuda("ATVES", "Adquisición vestuario", 100, 100, 0),
+    Ayuda("ATTPINCO", "Transporte Incorporación dispositivo", None, None, 0),
+    Ayuda("ATTPTIN", "Transporte Intraprovincial", None, None, 0),
+    Ayuda("ATTPTEXT", "Transporte Intraprovincial", None, None, 0),
+    Ayuda("ATTPTEXA", "Transporte Intraprovincial", None, None, 0),
+    Ayuda("ATTPTEXM", "Transporte Intraprovincial", None, None, 0),
+    Ayuda("ATEDUGUME", "Guardería Mensualidad", None, None, 0),
+    Ayuda("ATEDUGUMA", "Guardería Matrícula", None, None, 0),
+    Ayuda("ATEDURMA", "Educación reglada Matrícula", None, None, 0),
+    Ayuda("ATEDURMATE", "Educación reglada Material escolar", 279, 279, 0),
+    Ayuda("ATEDURUNI", "Educación reglada Uniformes escolares", None, None, 0),
+    Ayuda("ATEDURCOM", "Educación reglada Comedor escolar", None, None, 0),
+    Ayuda("ATEDUREXTR", "Educación reglada Actividades extraescolares", 33, 33, 0),
+    Ayuda("ATEDURTPT", "Educación reglada Transporte escolar", None, None, 0),
+    Ayuda("ATEDURSEO", "Educación reglada Seguro escolar obligatorio", None, None, 0),
+    Ayuda("ATEDURAMPA", "Educación reglada AMPA", None, None, 0),
+    Ayuda("ATCONMM", "Contextualiz y habilidades sociales Matrícula y/o mensualidades", 600, 600, 0),
+    Ayuda("ATCONMAT", "Contextualiz y habilidades sociales Material didáctico", 100, 100, 0),
+    Ayuda("ATOCCAMP", "Campamentos de verano infantil y juvenil", 223, 223, 0),
+    Ayuda("ATDOCU", "Obtención de documentos", None, None, 0),
+    Ayuda("ATREADOCU", "Reagrupación familiar Obtención de documentos", None, None, 0),
+    Ayuda("ATREALLEG", "Reagrupación familiar Viajes, traslados, estancias para llegar a España", None, None, 0),
+    Ayuda("ATREAESTA", "Reagrupación familiar Viajes, traslados, estancias en España", None, None, 0),
+    Ayuda("ATEMPEDUGUME", "Empleo Facilitar formación Mensualidad guardería", None, None, 0),
+    Ayuda("ATEMPEDUGUMA", "Empleo Facilitar formación Matrícula de guardería", None, None, 0),
+    Ayuda("ATEMPEDUCOM", "Empleo Facilitar formación Comedor escolar", None, None, 0),
+    Ayuda("ATPREMAME", "Empleo Preformación Matrícula y/o mensualidades", 1364, 1364, 0),
+    Ayuda("ATPREMAT", "Empleo Preformación Material didáctico", 250, 250, 0),
+    Ayuda("ATFORMAME", "Empleo Formación ocupacional Matrícula y/o mensualidades", 1364, 1364, 0),
+    Ayuda("ATFORMAT", "Empleo Formación ocupacional Material didáctico para la formación", 250, 250, 0),
+    Ayuda("ATTPT", "Empleo Transporte asistencia cursos o búsqueda empleo", None, None, 0),
+    Ayuda("ATEHT", "Empleo Obtención documentos (expedición, homologación, tramitación…)", None, None, 0),
+    Ayuda("2FNB1", "Necesidades básicas UC1", 466, 466, 0),
+    Ayuda("2FNB2", "Necesidades básicas UC2", 692, 692, 0),
+    Ayuda("2FNB3", "Necesidades básicas UC3", 758, 758, 0),
+    Ayuda("2FNB4", "Necesidades básicas UC4", 825, 825, 0),
+    Ayuda("2FNB5", "Necesidades básicas UC5", 891, 891, 0),
+    Ayuda("2FNB6", "Necesidades básicas UC6", 958, 958, 0),
+    Ayuda("2FNB7", "Necesidades básicas UC7", 1024, 1024, 0),
+    Ayuda("2FNB8", "Necesidades básicas UC8", 1091, 1091, 0),
+    Ayuda("2FNB9", "Necesidades básicas UC9 o más", 1157, 1157, 0),
+    Ayuda("2FAV1", "Alquiler UC1", 445, 445, 0),
+    Ayuda("2FAV2", "Alquiler UC2", 578, 578, 0),
+    Ayuda("2FAV3", "Alquiler UC3", 668, 668, 0),
+    Ayuda("2FAV4", "Alquiler UC4", 758, 758, 0),
+    Ayuda("2FAV5", "Alquiler UC5", 848, 848, 0),
+    Ayuda("2FAV6", "Alquiler UC6", 848, 848, 0),
+    Ayuda("2FAV7", "Alquiler UC7", 848, 848, 0),
+    Ayuda("2FAV8", "Alquiler UC8", 923, 923, 0),
+    Ayuda("2FAV9", "Alquiler UC9 o más", 923, 923, 0),
+)
+
+AIDS_FILENAME = "ayudas.json"
+
+def parse_amount(valor) -> Optional[float]:
+    """Number from an aid catalog entry, which may be written as text with a decimal comma ("56,00"); None if empty.
+
+    Whole amounts are kept as int so they are shown as in the built-in catalog ("56", not "56.0").
+    """
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, bool):
+        raise ValueError(valor)
+    if isinstance(valor, str):
+        valor = float(valor.strip().replace(',', '.'))
+    valor = float(valor)
+    if not math.isfinite(valor):
+        raise ValueError(valor)
+    return int(valor) if valor.is_integer() else valor
+
+class AidCatalog:
+    """Immutable catalog of aid codes with O(1) lookup, validation and copago calculation."""
+    __slots__ = ('_ayudas',)
+
+    def __init__(self, ayudas):
+        self._ayudas = MappingProxyType({ayuda.codigo: ayuda for ayuda in ayudas})
+
+    @classmethod
+    def from_file(cls, path: str) -> 'AidCatalog':
+        """Load the catalog from a JSON list of {codigo, descripcion, cuantia, maximo, copago} objects."""
+        with open(path, encoding='utf-8') as f:
+            entradas = json.load(f)
+        ayudas = []
+        for entrada in entradas:
+            if not entrada.get('codigo') or not entrada.get('descripcion'):
+                raise ValueError(f"Entrada sin código o descripción en {path}: {entrada}")
+            try:
+                cuantia, maximo, copago = (parse_amount(entrada.get(campo)) for campo in ('cuantia', 'maximo', 'copago'))
+            except ValueError:
+                raise ValueError(f"Cuantía, máximo o copago no numérico en {path}: {entrada}") from None
+            ayudas.append(Ayuda(
+                codigo=str(entrada['codigo']).strip().upper(),
+                descripcion=str(entrada['descripcion']),
+                cuantia=cuantia,
+                maximo=maximo,
+                copago=copago or 0,
+            ))
+        return cls(ayudas)
+
+    def __contains__(self, codigo) -> bool:
+        return codigo in self._ayudas
+
+    def __iter__(self):
+        return iter(self._ayudas.values())
+
+    def __len__(self) -> int:
+        return len(self._ayudas)
+
+    def get(self, codigo: str) -> Optional[Ayuda]:
+        return self._ayudas.get(codigo)
+
+    def codes(self) -> List[str]:
+        return list(self._ayudas)
+
+    def validate_amount(self, codigo: str, cuantia: float) -> str:
+        """Return an error message if the code is unknown or the amount exceeds its maximum, or ''."""
+        ayuda = self._ayudas.get(codigo)
+        if ayuda is None:
+            return f"El código de ayuda {codigo} no existe."
+        if ayuda.maximo is not None and cuantia > ayuda.maximo:
+            return f"La cuantía para la ayuda {codigo} no puede superar los {ayuda.maximo} euros."
+        return ""
+
+    def copago(self, codigo: str, cuantia: float) -> float:
+        """Return the copago owed for the amount, 0 when the aid has none."""
+        ayuda = self._ayudas.get(codigo)
+        return cuantia * ayuda.copago if ayuda else 0.0
+
+def program_dir() -> str:
+    """Directory of the script, or of the executable when packaged with PyInstaller."""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def load_aid_catalog(path: Optional[str] = None) -> AidCatalog:
+    """Load the aid catalog from ayudas.json next to the program if it exists, else the built-in one."""
+    path = path or os.path.join(program_dir(), AIDS_FILENAME)
+    if os.path.exists(path):
+        return AidCatalog.from_file(path)
+    return AidCatalog(AYUDAS_PREDEFINIDAS)
+
+# Versión del formato de la instantánea del Excel; cambiarla invalida las instantáneas anteriores
+SNAPSHOT_VERSION = 2
+
+# Columnas del listado que se usan para generar los recibís
+COLUMNAS_ROSTER = (
+    'NOMBRE',
+    'APELLIDOS',
+    'NÚMERO NIE',
+    'CADUCIDAD NIE ',
+    'Nº SIRIA BENEFICIARIA/O',
+    'Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)',
+    'Nº DE SIRIA TITULAR UNIDAD FAMILIAR',
+    'Nº EXPEDIENTE OAR',
+    'FECHA NACIMIENTO',
+    'SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL',
+)
+COLUMNAS_SIRIA = (
+    'Nº SIRIA BENEFICIARIA/O',
+    'Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)',
+    'Nº DE SIRIA TITULAR UNIDAD FAMILIAR',
+)
+# Marcas de la tabla de tipo de protección de la plantilla y las situaciones que las activan
+TIPOS_PROTECCION = {
+    'sol_pi': ('Solicitante Protección Internacional',),
+    'ben_pi': ('Beneficiario/a Estatuto Refugiado/a',),
+    'ben_ps': ('Beneficiario/a Protección Subsidiaria',),
+    'sol_ap': ('Solicitante Estatuto de Apátrida',),
+    'apatrida': ('Apátrida',),
+    'sol_ben_pt': ('Solicitante Protección Temporal', 'Beneficiario/a Protección Temporal'),
+}
+# Columnas con muchos valores repetidos, que se guardan como categorías si al menos la mitad se repiten
+COLUMNAS_REPETIDAS = (
+    'NOMBRE',
+    'Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)',
+    'Nº DE SIRIA TITULAR UNIDAD FAMILIAR',
+    'SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL',
+)
+# Problemas de las filas del listado que impiden o estropean un recibí, y su descripción
+PROBLEMAS_LISTADO = {
+    'sin_nombre': "falta el nombre",
+    'sin_apellidos': "faltan los apellidos",
+    'sin_nie': "falta el número NIE",
+    'fecha_nacimiento_invalida': "la fecha de nacimiento no es válida, no se sabe si es menor",
+    'siria_repetido': "el número SIRIA está repetido y se usa la primera fila",
+    'menor_sin_titular': "es menor y no tiene SIRIA de titular",
+    'titular_inexistente': "es menor y el SIRIA de su titular no está en el listado",
+}
+# Problemas que no afectan si el titular se indica a mano o en la orden
+PROBLEMAS_TITULAR = ('menor_sin_titular', 'titular_inexistente')
+FILA_CABECERA = 5  # El listado tiene 4 filas de preámbulo antes de la cabecera
+HOJA_OCULTA = 'LISTADOS (no tocar)'
+
+def snapshot_dir() -> str:
+    """Per-user local directory where the workbook snapshots are kept."""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), 'AppData', 'Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'recibi', 'instantaneas')
+
+def snapshot_path(archivo: str) -> str:
+    """Return the path of a workbook's snapshot in the local snapshot directory.
+
+    The snapshot is never stored next to the workbook: that is usually a
+    shared folder, and whoever can write there could leave a pickle that
+    runs code when loaded.
+    """
+    nombre = hashlib.sha256(os.path.abspath(archivo).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(snapshot_dir(), f"{nombre}.recibi.pkl")
+
+def file_hash(path: str) -> str:
+    """Return the SHA-256 of a file's contents."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+def read_roster_workbook(archivo: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Read the roster columns and the professional range in a single read-only pass over the workbook.
+
+    Returns the roster with the SIRIA columns already normalized to strings
+    and the B4:C7 range of the hidden sheet.
+    """
+    import openpyxl
+    import pandas as pd
+
+    libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        hoja.reset_dimensions()
+        cabecera = next(hoja.iter_rows(min_row=FILA_CABECERA, max_row=FILA_CABECERA, values_only=True), ())
+        cabecera = [str(valor) if valor is not None else '' for valor in cabecera]
+
+        posiciones = []
+        for columna in COLUMNAS_ROSTER:
+            if columna not in cabecera:
+                raise ValueError(f"Falta la columna '{columna.strip()}' en la hoja de beneficiarias/os.")
+            posiciones.append(cabecera.index(columna))
+
+        datos = {columna: [] for columna in COLUMNAS_ROSTER}
+        for fila in hoja.iter_rows(min_row=FILA_CABECERA + 1, max_col=max(posiciones) + 1, values_only=True):
+            valores = [fila[i] for i in posiciones]
+            if all(valor is None for valor in valores):
+                continue
+            for columna, valor in zip(COLUMNAS_ROSTER, valores):
+                datos[columna].append(valor)
+
+        # Los números SIRIA se guardan como texto desde la lectura; el resto de tipos los infiere pandas
+        for columna in COLUMNAS_SIRIA:
+            datos[columna] = pd.Series([normalize_siria(valor) or None for valor in datos[columna]], dtype=object)
+        df = pd.DataFrame(datos, columns=list(COLUMNAS_ROSTER))
+
+        # Rango de profesionales de la hoja oculta (B4:C7)
+        profesionales = list(libro[HOJA_OCULTA].iter_rows(min_row=4, max_row=7, min_col=2, max_col=3, values_only=True))
+        df_oculta = pd.DataFrame(profesionales, columns=['B', 'C'], dtype=object)
+    finally:
+        libro.close()
+
+    return df, df_oculta
+
+def load_roster(archivo: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Load the roster from its snapshot if the workbook is unchanged, otherwise parse it and save a new snapshot.
+
+    The snapshot is keyed by path, size and mtime; when only the mtime differs
+    (e.g. the file was copied again) the content hash decides. See snapshot_path.
+    """
+    stat = os.stat(archivo)
+    clave = {
+        'version': SNAPSHOT_VERSION,
+        'path': os.path.abspath(archivo),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+    }
+    ruta_snapshot = snapshot_path(archivo)
+
+    try:
+        with open(ruta_snapshot, 'rb') as f:
+            guardada = pickle.load(f)
+            mismos_datos = all(guardada.get(k) == clave[k] for k in ('version', 'path', 'size'))
+            if mismos_datos and (guardada['mtime'] == clave['mtime'] or guardada['hash'] == file_hash(archivo)):
+                datos = pickle.load(f)
+                return datos['df'], datos['df_oculta']
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # Instantánea dañada o de otra versión de pandas: se vuelve a leer el Excel
+        logger.warning("No se pudo usar la instantánea del Excel: %s", e)
+
+    df, df_oculta = read_roster_workbook(archivo)
+
+    temporal = None
+    try:
+        clave['hash'] = file_hash(archivo)
+        directorio = os.path.dirname(ruta_snapshot)
+        os.makedirs(directorio, mode=0o700, exist_ok=True)
+        # Un temporal propio en la misma carpeta: dos programas abiertos a la vez no se pisan al guardarla
+        descriptor, temporal = tempfile.mkstemp(prefix='.instantanea_', suffix='.tmp', dir=directorio)
+        with os.fdopen(descriptor, 'wb') as f:
+            pickle.dump(clave, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump({'df': df, 'df_oculta': df_oculta}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta_snapshot)
+    except OSError as e:
+        logger.warning("No se pudo guardar la instantánea del Excel: %s", e)
+        if temporal is not None and os.path.exists(temporal):
+            os.remove(temporal)
+
+    return df, df_oculta
+
+def prepare_roster(df: pd.DataFrame, edad_mayoria: int, hoy: Optional[datetime] = None) -> pd.DataFrame:
+    """Add the per-row values derived from the roster, computed for all rows at once.
+
+    Adds 'fecha_nacimiento_dt', 'edad', 'es_menor', 'fecha_nacimiento_str' and
+    one boolean column per protection type in TIPOS_PROTECCION, and stores the
+    COLUMNAS_REPETIDAS with many repeated values as categoricals, so each
+    distinct value is kept once however many rows share it.
+    """
+    import pandas as pd
+
+    hoy = hoy or datetime.now()
+    fecha_nacimiento = df['FECHA NACIMIENTO']
+    if pd.api.types.is_datetime64_any_dtype(fecha_nacimiento):
+        nacimiento = fecha_nacimiento
+    else:
+        nacimiento = pd.to_datetime(fecha_nacimiento, errors='coerce', format='mixed')
+
+    # Años cumplidos: diferencia de años menos uno si todavía no ha llegado el cumpleaños.
+    # Quien nació un 29 de febrero cumple el 28 en los años no bisiestos, como con relativedelta.
+    dia = nacimiento.dt.day
+    if not calendar.isleap(hoy.year):
+        dia = dia.mask((nacimiento.dt.month == 2) & (dia == 29), 28)
+    aun_no_cumple = (nacimiento.dt.month > hoy.month) | ((nacimiento.dt.month == hoy.month) & (dia > hoy.day))
+    edad = (hoy.year - nacimiento.dt.year - aun_no_cumple.astype(int)).astype('Int64')
+
+    derivados = {
+        'fecha_nacimiento_dt': nacimiento,
+        'edad': edad,
+        'es_menor': (edad < edad_mayoria).fillna(False).astype(bool),
+        # Si la fecha no se puede interpretar se deja el valor original, como antes
+        'fecha_nacimiento_str': nacimiento.dt.strftime('%d-%m-%Y').astype(object).where(nacimiento.notna(), fecha_nacimiento),
+    }
+    tipo_proteccion = df['SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL']
+    for marca, situaciones in TIPOS_PROTECCION.items():
+        derivados[marca] = tipo_proteccion.isin(situaciones).to_numpy()
+    for columna in COLUMNAS_REPETIDAS:
+        if df[columna].nunique() <= len(df) // 2:
+            derivados[columna] = df[columna].astype('category')
+    return df.assign(**derivados)
+
+def preflight_report(df: pd.DataFrame, edad_mayoria: int, hoy: Optional[datetime] = None) -> Dict[str, pd.DataFrame]:
+    """Return the roster rows that need attention before issuing receipts.
+
+    Expects a frame already processed by prepare_roster.
+    """
+    hoy = hoy or datetime.now()
+    nacimiento = df['fecha_nacimiento_dt']
+    siria = df['Nº SIRIA BENEFICIARIA/O']
+    siria_titular = df['Nº DE SIRIA TITULAR UNIDAD FAMILIAR']
+    columnas = ['Nº SIRIA BENEFICIARIA/O', 'NOMBRE', 'APELLIDOS']
+
+    cumplen_mayoria = (nacimiento.dt.month == hoy.month) & (hoy.year - nacimiento.dt.year == edad_mayoria)
+    titular_inexistente = siria_titular.notna() & ~siria_titular.isin(siria.dropna())
+    return {
+        'cumplen_mayoria_este_mes': df.loc[cumplen_mayoria, columnas + ['fecha_nacimiento_str']],
+        'sin_fecha_nacimiento': df.loc[nacimiento.isna(), columnas + ['FECHA NACIMIENTO']],
+        'titular_inexistente': df.loc[titular_inexistente, columnas + ['Nº DE SIRIA TITULAR UNIDAD FAMILIAR']],
+    }
+
+def blank(columna: pd.Series) -> pd.Series:
+    """True where a roster cell is empty or only spaces."""
+    return columna.isna() | columna.astype(str).str.strip().eq('')
+
+def validate_roster(df: pd.DataFrame) -> Dict[str, Tuple[str, ...]]:
+    """Check every row for the data a receipt needs; return the problems of each SIRIA number that has any.
+
+    Expects a frame already processed by prepare_roster. The checks are done
+    on whole columns at once; problems are keys of PROBLEMAS_LISTADO. Like the
+    beneficiary index, a repeated SIRIA keeps the problems of its first row.
+    """
+    import pandas as pd
+
+    siria = df['Nº SIRIA BENEFICIARIA/O']
+    siria_titular = df['Nº DE SIRIA TITULAR UNIDAD FAMILIAR']
+    es_menor = df['es_menor']
+    problemas = pd.DataFrame({
+        'sin_nombre': blank(df['NOMBRE']),
+        'sin_apellidos': blank(df['APELLIDOS']),
+        'sin_nie': blank(df['NÚMERO NIE']),
+        'fecha_nacimiento_invalida': df['fecha_nacimiento_dt'].isna(),
+        'siria_repetido': siria.notna() & siria.duplicated(keep=False),
+        'menor_sin_titular': es_menor & siria_titular.isna(),
+        'titular_inexistente': es_menor & siria_titular.notna() & ~siria_titular.isin(siria.dropna()),
+    }, columns=list(PROBLEMAS_LISTADO))
+
+    # Solo se recorren las filas con algún problema
+    con_problemas = problemas.any(axis=1) & siria.notna()
+    indice = {}
+    for numero_siria, fila in zip(siria[con_problemas], problemas[con_problemas].itertuples(index=False)):
+        if numero_siria not in indice:
+            indice[numero_siria] = tuple(problema for problema, hay in zip(PROBLEMAS_LISTADO, fila) if hay)
+    return indice
+
+def cell_text(valor) -> str:
+    """Roster cell as text that does not depend on the type pandas inferred for its whole column.
+
+    A date read as datetime64 and the same date in a column that also holds
+    text, a whole number read as int or as float, and an empty cell read as
+    None, NaN or NaT all give the same text.
+    """
+    # Casi todas las celdas son texto, se comprueba primero
+    if isinstance(valor, str):
+        return valor
+    if valor is None:
+        return ''
+    if isinstance(valor, float):
+        if math.isnan(valor):
+            return ''
+        return str(int(valor)) if valor.is_integer() else str(valor)
+    try:
+        # NaT es distinto de sí mismo; pd.NA no se puede evaluar como booleano
+        if valor != valor:
+            return ''
+    except TypeError:
+        return ''
+    if isinstance(valor, datetime):
+        return date_text(valor)
+    return str(valor)
+
+@lru_cache(maxsize=65536)
+def date_text(valor: datetime) -> str:
+    """cell_text of a date; a roster repeats the same few thousand dates, so each one is formatted once."""
+    return datetime.isoformat(valor, timespec='seconds')
+
+def column_text(columna: pd.Series) -> pd.Series:
+    """cell_text of every cell of a column, vectorized for the column types where the result is known."""
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(columna.dtype, pd.CategoricalDtype):
+        # Cada valor distinto se convierte una sola vez
+        categorias = columna.cat.categories.map(cell_text).tolist() + ['']
+        return pd.Series(categorias, dtype=object).take(columna.cat.codes).reset_index(drop=True)
+    if pd.api.types.is_datetime64_any_dtype(columna) and columna.dt.tz is None:
+        textos = np.datetime_as_string(columna.to_numpy(dtype='datetime64[s]')).astype(object)
+        textos[columna.isna().to_numpy()] = ''
+        return pd.Series(textos)
+    if pd.api.types.is_integer_dtype(columna) and not pd.api.types.is_extension_array_dtype(columna):
+        return columna.astype(str).astype(object).reset_index(drop=True)
+    if pd.api.types.is_string_dtype(columna) and not pd.api.types.is_object_dtype(columna):
+        return columna.fillna('').astype(object).reset_index(drop=True)
+    return columna.astype(object).map(cell_text).reset_index(drop=True)
+
+def roster_fingerprints(df: pd.DataFrame) -> Dict[str, int]:
+    """Return a hash of each roster row (including its derived age) keyed by SIRIA number.
+
+    Cells are hashed as text (cell_text), so adding a row that changes the
+    type pandas infers for a column (e.g. a date typed as text) does not
+    change the hash of the other rows.
+    """
+    import pandas as pd
+
+    textos = pd.DataFrame({columna: column_text(df[columna]) for columna in COLUMNAS_ROSTER})
+    textos['edad'] = df['edad'].astype('Int64').array
+    hashes = pd.util.hash_pandas_object(textos, index=False)
+    huellas = {}
+    for siria, huella in zip(df['Nº SIRIA BENEFICIARIA/O'], hashes):
+        # Igual que en el índice, si el SIRIA está repetido cuenta la primera fila
+        if siria and siria not in huellas:
+            huellas[siria] = int(huella)
+    return huellas
+
+class SortedKeys:
+    """Position of each text key in a sorted array of their UTF-8 bytes, a few bytes per key instead of a dict entry."""
+
+    def __init__(self, claves):
+        import numpy as np
+
+        codificadas = np.array([clave.encode('utf-8') for clave in claves], dtype=bytes)
+        self.orden = np.argsort(codificadas, kind='stable').astype(np.int32)
+        self.claves = codificadas[self.orden]
+
+    def position(self, clave: str) -> int:
+        """Position the key had in claves, or -1."""
+        codificada = clave.encode('utf-8')
+        i = int(self.claves.searchsorted(codificada))
+        if i < len(self.claves) and self.claves[i] == codificada:
+            return int(self.orden[i])
+        return -1
+
+class TextColumn:
+    """Column of mostly text values packed in a single string with the start of each value.
+
+    A value costs its characters plus four bytes instead of a whole str object.
+    Values that are not text (empty cells, numbers) are kept as they are in
+    otros, keyed by row.
+    """
+
+    def __init__(self, valores):
+        textos = []
+        self.otros: Dict[int, Any] = {}
+        for fila, valor in enumerate(valores):
+            if isinstance(valor, str):
+                textos.append(valor)
+            else:
+                textos.append('')
+                self.otros[fila] = valor
+        self.texto = ''.join(textos)
+        self.inicios = array('i', accumulate(map(len, textos), initial=0))
+
+    def __len__(self) -> int:
+        return len(self.inicios) - 1
+
+    def __getitem__(self, fila: int):
+        if fila in self.otros:
+            return self.otros[fila]
+        return self.texto[self.inicios[fila]:self.inicios[fila + 1]]
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+class CategoryColumn:
+    """Column stored as the code of each row and its distinct values packed in a TextColumn; code -1 is the empty cell."""
+
+    def __init__(self, codigos, categorias: List, vacio):
+        self.codigos = codigos
+        self.categorias = TextColumn(categorias)
+        self.vacio = vacio
+
+    def __len__(self) -> int:
+        return len(self.codigos)
+
+    def __getitem__(self, fila: int):
+        codigo = self.codigos[fila]
+        return self.categorias[codigo] if codigo >= 0 else self.vacio
+
+    def __iter__(self):
+        return (self.categorias[codigo] if codigo >= 0 else self.vacio for codigo in self.codigos.tolist())
+
+@lru_cache(maxsize=65536)
+def timestamp(valor: int, unidad: str):
+    """Timestamp of a datetime64 stored as an integer; a roster repeats the same few thousand dates, so each one is built once."""
+    import numpy as np
+    import pandas as pd
+    return pd.Timestamp(np.datetime64(valor, unidad))
+
+class DateColumn:
+    """Column of dates stored as datetime64 and read as Timestamp (NaT when empty), like a pandas date column."""
+
+    def __init__(self, fechas):
+        import numpy as np
+
+        self.fechas = fechas
+        self.enteros = fechas.view(np.int64)
+        self.unidad = np.datetime_data(fechas.dtype)[0]
+
+    def __len__(self) -> int:
+        return len(self.fechas)
+
+    def __getitem__(self, fila: int):
+        return timestamp(int(self.enteros[fila]), self.unidad)
+
+    def __iter__(self):
+        import pandas as pd
+        return iter(pd.DatetimeIndex(self.fechas))
+
+def compact_column(columna: pd.Series, vacio_ninguno: bool = False):
+    """Return a compact copy of a roster column whose values read back like iterating the column.
+
+    With vacio_ninguno empty cells read as None. Columns that are not text,
+    categories or dates are kept as an array of Python objects.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if vacio_ninguno and not isinstance(columna.dtype, pd.CategoricalDtype):
+        columna = columna.astype(object).where(columna.notna(), None)
+    if isinstance(columna.dtype, pd.CategoricalDtype):
+        return CategoryColumn(columna.cat.codes.to_numpy().copy(), columna.cat.categories.tolist(),
+                              None if vacio_ninguno else np.nan)
+    if pd.api.types.is_datetime64_any_dtype(columna) and columna.dt.tz is None:
+        return DateColumn(columna.to_numpy().copy())
+    if pd.api.types.is_string_dtype(columna) or pd.api.types.is_object_dtype(columna):
+        return TextColumn(columna.tolist())
+    valores = np.empty(len(columna), dtype=object)
+    valores[:] = columna.tolist()
+    return valores
+
+class RosterStore:
+    """The roster kept in memory: one compact column per field and one row per SIRIA number.
+
+    It is the only copy of the roster once loaded. Like a dict of Beneficiario
+    records it is looked up by SIRIA number and iterated in roster order; each
+    record is built when asked for. A repeated SIRIA keeps its first row.
+    huellas are the row fingerprints of roster_fingerprints, kept to diff the
+    next reload of the workbook.
+    """
+
+    def __init__(self, df: Optional[pd.DataFrame] = None, huellas: Optional[Dict[str, int]] = None):
+        import numpy as np
+
+        self.columnas: Dict[str, Any] = {}
+        self.numero_siria = TextColumn(())
+        self.claves = SortedKeys(())
+        self.huellas = np.zeros(0, dtype=np.uint64)
+        if df is None:
+            return
+
+        primeras = {}
+        for fila, siria in enumerate(df['Nº SIRIA BENEFICIARIA/O']):
+            numero_siria = normalize_siria(siria)
+            if numero_siria and numero_siria not in primeras:
+                primeras[numero_siria] = fila
+        df = df.iloc[list(primeras.values())]
+
+        self.numero_siria = TextColumn(primeras)
+        self.claves = SortedKeys(primeras)
+        huellas = huellas or {}
+        self.huellas = np.array([huellas.get(numero_siria, 0) for numero_siria in primeras], dtype=np.uint64)
+        for columna in COLUMNAS_ROSTER + ('fecha_nacimiento_str',):
+            # El SIRIA de la beneficiaria/o ya está en numero_siria, normalizado
+            if columna != 'Nº SIRIA BENEFICIARIA/O':
+                self.columnas[columna] = compact_column(df[columna], vacio_ninguno=columna in COLUMNAS_SIRIA[1:])
+        # SIRIA del titular normalizado, una vez por cada valor distinto
+        titulares = df['Nº DE SIRIA TITULAR UNIDAD FAMILIAR'].astype('category')
+        self.columnas['siria_titular'] = CategoryColumn(
+            titulares.cat.codes.to_numpy().copy(), [normalize_siria(valor) or None for valor in titulares.cat.categories], None)
+        # Edad -1 cuando la fecha de nacimiento no se puede interpretar
+        self.columnas['edad'] = df['edad'].fillna(-1).to_numpy(dtype=np.int16)
+        self.columnas['es_menor'] = df['es_menor'].to_numpy(dtype=bool).copy()
+        for marca in TIPOS_PROTECCION:
+            self.columnas[marca] = df[marca].to_numpy(dtype=bool).copy()
+
+    def __len__(self) -> int:
+        return len(self.numero_siria)
+
+    def __iter__(self):
+        return iter(self.numero_siria)
+
+    def __contains__(self, numero_siria) -> bool:
+        return self.position(numero_siria) >= 0
+
+    def __getitem__(self, numero_siria: str) -> Beneficiario:
+        fila = self.position(numero_siria)
+        if fila < 0:
+            raise KeyError(numero_siria)
+        return self.record(fila)
+
+    def get(self, numero_siria: str) -> Optional[Beneficiario]:
+        fila = self.position(numero_siria)
+        return self.record(fila) if fila >= 0 else None
+
+    def items(self):
+        return ((persona.numero_siria, persona) for persona in self.values())
+
+    def values(self):
+        return map(self.record, range(len(self)))
+
+    def position(self, numero_siria) -> int:
+        """Row of a normalized SIRIA number, or -1."""
+        if not isinstance(numero_siria, str):
+            return -1
+        return self.claves.position(numero_siria)
+
+    def column(self, columna: str):
+        """Compact column of the store, see compact_column; empty before a roster is loaded."""
+        return self.columnas.get(columna, ())
+
+    def record(self, fila: int) -> Beneficiario:
+        """Beneficiario of a row, with the same values the roster frame had."""
+        c = self.columnas
+        edad = int(c['edad'][fila])
+        return Beneficiario(
+            nombre=c['NOMBRE'][fila],
+            apellidos=c['APELLIDOS'][fila],
+            nie=c['NÚMERO NIE'][fila],
+            caducidad_nie=c['CADUCIDAD NIE '][fila],
+            numero_siria=self.numero_siria[fila],
+            numero_siria_uc=c['Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)'][fila],
+            numero_siria_uf=c['Nº DE SIRIA TITULAR UNIDAD FAMILIAR'][fila],
+            siria_titular=c['siria_titular'][fila],
+            oar=c['Nº EXPEDIENTE OAR'][fila],
+            fecha_nacimiento=c['FECHA NACIMIENTO'][fila],
+            fecha_nacimiento_str=c['fecha_nacimiento_str'][fila],
+            edad=edad if edad >= 0 else None,
+            es_menor=bool(c['es_menor'][fila]),
+            tipo_proteccion=c['SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL'][fila],
+        )
+
+    def fingerprints(self) -> Dict[str, int]:
+        """Fingerprint of each stored row keyed by SIRIA number, as returned by roster_fingerprints."""
+        return dict(zip(self.numero_siria, self.huellas.tolist()))
+
+    def protection_marks(self, numero_siria: str) -> Dict[str, str]:
+        """Return 'X' for the protection type of the template that matches the person's legal situation and '' for the rest."""
+        fila = self.position(numero_siria)
+        return {marca: 'X' if fila >= 0 and self.columnas[marca][fila] else '' for marca in TIPOS_PROTECCION}
+
+    def frame(self) -> pd.DataFrame:
+        """The stored rows as a roster frame with the COLUMNAS_ROSTER, to be processed again by prepare_roster."""
+        import pandas as pd
+
+        datos = {}
+        for columna in COLUMNAS_ROSTER:
+            valores = self.columnas.get(columna, ())
+            datos[columna] = valores.fechas if isinstance(valores, DateColumn) else list(valores)
+        datos['Nº SIRIA BENEFICIARIA/O'] = list(self.numero_siria)
+        return pd.DataFrame(datos, columns=list(COLUMNAS_ROSTER))
+
+class HouseholdIndex:
+    """Households of the roster store, keyed by UC SIRIA or by titular SIRIA when there is no UC.
+
+    A member without UC joins the UC of their titular. The household's titular
+    is the person most members name as titular or, if nobody does, its first
+    adult. Members are kept as rows of the store, titular first, then adults
+    and then minors; each Hogar is built when asked for.
+    """
+
+    def __init__(self, listado: RosterStore):
+        sirias = list(listado)
+        uc = [normalize_siria(valor) for valor in listado.column('Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)')]
+        titulares = list(listado.column('siria_titular'))
+        es_menor = listado.column('es_menor')
+        uc_de = dict(zip(sirias, uc))
+        fila_de = {siria: fila for fila, siria in enumerate(sirias)}
+
+        grupos: Dict[str, List[int]] = {}
+        for fila, (siria, titular) in enumerate(zip(sirias, titulares)):
+            clave = uc[fila] or uc_de.get(titular) or titular or siria
+            grupos.setdefault(clave, []).append(fila)
+
+        self.hogar_de = array('i', [0]) * len(sirias)
+        self.miembros = array('i')
+        self.inicios = array('i', [0])
+        self.titular = array('i')
+        ucs = []
+        for hogar, miembros in enumerate(grupos.values()):
+            nombrados = Counter(titulares[fila] for fila in miembros if titulares[fila] in fila_de)
+            if nombrados:
+                titular = fila_de[nombrados.most_common(1)[0][0]]
+            else:
+                titular = next((fila for fila in miembros if not es_menor[fila]), -1)
+            miembros = sorted(miembros, key=lambda fila: (fila != titular, bool(es_menor[fila])))
+            for fila in miembros:
+                self.hogar_de[fila] = hogar
+            self.miembros.extend(miembros)
+            self.inicios.append(len(self.miembros))
+            self.titular.append(titular)
+            ucs.append(next((uc[fila] for fila in miembros if uc[fila]), ''))
+
+        self.listado = listado
+        self.claves = TextColumn(grupos)
+        self.posiciones = SortedKeys(grupos)
+        self.uc = TextColumn(ucs)
+
+    def __len__(self) -> int:
+        return len(self.titular)
+
+    def get(self, clave: str) -> Optional[Hogar]:
+        hogar = self.posiciones.position(clave) if isinstance(clave, str) else -1
+        return self.household(hogar) if hogar >= 0 else None
+
+    def values(self):
+        return map(self.household, range(len(self)))
+
+    def find(self, numero_siria: str) -> Optional[Hogar]:
+        """Return the household of a member, or the one with that UC SIRIA number, or None."""
+        fila = self.listado.position(numero_siria)
+        if fila >= 0:
+            return self.household(self.hogar_de[fila])
+        return self.get(numero_siria)
+
+    def household(self, hogar: int) -> Hogar:
+        sirias = self.listado.numero_siria
+        titular = self.titular[hogar]
+        return Hogar(
+            clave=self.claves[hogar],
+            numero_siria_uc=self.uc[hogar],
+            numero_siria_titular=sirias[titular] if titular >= 0 else None,
+            miembros=tuple(sirias[fila] for fila in self.miembros[self.inicios[hogar]:self.inicios[hogar + 1]]),
+        )
+
+def deep_sizeof(objeto, vistos: Optional[Dict[int, Any]] = None) -> int:
+    """Return the bytes used by an object and everything it references.
+
+    Objects already in vistos (e.g. the roster store referenced by the
+    household index) are not counted again, so one vistos can be passed to
+    several calls to split the memory among structures.
+    """
+    import numpy as np
+
+    vistos = {} if vistos is None else vistos
+    total = 0
+    pendientes = [objeto]
+    while pendientes:
+        objeto = pendientes.pop()
+        if objeto is None or id(objeto) in vistos:
+            continue
+        vistos[id(objeto)] = objeto  # Se guarda el objeto para que su id no se reutilice
+        total += sys.getsizeof(objeto)
+        if isinstance(objeto, np.ndarray):
+            # Un array que no es dueño de sus datos no los incluye en getsizeof
+            if objeto.base is not None:
+                pendientes.append(objeto.base)
+            if objeto.dtype == object:
+                pendientes.extend(objeto.ravel().tolist())
+        elif isinstance(objeto, dict):
+            pendientes.extend(objeto.keys())
+            pendientes.extend(objeto.values())
+        elif isinstance(objeto, (list, tuple, set, frozenset)):
+            pendientes.extend(objeto)
+        elif hasattr(objeto, '__dict__'):
+            pendientes.append(vars(objeto))
+    return total
+
+BATCH_SUMMARY_COLUMNS = ['fila', 'numero_siria', 'codigo_ayuda', 'cuantia', 'archivo', 'estado', 'error', 'aviso']
+
+def write_batch_summary(resultados: List[Dict], output_dir: str) -> str:
+    """Save the per-row results of a batch as a resumen_lote_*.csv in output_dir and return its path."""
+    import pandas as pd
+
+    resumen_path = os.path.join(output_dir, f"resumen_lote_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    pd.DataFrame(resultados, columns=BATCH_SUMMARY_COLUMNS).to_csv(
+        resumen_path, index=False, sep=';', encoding='utf-8-sig')
+    return resumen_path
+
+class RenderCache:
+    """Size-bounded LRU of rendered receipts, keyed by a hash of the template and the full context.
+
+    A change in the template or in a beneficiary's row changes the key; the
+    stale entries are also dropped at once through set_template and invalidate.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.documentos: OrderedDict = OrderedDict()  # clave -> (bytes, SIRIA del recibí)
+        self.bytes = 0
+        self.template_digest = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(context: Dict, template_digest: str) -> str:
+        datos = json.dumps(context, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{template_digest}\n{datos}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def context_sirias(context: Dict) -> Tuple[str, ...]:
+        """SIRIA numbers whose roster rows the context was built from."""
+        return tuple(str(context[campo]) for campo in ('titular_numero_siria_beneficiaria', 'menor_numero_siria_beneficiaria')
+                     if context.get(campo))
+
+    def get(self, clave: str) -> Optional[bytes]:
+        with self.lock:
+            entrada = self.documentos.get(clave)
+            if entrada is None:
+                return None
+            self.documentos.move_to_end(clave)
+            return entrada[0]
+
+    def put(self, clave: str, documento: bytes, sirias: Tuple[str, ...]):
+        if len(documento) > self.max_bytes:
+            return
+        with self.lock:
+            if clave in self.documentos:
+                self.bytes -= len(self.documentos.pop(clave)[0])
+            self.documentos[clave] = (documento, sirias)
+            self.bytes += len(documento)
+            while self.bytes > self.max_bytes:
+                _, (antiguo, _) = self.documentos.popitem(last=False)
+                self.bytes -= len(antiguo)
+
+    def set_template(self, template_digest: str):
+        """Drop every entry if the template has changed."""
+        with self.lock:
+            if template_digest != self.template_digest:
+                self.documentos.clear()
+                self.bytes = 0
+                self.template_digest = template_digest
+
+    def invalidate(self, sirias):
+        """Drop the entries built from any of the given roster rows."""
+        sirias = set(sirias)
+        with self.lock:
+            for clave in [clave for clave, (_, de) in self.documentos.items() if sirias.intersection(de)]:
+                self.bytes -= len(self.documentos.pop(clave)[0])
+
+class ReceiptEngine:
+    """Everything needed to generate receipts, without any GUI; DocumentGenerator is its Tk front end."""
+
+    def __init__(self):
+        try:
+            locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
+        except locale.Error:
+            try:
+                locale.setlocale(locale.LC_TIME, 'spanish')
+            except locale.Error:
+                self.show_warning("Advertencia", "No se pudo configurar el idioma español para las fechas.")
+
+        self.beneficiarios = RosterStore()
+        self.hogares = HouseholdIndex(self.beneficiarios)
+        self.problemas: Dict[str, Tuple[str, ...]] = {}
+        self.buscador: Optional[SearchIndex] = None
+        self.archivo = None
+        self.archivo_mtime = None
+        self.valores_combined = []
+        self.setup_constants()
+        self.render_cache = RenderCache(self.RENDER_CACHE_BYTES)
+        self.registro = ReceiptLedger(self.ledger_path)
+
+    def show_error(self, title: str, message: str):
+        """Report an error; the engine prints it on stderr, front ends may show it their own way."""
+        print(f"{title}: {message}", file=sys.stderr)
+
+    def show_warning(self, title: str, message: str):
+        """Report a warning; the engine prints it on stderr, front ends may show it their own way."""
+        print(f"{title}: {message}", file=sys.stderr)
+
+    def setup_constants(self):
+        """Initialize constant values and the aid catalog used to build receipts."""
+        self.EDAD_MAYORIA = 18
+        self.RENDER_CACHE_BYTES = 32 * 1024 * 1024  # Recibís ya generados que se guardan en memoria
+        self.template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plantilla_recibo.docx")
+        self.ledger_path = os.path.join(program_dir(), LEDGER_FILENAME)
+
+        try:
+            self.catalogo = load_aid_catalog()
+        except (OSError, ValueError, TypeError) as e:
+            self.show_warning("Advertencia", f"No se pudo leer {AIDS_FILENAME}, se usa el catálogo de ayudas por defecto: {str(e)}")
+            self.catalogo = AidCatalog(AYUDAS_PREDEFINIDAS)
+
+    def load_excel_file(self, archivo: Optional[str] = None) -> bool:
+        """Load Excel file and return success status."""
+        if not archivo:
+            self.show_error("Error", "No se seleccionó ningún archivo.")
+            return False
+
+        try:
+            with instrumentation.stage('carga_excel'):
+                mtime = os.path.getmtime(archivo)
+                df, df_oculta = load_roster(archivo)
+                self.build_beneficiary_index(prepare_roster(df, self.EDAD_MAYORIA))
+                # De la hoja oculta solo se guardan los profesionales
+                self.load_professional_values(df_oculta)
+            self.archivo = archivo
+            self.archivo_mtime = mtime
+            logger.info("Excel cargado: %s (%d beneficiarias/os)", archivo, len(self.beneficiarios))
+            return True
+        except Exception as e:
+            self.show_error("Error", f"No se pudo cargar el archivo Excel: {str(e)}")
+            return False
+
+    def reload_excel_file(self) -> Dict[str, int]:
+        """Reload the current workbook and apply it if any row is new, changed or removed.
+
+        Returns the number of 'nuevas', 'modificadas' and 'eliminadas' rows.
+        """
+        return self.apply_roster_changes(*self.read_roster_changes())
+
+    def read_roster_changes(self) -> Tuple[float, RosterStore, pd.DataFrame, Dict[str, Tuple[str, ...]]]:
+        """Read, store and check the current workbook again; safe to run outside the Tk thread."""
+        mtime = os.path.getmtime(self.archivo)
+        df, df_oculta = load_roster(self.archivo)
+        df = prepare_roster(df, self.EDAD_MAYORIA)
+        return mtime, RosterStore(df, roster_fingerprints(df)), df_oculta, self.check_roster(df)
+
+    def apply_roster_changes(self, mtime: float, listado: RosterStore, df_oculta: pd.DataFrame,
+                             problemas: Dict[str, Tuple[str, ...]]) -> Dict[str, int]:
+        """Diff a freshly read roster against the stored one; only the receipts of the rows that changed are discarded."""
+        row_hashes = listado.fingerprints()
+        anteriores = self.beneficiarios.fingerprints()
+        nuevas = row_hashes.keys() - anteriores.keys()
+        eliminadas = anteriores.keys() - row_hashes.keys()
+        modificadas = {siria for siria in row_hashes.keys() & anteriores.keys() if row_hashes[siria] != anteriores[siria]}
+
+        cambiadas = nuevas | modificadas
+        if cambiadas or eliminadas:
+            # Las columnas compactas no admiten cambiar filas sueltas: se cambia el listado entero
+            self.beneficiarios = listado
+            self.build_household_index()
+            self.buscador = None
+        self.render_cache.invalidate(cambiadas | eliminadas)
+
+        self.problemas = problemas
+        self.archivo_mtime = mtime
+        self.load_professional_values(df_oculta)
+        return {'nuevas': len(nuevas), 'modificadas': len(modificadas), 'eliminadas': len(eliminadas)}
+
+    def load_professional_values(self, df_oculta: pd.DataFrame) -> bool:
+        """Load professional values from the B4:C7 range of the hidden sheet; return True if they changed."""
+        valores_b = df_oculta['B'].dropna().tolist()
+        valores_c = df_oculta['C'].dropna().tolist()
+        valores_combined = valores_b + valores_c
+        if valores_combined == self.valores_combined:
+            return False
+        self.valores_combined = valores_combined
+        logger.debug("Valores de profesionales cargados: %s", self.valores_combined)
+        return True
+
+    def build_beneficiary_index(self, df: pd.DataFrame):
+        """Keep a prepared roster in the store indexed by SIRIA number and remember each row's fingerprint."""
+        self.beneficiarios = RosterStore(df, roster_fingerprints(df))
+        self.buscador = None
+        self.build_household_index()
+        self.problemas = self.check_roster(df)
+
+    def check_roster(self, df: pd.DataFrame) -> Dict[str, Tuple[str, ...]]:
+        """Check the whole roster once per load, so receipts with missing data are known before generating them."""
+        with instrumentation.stage('validacion'):
+            problemas = validate_roster(df)
+        if problemas:
+            logger.info("%d beneficiarias/os con datos incompletos en el listado", len(problemas))
+        return problemas
+
+    def roster_problems(self, numero_siria: str, con_titular: bool = False) -> str:
+        """Describe the roster problems of a person's row, or ''.
+
+        With con_titular the titular is given by other means, so a missing or unknown titular is not a problem.
+        """
+        problemas = self.problemas.get(normalize_siria(numero_siria), ())
+        if con_titular:
+            problemas = [problema for problema in problemas if problema not in PROBLEMAS_TITULAR]
+        return "; ".join(PROBLEMAS_LISTADO[problema] for problema in problemas)
+
+    def build_household_index(self):
+        """Group the stored beneficiaries into households."""
+        self.hogares = HouseholdIndex(self.beneficiarios)
+
+    def find_beneficiary(self, numero_siria: str) -> Optional[Beneficiario]:
+        """Return the indexed roster record for a SIRIA number, or None."""
+        with instrumentation.stage('busqueda'):
+            return self.beneficiarios.get(normalize_siria(numero_siria))
+
+    def find_household(self, numero_siria: str) -> Optional[Hogar]:
+        """Return the household of a member, or the one with that UC SIRIA number, or None."""
+        return self.hogares.find(normalize_siria(numero_siria))
+
+    def search_index(self, construir: bool = True) -> Optional[SearchIndex]:
+        """Return the search index of the roster, building it the first time it is needed after each load.
+
+        With construir=False it is not built: None until someone else (e.g.
+        the warm-up after loading) has built it.
+        """
+        buscador = self.buscador
+        if buscador is None and construir:
+            listado = self.beneficiarios
+            with instrumentation.stage('indice_busqueda'):
+                buscador = SearchIndex.from_roster(zip(listado, listado.column('NOMBRE'), listado.column('APELLIDOS'),
+                                                       listado.column('NÚMERO NIE')))
+            # Si se ha recargado el Excel mientras tanto, el índice es del listado anterior y no se guarda
+            if self.beneficiarios is listado:
+                self.buscador = buscador
+        return buscador
+
+    def search_beneficiaries(self, consulta: str, limite: int = 10, construir: bool = True) -> Optional[List[Beneficiario]]:
+        """Return the beneficiaries matching a partial SIRIA, NIE, name or surname, best matches first.
+
+        With construir=False, None if the search index is not built yet (see search_index).
+        """
+        listado = self.beneficiarios
+        if not listado:
+            return []
+        buscador = self.search_index(construir)
+        if buscador is None:
+            return None
+        with instrumentation.stage('busqueda_texto'):
+            return [listado[siria] for siria in buscador.search(consulta, limite) if siria in listado]
+
+    def memory_report(self) -> Dict[str, int]:
+        """Return the bytes held by each in-memory structure of the roster.
+
+        Objects shared between structures are counted in the first one, in the
+        order beneficiarias, hogares, busqueda, problemas.
+        """
+        vistos = {}
+        return {
+            'beneficiarias': deep_sizeof(self.beneficiarios, vistos),
+            'hogares': deep_sizeof(self.hogares, vistos),
+            'busqueda': deep_sizeof(self.buscador, vistos),
+            'problemas': deep_sizeof(self.problemas, vistos),
+            'cache_recibis': self.render_cache.bytes,
+        }
+
+    def preflight_report(self) -> Dict[str, pd.DataFrame]:
+        """Return who turns 18 this month, who lacks a birth date and which titular SIRIA numbers are unknown.
+
+        Only the stored rows are checked: a row without SIRIA number or with a repeated one is not.
+        """
+        return preflight_report(prepare_roster(self.beneficiarios.frame(), self.EDAD_MAYORIA), self.EDAD_MAYORIA)
+
+    def is_minor(self, numero_siria: str) -> Tuple[bool, Any, Optional[str]]:
+        """Check if a person is a minor and return their titular's SIRIA number if available."""
+        persona = self.find_beneficiary(numero_siria)
+        if persona is None:
+            return False, None, None
+        
+        if persona.edad is None:
+            return False, None, None
+            
+        return persona.es_menor, persona.fecha_nacimiento, persona.siria_titular
+
+    def get_person_data(self, numero_siria: str, is_titular: bool = True) -> Optional[Dict]:
+        """Retrieve person data from the beneficiary index with role-specific field names."""
+        persona = self.find_beneficiary(numero_siria)
+        if persona is None:
+            return None
+        
+        prefix = 'titular_' if is_titular else 'menor_'
+        
+        # Determinar el tipo de protección
+        tipo_proteccion = persona.tipo_proteccion
+        
+        logger.debug("Tipo de protección encontrado: '%s'", tipo_proteccion)
+        
+        data = {
+            f'{prefix}nombre': persona.nombre,
+            f'{prefix}apellidos': persona.apellidos,
+            f'{prefix}nie': persona.nie,
+            f'{prefix}caducidad_nie': persona.caducidad_nie,
+            f'{prefix}numero_siria_beneficiaria': persona.numero_siria,
+            f'{prefix}numero_siria_uc': persona.numero_siria_uc,
+            f'{prefix}numero_siria_uf': persona.numero_siria_uf,
+            f'{prefix}oar': persona.oar,
+            f'{prefix}fecha_nacimiento': persona.fecha_nacimiento_str,
+        }
+
+        # Campos para la tabla de tipo de protección
+        data.update(self.beneficiarios.protection_marks(persona.numero_siria))
+        
+        # Añadir el placeholder "Hijo/a" si es menor
+        if not is_titular:
+            data['relacion_familiar'] = "Hijo/a"
+        
+        return data
+
+    def validate_values(self, numero_siria: str, codigo_ayuda: str, cuantia_str: str) -> Tuple[bool, str]:
+        """Validate receipt values and return (is_valid, error_message)."""
+        if not numero_siria:
+            return False, "Por favor, introduce todos los datos necesarios."
+        return self.validate_aid_values(codigo_ayuda, cuantia_str)
+
+    def validate_aid_values(self, codigo_ayuda: str, cuantia_str: str) -> Tuple[bool, str]:
+        """Validate the aid code and amount of a receipt and return (is_valid, error_message)."""
+        cuantia_str = cuantia_str.replace(',', '.')
+
+        if not all([codigo_ayuda, cuantia_str]):
+            return False, "Por favor, introduce todos los datos necesarios."
+
+        try:
+            cuantia = float(cuantia_str)
+            error_message = self.catalogo.validate_amount(codigo_ayuda, cuantia)
+            if error_message:
+                return False, error_message
+        except ValueError:
+            return False, "Por favor, introduce una cuantía válida en euros."
+
+        return True, ""
+
+    def build_context(self, numero_siria: str, numero_siria_titular: Optional[str], codigo_ayuda: str,
+                      cuantia: str, profesional: str, metodo_pago: str,
+                      datos_titular: Optional[Dict] = None) -> Tuple[Optional[Dict], str]:
+        """Build the template context for a receipt and return (context, error_message).
+
+        For minors, numero_siria_titular must already be resolved by the caller;
+        datos_titular may pass the titular's data already looked up by get_person_data.
+        """
+        context = {}
+
+        if numero_siria_titular:
+            # Obtener datos del titular
+            datos_titular = datos_titular or self.get_person_data(numero_siria_titular, is_titular=True)
+            if not datos_titular:
+                return None, "No se encontraron los datos del titular."
+
+            # Obtener datos del menor
+            datos_menor = self.get_person_data(numero_siria, is_titular=False)
+            if not datos_menor:
+                return None, "No se encontraron los datos del menor."
+
+            # Combinar datos en el contexto
+            context.update(datos_titular)
+            context.update(datos_menor)
+            context['relacion_familiar'] = "Hijo/a"
+        else:
+            # Si es adulto
+            datos_persona = self.get_person_data(numero_siria, is_titular=True)
+            if not datos_persona:
+                return None, "No se encontraron los datos de la persona."
+            context.update(datos_persona)
+            context['relacion_familiar'] = ""
+
+        # Añadir datos adicionales al contexto
+        context.update({
+            'codigo_ayuda': codigo_ayuda,
+            'descripcion_ayuda': self.catalogo.get(codigo_ayuda).descripcion,
+            'cuantia': self.apply_copago(codigo_ayuda, cuantia),
+            'cuantia_bruta': cuantia,
+            'profesional': profesional,
+            'metodo_pago': metodo_pago,
+            'fecha_actual': datetime.now().strftime("%d de %B de %Y")
+        })
+        return context, ""
+
+    def apply_copago(self, codigo_ayuda: str, cuantia: str) -> str:
+        """Return the amount to print on the receipt, discounting the copago if applicable."""
+        ayuda = self.catalogo.get(codigo_ayuda)
+        if ayuda and ayuda.copago:  # Verifica si la ayuda requiere copago
+            try:
+                cuantia_float = float(cuantia.replace(',', '.'))
+                copago = self.catalogo.copago(codigo_ayuda, cuantia_float)
+                cuantia_final = cuantia_float - copago
+                return f"{cuantia_final:.2f}"  # Cuantía sin el copago y sin el símbolo
+            except ValueError:
+                return cuantia  # Mantener la cuantía original si hay error
+        return cuantia  # Mantener la cuantía original
+
+    def ledger_warnings(self, numero_siria: str, codigo_ayuda: str, cuantia_str: str, context: Optional[Dict] = None,
+                        en_lote: Optional[Dict[Tuple[str, str], Tuple[int, float]]] = None) -> str:
+        """Return a warning if this aid was already issued to the person this month or would exceed its maximum, or ''.
+
+        With context, a receipt already in the ledger (a reprint, which is not
+        recorded again) gives no warning. en_lote holds the receipts and amount
+        per (SIRIA, code) of the batch being generated, not recorded yet: they
+        count as issued, and this receipt is added to them.
+        """
+        numero_siria = normalize_siria(numero_siria)
+        try:
+            cuantia = float(cuantia_str.replace(',', '.'))
+            if context is not None and self.registro.recorded(context):
+                return ""
+            totales = self.registro.beneficiary_totals(numero_siria, codigo_ayuda, datetime.now().strftime('%Y-%m'))
+        except ValueError:
+            return ""
+        except sqlite3.Error as e:
+            logger.warning("No se pudo consultar el registro de recibís: %s", e)
+            return ""
+
+        recibos, total, del_lote = totales.recibos, totales.cuantia, 0
+        if en_lote is not None:
+            del_lote, cuantia_lote = en_lote.get((numero_siria, codigo_ayuda), (0, 0.0))
+            en_lote[(numero_siria, codigo_ayuda)] = (del_lote + 1, cuantia_lote + cuantia)
+            recibos += del_lote
+            total += cuantia_lote
+        if not recibos:
+            return ""
+
+        en_este_lote = f" ({del_lote} en este lote)" if del_lote else ""
+        avisos = [f"Este mes ya se han emitido {recibos} recibí(s){en_este_lote} de {codigo_ayuda} a esta persona "
+                  f"por un total de {total:.2f} euros."]
+        ayuda = self.catalogo.get(codigo_ayuda)
+        if ayuda and ayuda.maximo is not None and total + cuantia > ayuda.maximo:
+            avisos.append(f"Con este recibí el total del mes ({total + cuantia:.2f} euros) "
+                          f"supera el máximo de {ayuda.maximo} euros.")
+        return "\n".join(avisos)
+
+    def record_receipt(self, context: Dict, archivo: str = ''):
+        """Add an issued receipt to the ledger; a ledger failure never stops the receipt."""
+        try:
+            cuantia = float(context['cuantia_bruta'].replace(',', '.'))
+            self.registro.record(context, self.catalogo.copago(context['codigo_ayuda'], cuantia), archivo)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning("No se pudo anotar el recibí en el registro: %s", e)
+
+    def default_amount(self, codigo_ayuda: str, cuantia: str) -> str:
+        """Return the amount given, or the aid's predefined amount when it is empty."""
+        ayuda = self.catalogo.get(codigo_ayuda)
+        if not cuantia and ayuda and ayuda.cuantia is not None:
+            return str(ayuda.cuantia)
+        return cuantia
+
+    def build_unattended_context(self, numero_siria: str, numero_siria_titular: str, codigo_ayuda: str,
+                                 cuantia: str, profesional: str, metodo_pago: str) -> Tuple[Optional[Dict], str]:
+        """Validate a receipt request and build its context without asking anything.
+
+        For minors the titular given is used or, if empty, the one in the roster.
+        Returns (context, error_message) like build_context.
+        """
+        is_valid, error_message = self.validate_values(numero_siria, codigo_ayuda, cuantia)
+        if not is_valid:
+            return None, error_message
+
+        is_minor, fecha_nacimiento, siria_titular = self.is_minor(numero_siria)
+        if not is_minor:
+            numero_siria_titular = None
+        elif not numero_siria_titular:
+            numero_siria_titular = siria_titular
+            if not numero_siria_titular:
+                return None, "Se requiere el número SIRIA del titular para menores de edad."
+
+        return self.build_context(numero_siria, numero_siria_titular, codigo_ayuda, cuantia, profesional, metodo_pago)
+
+    def build_household_contexts(self, hogar: Hogar, codigo_ayuda: str, cuantia: str, profesional: str,
+                                 metodo_pago: str, miembros: Optional[List[str]] = None) -> List[Tuple[str, Optional[Dict], str]]:
+        """Build the receipt context of every member of a household, or of the members given.
+
+        Minors use the titular named in their row or, if it is not in the roster,
+        the household's titular; each titular's data is looked up only once.
+        Returns (numero_siria, context, error_message) per member.
+        """
+        miembros = list(hogar.miembros if miembros is None else miembros)
+        is_valid, error_message = self.validate_aid_values(codigo_ayuda, cuantia)
+        if not is_valid:
+            return [(numero_siria, None, error_message) for numero_siria in miembros]
+
+        datos_titulares: Dict[str, Optional[Dict]] = {}
+        resultados = []
+        for numero_siria in miembros:
+            persona = self.find_beneficiary(numero_siria)
+            numero_siria_titular = None
+            if persona is not None and persona.es_menor:
+                numero_siria_titular = persona.siria_titular if persona.siria_titular in self.beneficiarios else hogar.numero_siria_titular
+                if not numero_siria_titular:
+                    resultados.append((numero_siria, None, "Se requiere el número SIRIA del titular para menores de edad."))
+                    continue
+                if numero_siria_titular not in datos_titulares:
+                    datos_titulares[numero_siria_titular] = self.get_person_data(numero_siria_titular, is_titular=True)
+
+            context, error_message = self.build_context(
+                numero_siria, numero_siria_titular, codigo_ayuda, cuantia, profesional, metodo_pago,
+                datos_titular=datos_titulares.get(numero_siria_titular))
+            resultados.append((numero_siria, context, error_message))
+        return resultados
+
+    def build_output_filename(self, context: Dict, numero_siria: str) -> str:
+        """Build the receipt filename from the beneficiary's name and the current date."""
+        # Definir la fecha actual
+        fecha_actual = datetime.now().strftime("%Y.%m.%d")  # Formato: YYYY.MM.DD
+
+        # Dos primeras letras del nombre y apellido del menor, o de la persona si es adulta
+        prefix = 'menor_' if 'menor_nombre' in context else 'titular_'
+        nombre = str(context[f'{prefix}nombre'])[:2].upper()
+        apellido = str(context[f'{prefix}apellidos'])[:2].upper()
+        return f"{nombre}.{apellido}_{numero_siria}_{fecha_actual}.docx"
+
+    def render_bytes(self, context: Dict) -> bytes:
+        """Render the receipt template with the given context and return the DOCX file contents.
+
+        Receipts already rendered with the same context and template come from the render cache.
+        """
+        # Verificar si existe la plantilla
+        if not os.path.exists(self.template_path):
+            raise FileNotFoundError("No se encuentra el archivo de plantilla 'plantilla_recibo.docx'")
+
+        from recibi_render import get_template_cache
+
+        with instrumentation.stage('plantilla'):
+            cache = get_template_cache(self.template_path)
+            template_digest = cache.refresh()
+            self.render_cache.set_template(template_digest)
+            clave = RenderCache.key(context, template_digest)
+        documento = self.render_cache.get(clave)
+        if documento is not None:
+            logger.debug("Recibí tomado de la caché de render")
+            return documento
+
+        # Obtener una copia de la plantilla ya cargada y compilada
+        with instrumentation.stage('plantilla'):
+            template = cache.new_template()
+
+        # Renderizar el documento en memoria
+        with instrumentation.stage('render'):
+            template.render(context)
+            buffer = io.BytesIO()
+            template.save(buffer)
+        documento = buffer.getvalue()
+        self.render_cache.put(clave, documento, RenderCache.context_sirias(context))
+        return documento
+
+    def read_work_order(self, orden_path: str) -> pd.DataFrame:
+        """Read a batch work order (CSV or Excel) and map its columns to receipt fields."""
+        import pandas as pd
+
+        if orden_path.lower().endswith('.csv'):
+            orden = pd.read_csv(orden_path, dtype=str, sep=None, engine='python')
+        else:
+            orden = pd.read_excel(orden_path, dtype=str)
+
+        columnas = {}
+        for columna in orden.columns:
+            cabecera = normalize_header(columna)
+            for campo, alias in COLUMNAS_ORDEN.items():
+                if cabecera in alias and campo not in columnas.values():
+                    columnas[columna] = campo
+        orden = orden.rename(columns=columnas)[list(columnas.values())]
+
+        for campo in ('numero_siria', 'codigo_ayuda'):
+            if campo not in orden.columns:
+                raise ValueError(f"Falta la columna '{COLUMNAS_ORDEN[campo][0]}' en la hoja de órdenes.")
+        for campo in COLUMNAS_ORDEN:
+            if campo not in orden.columns:
+                orden[campo] = ''
+        return orden.fillna('')
+
+    def generate_batch(self, orden_path: str, output_dir: str, workers: int = 1, formato: str = 'docx',
+                       combinado: Optional[str] = None, zip_path: Optional[str] = None,
+                       omitir_incompletos: bool = False) -> List[Dict]:
+        """Generate every receipt listed in a work order without GUI and return one result per row.
+
+        If combinado and/or zip_path are given, every receipt is also appended, as soon as
+        it is rendered, to a single printable DOCX and/or a ZIP of the individual files.
+        Rows whose person has incomplete roster data are generated with a warning or,
+        with omitir_incompletos, skipped as errors before anything is rendered.
+        """
+        orden = self.read_work_order(orden_path)
+        # La primera fila de órdenes es la 2 de la hoja, tras la cabecera
+        return self.generate_orders(orden.to_dict('records'), output_dir, workers, formato, combinado, zip_path,
+                                    omitir_incompletos, primera_fila=2)
+
+    def generate_orders(self, ordenes: List[Dict[str, str]], output_dir: str, workers: int = 1, formato: str = 'docx',
+                        combinado: Optional[str] = None, zip_path: Optional[str] = None,
+                        omitir_incompletos: bool = False, primera_fila: int = 1,
+                        pool=None, converter=None) -> List[Dict]:
+        """Generate the receipts of work order rows (dicts with the COLUMNAS_ORDEN fields as text); see generate_batch.
+
+        pool (a recibi_render.render_pool of `workers` processes) and converter
+        (a PdfConverter) are used instead of starting new ones and are left
+        open, for callers that generate several groups of orders in a row.
+        """
+        from recibi_render import PdfConverter, MergedDocumentWriter, iter_render_jobs
+        from recibi_salida import OutputSink
+
+        os.makedirs(output_dir, exist_ok=True)
+        resultados = []
+        jobs = []
+        job_resultados = []
+        en_lote: Dict[Tuple[str, str], Tuple[int, float]] = {}
+
+        for fila, orden_fila in enumerate(ordenes, start=primera_fila):
+            numero_siria = orden_fila['numero_siria'].strip().replace(" ", "")
+            codigo_ayuda = orden_fila['codigo_ayuda'].strip().upper()
+            cuantia = self.default_amount(codigo_ayuda, orden_fila['cuantia'].strip())
+            resultado = {'fila': fila, 'numero_siria': numero_siria, 'codigo_ayuda': codigo_ayuda,
+                         'cuantia': cuantia, 'archivo': '', 'estado': 'ERROR', 'error': '', 'aviso': ''}
+            resultados.append(resultado)
+
+            numero_siria_titular = orden_fila['numero_siria_titular'].strip().replace(" ", "")
+            problemas = self.roster_problems(numero_siria, con_titular=bool(numero_siria_titular))
+            if problemas and omitir_incompletos:
+                resultado['error'] = f"Datos incompletos en el listado: {problemas}."
+                continue
+
+            # En lote no se pregunta: para menores se usa el titular de la orden o, si no hay, el del Excel
+            context, error_message = self.build_unattended_context(
+                numero_siria,
+                numero_siria_titular,
+                codigo_ayuda,
+                cuantia,
+                orden_fila['profesional'].strip(),
+                orden_fila['metodo_pago'].strip() or "Efectivo"
+            )
+            if context is None:
+                resultado['error'] = error_message
+                continue
+
+            # Lo ya emitido este mes, o antes en esta misma orden, solo se avisa; el lote genera el recibí igualmente
+            avisos = [self.ledger_warnings(numero_siria, codigo_ayuda, cuantia, context, en_lote).replace("\n", " ")]
+            if problemas:
+                avisos.append(f"Datos incompletos en el listado: {problemas}.")
+            resultado['aviso'] = " ".join(aviso for aviso in avisos if aviso)
+            resultado['archivo'] = self.build_output_filename(context, numero_siria)
+            resultado['cuantia'] = context['cuantia']
+            jobs.append(context)
+            job_resultados.append(resultado)
+
+        # Los procesos solo renderizan; los recibís se escriben en la carpeta de salida por tandas,
+        # cada uno en un temporal que se renombra al terminar. Los PDF se van convirtiendo a medida que salen.
+        salida = OutputSink(output_dir)
+        propio = converter is None and formato == 'pdf' and bool(jobs)
+        if propio:
+            converter = PdfConverter()
+        elif formato != 'pdf':
+            converter = None
+        writer = MergedDocumentWriter(combinado, zip_path) if combinado or zip_path else None
+        conversiones = []
+        try:
+            for resultado, (error, documento) in zip(job_resultados, iter_render_jobs(self.template_path, jobs, workers, pool)):
+                if error:
+                    resultado['archivo'] = ''
+                    resultado['error'] = error
+                    continue
+                if converter:
+                    conversiones.append((resultado, converter.submit_document(documento, resultado['archivo'])))
+                else:
+                    # En el ZIP va el nombre definitivo, que cambia si ya había otro recibí con el mismo;
+                    # una reimpresión guardada sobre el mismo archivo no se repite en el ZIP
+                    resultado['archivo'] = salida.add(resultado['archivo'], documento)
+                    resultado['estado'] = 'OK'
+                if writer:
+                    writer.add(salida.final_path(resultado['archivo']), documento)
+
+            for resultado, conversion in conversiones:
+                try:
+                    pdf_path = conversion.result()
+                    with open(pdf_path, 'rb') as f:
+                        pdf = f.read()
+                    os.remove(pdf_path)
+                    resultado['archivo'] = salida.add(os.path.splitext(resultado['archivo'])[0] + '.pdf', pdf)
+                    resultado['estado'] = 'OK'
+                except Exception as e:
+                    resultado['archivo'] = ''
+                    resultado['error'] = f"Error al convertir a PDF: {str(e)}"
+        finally:
+            salida.flush()
+            if propio:
+                converter.close()
+            if writer:
+                writer.close()
+
+        for resultado, context in zip(job_resultados, jobs):
+            if resultado['estado'] != 'OK':
+                continue
+            if resultado['archivo'] in salida.errores:
+                resultado['estado'] = 'ERROR'
+                resultado['error'] = f"No se pudo guardar: {salida.errores[resultado['archivo']]}"
+                continue
+            resultado['archivo'] = salida.final_path(resultado['archivo'])
+            self.record_receipt(context, resultado['archivo'])
+        return resultados
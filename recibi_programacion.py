@@ -0,0 +1,205 @@
+"""Recurring aid schedules and the runner that generates only the receipts still missing in a period."""
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from recibi_motor import ReceiptEngine, Beneficiario, cell_text, program_dir
+
+logger = logging.getLogger("generar_recibi")
+
+SCHEDULES_FILENAME = "programaciones.json"
+
+# Campos de Beneficiario que no se imprimen tal cual en el recibí y no cuentan en su huella
+CAMPOS_SIN_HUELLA = ('edad', 'fecha_nacimiento')
+
+# Grupos de beneficiarias/os a los que se puede dirigir una programación
+GRUPOS = ('todas', 'adultos', 'menores', 'titulares')
+
+class Programacion(NamedTuple):
+    """Recurring aid given every month to a group of beneficiaries."""
+    nombre: str
+    codigos: Tuple[str, ...]  # Un código, o uno por tamaño de la unidad familiar (el último sirve para las mayores)
+    beneficiarias: str
+    situaciones: Tuple[str, ...]  # Situaciones legales a las que se limita; vacío para todas
+    cuantia: str  # Vacía para usar la cuantía predefinida de la ayuda
+    profesional: str
+    metodo_pago: str
+
+def load_schedules(path: Optional[str] = None) -> Dict[str, Programacion]:
+    """Load the schedules from programaciones.json next to the program, keyed by name.
+
+    The file is a JSON list of {nombre, codigo_ayuda, beneficiarias, situaciones,
+    cuantia, profesional, metodo_pago} objects; codigo_ayuda may be a list with
+    the code for a household of 1, 2, 3... members.
+    """
+    path = path or os.path.join(program_dir(), SCHEDULES_FILENAME)
+    with open(path, encoding='utf-8') as f:
+        entradas = json.load(f)
+
+    programaciones = {}
+    for entrada in entradas:
+        nombre = str(entrada.get('nombre') or '').strip()
+        codigos = entrada.get('codigo_ayuda')
+        if isinstance(codigos, str):
+            codigos = [codigos]
+        if not nombre or not codigos:
+            raise ValueError(f"Programación sin nombre o código de ayuda en {path}: {entrada}")
+        beneficiarias = entrada.get('beneficiarias', 'todas')
+        if beneficiarias not in GRUPOS:
+            raise ValueError(f"Grupo de beneficiarias/os desconocido en la programación '{nombre}': {beneficiarias} "
+                             f"(debe ser {', '.join(GRUPOS)})")
+        cuantia = entrada.get('cuantia')
+        programaciones[nombre] = Programacion(
+            nombre=nombre,
+            codigos=tuple(str(codigo).strip().upper() for codigo in codigos),
+            beneficiarias=beneficiarias,
+            situaciones=tuple(entrada.get('situaciones') or ()),
+            cuantia='' if cuantia is None else str(cuantia),
+            profesional=str(entrada.get('profesional') or ''),
+            metodo_pago=str(entrada.get('metodo_pago') or 'Efectivo'),
+        )
+    return programaciones
+
+class ScheduleRunner:
+    """Generate the receipts of a schedule for one month, only for the people that still need one.
+
+    A person needs a receipt if the schedule has not done them yet this month
+    or if something printed on their receipt changed since: their data, their
+    titular's, the aid code (e.g. the household grew) or the amount. Changes
+    to roster columns that are not printed, or to how a column was read
+    (e.g. a date typed as text in another row), do not count.
+    People who already got the aid this month outside the schedule (e.g. from
+    the window) are left out.
+
+    Receipts are generated in chunks, and each chunk is saved in the ledger's
+    checkpoint as soon as its files are written, so an interrupted run
+    resumes where it stopped. The render processes and the PDF converter are
+    started once per run and shared by all chunks.
+    """
+
+    def __init__(self, engine: ReceiptEngine, programacion: Programacion, periodo: Optional[str] = None):
+        self.engine = engine
+        self.programacion = programacion
+        self.periodo = periodo or datetime.now().strftime('%Y-%m')
+
+    def eligible(self) -> List[str]:
+        """SIRIA numbers of the schedule's group, in roster order."""
+        grupo = self.programacion.beneficiarias
+        situaciones = self.programacion.situaciones
+        titulares = {hogar.numero_siria_titular for hogar in self.engine.hogares.values()} if grupo == 'titulares' else None
+        elegibles = []
+        for numero_siria, persona in self.engine.beneficiarios.items():
+            if (grupo == 'adultos' and persona.es_menor) or (grupo == 'menores' and not persona.es_menor):
+                continue
+            if titulares is not None and numero_siria not in titulares:
+                continue
+            if situaciones and persona.tipo_proteccion not in situaciones:
+                continue
+            elegibles.append(numero_siria)
+        return elegibles
+
+    def aid_code(self, numero_siria: str) -> str:
+        """The schedule's aid code for a person, chosen by the size of their household if it has several."""
+        codigos = self.programacion.codigos
+        if len(codigos) == 1:
+            return codigos[0]
+        hogar = self.engine.find_household(numero_siria)
+        miembros = len(hogar.miembros) if hogar else 1
+        return codigos[min(miembros, len(codigos)) - 1]
+
+    @staticmethod
+    def receipt_values(persona: Optional[Beneficiario]) -> List[str]:
+        """A person's data that can appear on a receipt, as text that does not depend on how the roster was read."""
+        if persona is None:
+            return ['']
+        # La edad cambia con cada cumpleaños sin cambiar el recibí (que sea menor sí lo cambia),
+        # y la fecha de nacimiento se imprime desde fecha_nacimiento_str
+        return [cell_text(valor) for campo, valor in zip(persona._fields, persona) if campo not in CAMPOS_SIN_HUELLA]
+
+    def order(self, numero_siria: str) -> Tuple[Dict[str, str], str]:
+        """Return the work order row of a person and the fingerprint of everything on their receipt."""
+        programacion = self.programacion
+        beneficiarios = self.engine.beneficiarios
+        persona = beneficiarios[numero_siria]
+        codigo_ayuda = self.aid_code(numero_siria)
+        valores = [
+            codigo_ayuda,
+            self.engine.default_amount(codigo_ayuda, programacion.cuantia),
+            programacion.profesional,
+            programacion.metodo_pago,
+            *self.receipt_values(persona),
+            *(self.receipt_values(beneficiarios.get(persona.siria_titular)) if persona.es_menor else []),
+        ]
+        huella = hashlib.sha1("\x1f".join(valores).encode('utf-8')).hexdigest()
+        # El titular de los menores se toma del Excel, como en el modo por lotes
+        orden = {
+            'numero_siria': numero_siria,
+            'codigo_ayuda': codigo_ayuda,
+            'cuantia': programacion.cuantia,
+            'profesional': programacion.profesional,
+            'metodo_pago': programacion.metodo_pago,
+            'numero_siria_titular': '',
+        }
+        return orden, huella
+
+    def plan(self) -> Tuple[List[Tuple[Dict[str, str], str]], Dict[str, int]]:
+        """Return the (order, fingerprint) of the people still to do, and how many people are in each situation."""
+        registro = self.engine.registro
+        hechas = registro.scheduled_done(self.programacion.nombre, self.periodo)
+        emitidas = registro.issued_in_month(self.periodo)
+
+        pendientes = []
+        cuentas = {'elegibles': 0, 'hechas': 0, 'emitidas_aparte': 0, 'nuevas': 0, 'cambiadas': 0}
+        for numero_siria in self.eligible():
+            cuentas['elegibles'] += 1
+            orden, huella = self.order(numero_siria)
+            previa = hechas.get(numero_siria)
+            if previa == huella:
+                cuentas['hechas'] += 1
+                continue
+            if previa is None and (numero_siria, orden['codigo_ayuda']) in emitidas:
+                cuentas['emitidas_aparte'] += 1
+                continue
+            cuentas['cambiadas' if previa else 'nuevas'] += 1
+            pendientes.append((orden, huella))
+        return pendientes, cuentas
+
+    def run(self, pendientes: List[Tuple[Dict[str, str], str]], output_dir: str, workers: int = 1,
+            formato: str = 'docx', omitir_incompletos: bool = False, tanda: int = 50,
+            progreso: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+        """Generate the pending receipts of plan() chunk by chunk and return one result per receipt, like generate_batch.
+
+        After each chunk, the people whose receipt was written are saved in
+        the checkpoint and progreso(done, total) is called.
+        """
+        from recibi_render import PdfConverter, render_pool
+
+        resultados = []
+        workers = max(1, min(workers, tanda, len(pendientes)))
+        pool = render_pool(self.engine.template_path, workers) if workers > 1 else None
+        converter = None
+        try:
+            converter = PdfConverter() if formato == 'pdf' and pendientes else None
+            for inicio in range(0, len(pendientes), tanda):
+                bloque = pendientes[inicio:inicio + tanda]
+                generados = self.engine.generate_orders(
+                    [orden for orden, _ in bloque], output_dir, workers, formato,
+                    omitir_incompletos=omitir_incompletos, primera_fila=inicio + 1, pool=pool, converter=converter)
+                self.engine.registro.record_scheduled(self.programacion.nombre, self.periodo, [
+                    (orden['numero_siria'], huella, resultado['archivo'])
+                    for (orden, huella), resultado in zip(bloque, generados) if resultado['estado'] == 'OK'
+                ])
+                resultados.extend(generados)
+                logger.info("Programación %s (%s): %d de %d", self.programacion.nombre, self.periodo,
+                            len(resultados), len(pendientes))
+                if progreso:
+                    progreso(len(resultados), len(pendientes))
+        finally:
+            if converter:
+                converter.close()
+            if pool:
+                pool.shutdown()
+        return resultados
@@ -0,0 +1,168 @@
+"""Append-only ledger of issued receipts, stored in SQLite next to the program."""
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, NamedTuple, Set, Tuple
+
+LEDGER_FILENAME = "registro_recibis.sqlite"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS recibos (
+    id INTEGER PRIMARY KEY,
+    fecha TEXT NOT NULL,
+    mes TEXT NOT NULL,
+    numero_siria TEXT NOT NULL,
+    numero_siria_titular TEXT,
+    codigo_ayuda TEXT NOT NULL,
+    cuantia REAL NOT NULL,
+    copago REAL NOT NULL,
+    neto REAL NOT NULL,
+    profesional TEXT,
+    metodo_pago TEXT,
+    archivo TEXT,
+    huella TEXT NOT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS recibos_beneficiaria ON recibos (numero_siria, codigo_ayuda, mes);
+CREATE INDEX IF NOT EXISTS recibos_mes ON recibos (mes, codigo_ayuda);
+CREATE TRIGGER IF NOT EXISTS recibos_sin_modificar BEFORE UPDATE ON recibos
+BEGIN SELECT RAISE(ABORT, 'El registro de recibís no se puede modificar'); END;
+CREATE TRIGGER IF NOT EXISTS recibos_sin_borrar BEFORE DELETE ON recibos
+BEGIN SELECT RAISE(ABORT, 'El registro de recibís no se puede modificar'); END;
+CREATE TABLE IF NOT EXISTS programadas (
+    programacion TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    numero_siria TEXT NOT NULL,
+    huella TEXT NOT NULL,
+    archivo TEXT,
+    fecha TEXT NOT NULL,
+    PRIMARY KEY (programacion, periodo, numero_siria)
+);
+"""
+
+class Totales(NamedTuple):
+    """Receipts issued and amounts for one aid code."""
+    codigo_ayuda: str
+    recibos: int
+    cuantia: float
+    copago: float
+    neto: float
+
+class ReceiptLedger:
+    """Record of every receipt issued, with per-beneficiary and per-month totals.
+
+    Rows can only be added; reprinting the same receipt (same context, same
+    day) is recorded once. The connection is opened on first use and shared
+    between threads.
+
+    It also keeps the checkpoint of the scheduled runs (table programadas):
+    the people already done for each schedule and period, with a fingerprint
+    of their data. Unlike the receipts, these rows are replaced when a
+    person's receipt is generated again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conexion = None
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conexion is None:
+            conexion = sqlite3.connect(self.path, check_same_thread=False)
+            # El registro puede estar en una carpeta compartida de red, donde WAL no funciona: se usa el
+            # diario clásico, y se fija explícitamente para que un registro creado antes en WAL vuelva a él
+            conexion.execute("PRAGMA journal_mode=DELETE")
+            conexion.executescript(ESQUEMA)
+            self.conexion = conexion
+        return self.conexion
+
+    def close(self):
+        with self.lock:
+            if self.conexion is not None:
+                self.conexion.close()
+                self.conexion = None
+
+    @staticmethod
+    def fingerprint(context: Dict) -> str:
+        """Identify a receipt by its full context, which includes the date it was issued."""
+        datos = json.dumps(context, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(datos.encode('utf-8')).hexdigest()
+
+    def record(self, context: Dict, copago: float, archivo: str = '', fecha: Optional[datetime] = None) -> bool:
+        """Add an issued receipt; return False if the same receipt was already recorded."""
+        fecha = fecha or datetime.now()
+        es_menor = bool(context.get('menor_numero_siria_beneficiaria'))
+        fila = (
+            fecha.isoformat(timespec='seconds'),
+            fecha.strftime('%Y-%m'),
+            str(context['menor_numero_siria_beneficiaria' if es_menor else 'titular_numero_siria_beneficiaria']),
+            str(context['titular_numero_siria_beneficiaria']) if es_menor else None,
+            context['codigo_ayuda'],
+            float(context['cuantia_bruta'].replace(',', '.')),
+            copago,
+            float(context['cuantia'].replace(',', '.')),
+            context.get('profesional'),
+            context.get('metodo_pago'),
+            archivo,
+            self.fingerprint(context),
+        )
+        with self.lock:
+            conexion = self.connect()
+            with conexion:
+                cursor = conexion.execute(
+                    "INSERT OR IGNORE INTO recibos (fecha, mes, numero_siria, numero_siria_titular, codigo_ayuda, "
+                    "cuantia, copago, neto, profesional, metodo_pago, archivo, huella) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", fila)
+            return cursor.rowcount == 1
+
+    def recorded(self, context: Dict) -> bool:
+        """Whether this receipt (same context, see fingerprint) is already in the ledger."""
+        with self.lock:
+            fila = self.connect().execute(
+                "SELECT 1 FROM recibos WHERE huella = ?", (self.fingerprint(context),)).fetchone()
+        return fila is not None
+
+    def beneficiary_totals(self, numero_siria: str, codigo_ayuda: str, mes: str) -> Totales:
+        """Totals of one aid code issued to a beneficiary in a month ('YYYY-MM')."""
+        with self.lock:
+            n, cuantia, copago, neto = self.connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(cuantia), 0), COALESCE(SUM(copago), 0), COALESCE(SUM(neto), 0) "
+                "FROM recibos WHERE numero_siria = ? AND codigo_ayuda = ? AND mes = ?",
+                (numero_siria, codigo_ayuda, mes)).fetchone()
+        return Totales(codigo_ayuda, n, cuantia, copago, neto)
+
+    def month_totals(self, mes: str) -> List[Totales]:
+        """Totals per aid code of every receipt issued in a month ('YYYY-MM')."""
+        with self.lock:
+            filas = self.connect().execute(
+                "SELECT codigo_ayuda, COUNT(*), SUM(cuantia), SUM(copago), SUM(neto) "
+                "FROM recibos WHERE mes = ? GROUP BY codigo_ayuda ORDER BY codigo_ayuda", (mes,)).fetchall()
+        return [Totales(*fila) for fila in filas]
+
+    def issued_in_month(self, mes: str) -> Set[Tuple[str, str]]:
+        """(numero_siria, codigo_ayuda) of every receipt issued in a month ('YYYY-MM')."""
+        with self.lock:
+            filas = self.connect().execute(
+                "SELECT DISTINCT numero_siria, codigo_ayuda FROM recibos WHERE mes = ?", (mes,)).fetchall()
+        return set(filas)
+
+    def scheduled_done(self, programacion: str, periodo: str) -> Dict[str, str]:
+        """Fingerprint of each person already done for a schedule and period."""
+        with self.lock:
+            filas = self.connect().execute(
+                "SELECT numero_siria, huella FROM programadas WHERE programacion = ? AND periodo = ?",
+                (programacion, periodo)).fetchall()
+        return dict(filas)
+
+    def record_scheduled(self, programacion: str, periodo: str, hechas: Iterable[Tuple[str, str, str]],
+                         fecha: Optional[datetime] = None):
+        """Mark (numero_siria, huella, archivo) as done for a schedule and period, in a single transaction."""
+        fecha = (fecha or datetime.now()).isoformat(timespec='seconds')
+        with self.lock:
+            conexion = self.connect()
+            with conexion:
+                conexion.executemany(
+                    "INSERT OR REPLACE INTO programadas (programacion, periodo, numero_siria, huella, archivo, fecha) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(programacion, periodo, numero_siria, huella, archivo, fecha) for numero_siria, huella, archivo in hechas])
@@ -0,0 +1,418 @@
+"""Receipt rendering with docxtpl: template cache, render pool, PDF conversion and merged documents."""
+import os
+import re
+import io
+import hashlib
+import itertools
+import queue
+import shutil
+import tempfile
+import threading
+import zipfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Tuple, Dict, Optional, List
+
+from docx import Document
+from docxtpl import DocxTemplate
+from jinja2 import Template
+
+from recibi_motor import instrumentation, measure
+
+class PreparedDocxTemplate(DocxTemplate):
+    """DocxTemplate that renders an in-memory copy of the template with precompiled Jinja parts."""
+
+    def __init__(self, blob: bytes, compiled: Dict):
+        super().__init__(io.BytesIO(blob))
+        self._blob = blob
+        self._compiled = compiled
+
+    def init_docx(self, reload: bool = True):
+        if not self.docx or (self.is_rendered and reload):
+            self.docx = Document(io.BytesIO(self._blob))
+            self.is_rendered = False
+
+    def render_compiled(self, template: Template, part, context: Dict) -> str:
+        """Render a precompiled part and undo the preprocessing done by docxtpl."""
+        self.current_rendering_part = part
+        dst_xml = template.render(context)
+        dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+        dst_xml = (
+            dst_xml.replace("{_{", "{{")
+            .replace("}_}", "}}")
+            .replace("{_%", "{%")
+            .replace("%_}", "%}")
+        )
+        return self.resolve_listing(dst_xml)
+
+    def build_xml(self, context, jinja_env=None):
+        return self.render_compiled(self._compiled['body'], self.docx._part, context)
+
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        for relKey, part in self.get_headers_footers(uri):
+            template, encoding = self._compiled[relKey]
+            yield relKey, self.render_compiled(template, part, context).encode(encoding)
+
+class TemplateCache:
+    """Keep the receipt template loaded and precompiled, reloading it when the file changes."""
+
+    def __init__(self, template_path: str):
+        self.template_path = template_path
+        self.mtime = None
+        self.blob = None
+        self.digest = None
+        self.compiled = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the template into memory and precompile its body, headers and footers."""
+        mtime = os.path.getmtime(self.template_path)
+        with open(self.template_path, 'rb') as f:
+            blob = f.read()
+
+        # El preprocesado de docxtpl (patch_xml) y la compilación de Jinja se hacen una sola vez
+        template = DocxTemplate(io.BytesIO(blob))
+        template.init_docx()
+        compiled = {'body': Template(self.prepare_xml(template, template.get_xml()))}
+        for uri in (DocxTemplate.HEADER_URI, DocxTemplate.FOOTER_URI):
+            for relKey, part in template.get_headers_footers(uri):
+                xml = template.get_part_xml(part)
+                encoding = template.get_headers_footers_encoding(xml)
+                compiled[relKey] = (Template(self.prepare_xml(template, xml)), encoding)
+
+        self.blob = blob
+        self.digest = hashlib.sha256(blob).hexdigest()
+        self.compiled = compiled
+        self.mtime = mtime
+
+    @staticmethod
+    def prepare_xml(template: DocxTemplate, xml: str) -> str:
+        """Apply the same preprocessing docxtpl does before compiling a part."""
+        xml = template.patch_xml(xml)
+        return re.sub(r"<w:p([ >])", r"\n<w:p\1", xml)
+
+    def refresh(self) -> str:
+        """Reload the file if it has changed and return the SHA-256 of the current template."""
+        with self.lock:
+            if self.blob is None or os.path.getmtime(self.template_path) != self.mtime:
+                self.load()
+            return self.digest
+
+    def new_template(self) -> PreparedDocxTemplate:
+        """Return a fresh template ready to render, reloading the file if it has changed."""
+        with self.lock:
+            if self.blob is None or os.path.getmtime(self.template_path) != self.mtime:
+                self.load()
+            return PreparedDocxTemplate(self.blob, self.compiled)
+
+# Una caché de plantilla por ruta y por proceso
+_template_caches: Dict[str, TemplateCache] = {}
+
+def get_template_cache(template_path: str) -> TemplateCache:
+    """Return the process-wide cache for the given template path."""
+    cache = _template_caches.get(template_path)
+    if cache is None:
+        cache = _template_caches[template_path] = TemplateCache(template_path)
+    return cache
+
+def init_render_worker(template_path: str):
+    """Load the template once in each worker process of the render pool."""
+    get_template_cache(template_path).load()
+
+def render_job(template_path: str, context: Dict) -> Tuple[str, Dict[str, float], bytes]:
+    """Render one receipt in memory.
+
+    Returns (error message or '', seconds per stage, DOCX contents) so that
+    timings measured in a worker process can be added to the main process;
+    the caller decides where the document is saved.
+    """
+    tiempos = {}
+    try:
+        with measure(tiempos, 'plantilla'):
+            template = get_template_cache(template_path).new_template()
+        with measure(tiempos, 'render'):
+            template.render(context)
+            buffer = io.BytesIO()
+            template.save(buffer)
+        return "", tiempos, buffer.getvalue()
+    except Exception as e:
+        return f"Error al generar el documento: {str(e)}", tiempos, b''
+
+def render_pool(template_path: str, workers: int) -> ProcessPoolExecutor:
+    """Process pool for iter_render_jobs; each process loads its own copy of the template when it starts."""
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker, initargs=(template_path,))
+
+def iter_render_jobs(template_path: str, contexts: List[Dict], workers: int = 1,
+                     pool: Optional[ProcessPoolExecutor] = None):
+    """Render contexts, in a process pool if workers > 1.
+
+    Yields one (error message or '', DOCX contents) per context as soon as it
+    is available, in the same order as the contexts. pool is a render_pool()
+    of `workers` processes to use instead of starting one, for callers that
+    render several groups of receipts in a row.
+    """
+    if not os.path.exists(template_path):
+        yield from [("No se encuentra el archivo de plantilla 'plantilla_recibo.docx'", b'')] * len(contexts)
+        return
+
+    workers = max(1, min(workers, len(contexts)))
+    if workers == 1:
+        for context in contexts:
+            error, tiempos, documento = render_job(template_path, context)
+            instrumentation.add(tiempos)
+            yield error, documento
+        return
+
+    chunksize = max(1, len(contexts) // (workers * 4))
+    executor = pool or render_pool(template_path, workers)
+    try:
+        for error, tiempos, documento in executor.map(
+                render_job, [template_path] * len(contexts), contexts, chunksize=chunksize):
+            instrumentation.add(tiempos)
+            yield error, documento
+    finally:
+        if pool is None:
+            executor.shutdown()
+
+# Rutas habituales de LibreOffice en Windows, por si no está en el PATH
+SOFFICE_WINDOWS = (
+    r"C:\Program Files\LibreOffice\program\soffice.exe",
+    r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
+)
+
+def find_soffice() -> Optional[str]:
+    """Return the path of the LibreOffice executable, or None if it is not installed."""
+    for nombre in ('soffice', 'libreoffice'):
+        ruta = shutil.which(nombre)
+        if ruta:
+            return ruta
+    for ruta in SOFFICE_WINDOWS:
+        if os.path.exists(ruta):
+            return ruta
+    return None
+
+class PdfConverter:
+    """Pool of background workers that convert DOCX files to PDF.
+
+    Queued files are converted in chunks, so each headless LibreOffice start
+    (a few seconds) is paid once per chunk instead of once per receipt. Each
+    worker uses its own LibreOffice profile so several can run at once and
+    they do not clash with an office instance the user has open. Without
+    LibreOffice it falls back to docx2pdf (Microsoft Word) if installed.
+
+    Documents given in memory (submit_document) are converted in a local
+    temporary directory, so the office suite never reads or writes the
+    network share where the receipts are kept.
+    """
+
+    def __init__(self, workers: int = 1, chunk_size: int = 50):
+        self.soffice = find_soffice()
+        if self.soffice is None:
+            try:
+                import docx2pdf  # noqa: F401
+            except ImportError:
+                raise RuntimeError("Para generar PDF hace falta LibreOffice o el paquete docx2pdf con Microsoft Word.")
+        self.chunk_size = chunk_size
+        self.pending = queue.Queue()
+        self.directorio = tempfile.mkdtemp(prefix="recibi_pdf_")
+        self.numero = itertools.count()
+        self.profiles = [tempfile.mkdtemp(prefix="recibi_lo_") for _ in range(workers)]
+        self.threads = [threading.Thread(target=self.worker, args=(profile,), daemon=True) for profile in self.profiles]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, docx_path: str) -> Future:
+        """Queue a DOCX file; the future's result is the path of the PDF."""
+        future = Future()
+        self.pending.put([(docx_path, future)])
+        return future
+
+    def submit_document(self, documento: bytes, nombre: str) -> Future:
+        """Queue a rendered DOCX held in memory; the future's result is the path of its PDF in a temporary directory.
+
+        The caller reads the PDF and removes it; whatever is left there is removed on close.
+        """
+        return self.submit_documents([(documento, nombre)])[0]
+
+    def submit_documents(self, documentos: List[Tuple[bytes, str]]) -> List[Future]:
+        """Queue several (document, name) pairs at once, so they are converted in the same chunk."""
+        trabajos = []
+        for documento, nombre in documentos:
+            # Un prefijo numérico evita que dos recibís con el mismo nombre se pisen
+            docx_path = os.path.join(self.directorio, f"{next(self.numero)}_{os.path.basename(nombre)}")
+            with open(docx_path, 'wb') as f:
+                f.write(documento)
+            future = Future()
+            future.add_done_callback(lambda _, docx_path=docx_path: os.remove(docx_path))
+            trabajos.append((docx_path, future))
+        if trabajos:
+            self.pending.put(trabajos)
+        return [future for _, future in trabajos]
+
+    def close(self):
+        """Wait for the queued conversions to finish and stop the workers."""
+        for _ in self.threads:
+            self.pending.put(None)
+        for thread in self.threads:
+            thread.join()
+        for profile in self.profiles + [self.directorio]:
+            shutil.rmtree(profile, ignore_errors=True)
+
+    def worker(self, profile: str):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            # Se convierte de una vez todo lo que se haya acumulado en la cola
+            trabajos = list(item)
+            while len(trabajos) < self.chunk_size:
+                try:
+                    item = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.pending.put(None)
+                    break
+                trabajos.extend(item)
+
+            for inicio in range(0, len(trabajos), self.chunk_size):
+                self.convert_jobs(profile, trabajos[inicio:inicio + self.chunk_size])
+
+    def convert_jobs(self, profile: str, chunk: List[Tuple[str, Future]]):
+        """Convert a chunk of queued (docx_path, future) jobs and resolve their futures."""
+        for job in chunk:
+            job[1].set_running_or_notify_cancel()
+        try:
+            self.convert_chunk(profile, [docx_path for docx_path, _ in chunk])
+        except Exception as e:
+            for _, future in chunk:
+                future.set_exception(e)
+            return
+        for docx_path, future in chunk:
+            pdf_path = str(Path(docx_path).with_suffix('.pdf'))
+            if os.path.exists(pdf_path):
+                future.set_result(pdf_path)
+            else:
+                future.set_exception(RuntimeError(f"No se generó el PDF de {os.path.basename(docx_path)}"))
+
+    def convert_chunk(self, profile: str, docx_paths: List[str]):
+        """Convert a group of files, each into a PDF next to it."""
+        if self.soffice is None:
+            from docx2pdf import convert
+            for docx_path in docx_paths:
+                convert(docx_path, str(Path(docx_path).with_suffix('.pdf')))
+            return
+
+        por_directorio = {}
+        for docx_path in docx_paths:
+            por_directorio.setdefault(os.path.dirname(os.path.abspath(docx_path)), []).append(docx_path)
+        for directorio, rutas in por_directorio.items():
+            subprocess.run(
+                [self.soffice, '--headless', '--norestore', f'-env:UserInstallation={Path(profile).as_uri()}',
+                 '--convert-to', 'pdf', '--outdir', directorio] + rutas,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                timeout=120 + 10 * len(rutas), check=True,
+                creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0),
+            )
+
+class MergedDocumentWriter:
+    """Combine rendered receipts into a single DOCX, one section per receipt, and optionally a ZIP of the files.
+
+    Each receipt's body is appended to a temporary file as soon as it is added,
+    so only one receipt is held in memory; the final DOCX is assembled on close.
+    All receipts must come from the same template. Without output_filename
+    only the ZIP is written. Two files with the same name are stored in the
+    ZIP as 'name.docx' and 'name (2).docx'; the same path added again (a
+    reprint saved over its existing file) is stored only once.
+    """
+
+    def __init__(self, output_filename: Optional[str], zip_filename: Optional[str] = None):
+        self.output_filename = output_filename
+        self.zip_filename = zip_filename
+        self.zip = zipfile.ZipFile(f"{zip_filename}.tmp", 'w', zipfile.ZIP_STORED) if zip_filename else None
+        self.zip_names = set()
+        self.zip_paths = set()
+        self.body = tempfile.TemporaryFile()
+        self.base = None
+        self.prefix = None
+        self.sect_pr = None
+        self.count = 0
+
+    def add(self, docx_path: str, blob: Optional[bytes] = None):
+        """Append a rendered receipt to the combined document (and to the ZIP).
+
+        blob is the file's contents when it is already in memory; otherwise docx_path is read.
+        """
+        if blob is None:
+            with open(docx_path, 'rb') as f:
+                blob = f.read()
+        if self.output_filename is not None:
+            self.append_body(blob)
+        self.count += 1
+
+        if self.zip and os.path.normpath(docx_path) not in self.zip_paths:
+            self.zip_paths.add(os.path.normpath(docx_path))
+            self.zip.writestr(self.zip_name(docx_path), blob)
+
+    def append_body(self, blob: bytes):
+        """Append the body of a receipt to the combined document."""
+        with zipfile.ZipFile(io.BytesIO(blob)) as docx:
+            xml = docx.read('word/document.xml').decode('utf-8')
+
+        body_start = xml.index('<w:body>') + len('<w:body>')
+        sect_start = xml.rindex('<w:sectPr')
+        body_end = xml.rindex('</w:body>')
+        if self.base is None:
+            # El primer recibí aporta el resto del paquete (estilos, cabeceras, imágenes...)
+            self.base = blob
+            self.prefix = xml[:body_start]
+            self.sect_pr = xml[sect_start:body_end]
+        else:
+            # Salto de sección (página siguiente) para que cada recibí conserve su cabecera de primera página
+            self.body.write(f'<w:p><w:pPr>{self.sect_pr}</w:pPr></w:p>'.encode('utf-8'))
+        self.body.write(xml[body_start:sect_start].encode('utf-8'))
+
+    def zip_name(self, docx_path: str) -> str:
+        """Name of the file in the ZIP, numbered if another file already has it."""
+        base, extension = os.path.splitext(os.path.basename(docx_path))
+        nombre, n = os.path.basename(docx_path), 1
+        while nombre in self.zip_names:
+            n += 1
+            nombre = f"{base} ({n}){extension}"
+        self.zip_names.add(nombre)
+        return nombre
+
+    def close(self):
+        """Write the combined DOCX and the ZIP, replacing any previous files atomically."""
+        if self.zip:
+            self.zip.close()
+            os.replace(f"{self.zip_filename}.tmp", self.zip_filename)
+        if self.output_filename is None or self.base is None:
+            self.body.close()
+            return
+
+        temporal = f"{self.output_filename}.tmp"
+        with zipfile.ZipFile(io.BytesIO(self.base)) as base, zipfile.ZipFile(temporal, 'w', zipfile.ZIP_DEFLATED) as salida:
+            for item in base.infolist():
+                if item.filename != 'word/document.xml':
+                    salida.writestr(item, base.read(item.filename))
+                    continue
+                with salida.open('word/document.xml', 'w') as documento:
+                    documento.write(self.prefix.encode('utf-8'))
+                    self.body.seek(0)
+                    shutil.copyfileobj(self.body, documento, 1024 * 1024)
+                    documento.write(f'{self.sect_pr}</w:body></w:document>'.encode('utf-8'))
+        self.body.close()
+        os.replace(temporal, self.output_filename)
+
+def merge_documents(docx_paths: List[str], output_filename: str, zip_filename: Optional[str] = None) -> int:
+    """Combine existing receipt files into one DOCX; return how many were merged."""
+    writer = MergedDocumentWriter(output_filename, zip_filename)
+    try:
+        for docx_path in docx_paths:
+            writer.add(docx_path)
+    finally:
+        writer.close()
+    return writer.count
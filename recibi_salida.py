@@ -0,0 +1,183 @@
+"""Output of the generated receipts: atomic writes to a directory, in batches, without overwriting other receipts."""
+import io
+import os
+import logging
+import zipfile
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+from recibi_motor import instrumentation
+
+logger = logging.getLogger("generar_recibi")
+
+def same_document(a: bytes, b: bytes) -> bool:
+    """Whether two files hold the same document.
+
+    A DOCX rendered twice differs only in the dates of its ZIP entries, so
+    ZIP files are compared by the name, CRC and size of each entry.
+    """
+    if a == b:
+        return True
+    if not (a.startswith(b'PK') and b.startswith(b'PK')):
+        return False
+    try:
+        with zipfile.ZipFile(io.BytesIO(a)) as za, zipfile.ZipFile(io.BytesIO(b)) as zb:
+            return ([(i.filename, i.CRC, i.file_size) for i in za.infolist()]
+                    == [(i.filename, i.CRC, i.file_size) for i in zb.infolist()])
+    except zipfile.BadZipFile:
+        return False
+
+def move_without_replacing(origen: str, destino: str):
+    """Rename origen to destino, raising FileExistsError instead of replacing a file that is already there."""
+    if os.name == 'nt':
+        # En Windows rename nunca reemplaza un archivo existente
+        os.rename(origen, destino)
+        return
+    try:
+        os.link(origen, destino)
+    except FileExistsError:
+        raise
+    except OSError:
+        # Carpetas compartidas sin enlaces duros: se comprueba justo antes de renombrar
+        if os.path.exists(destino):
+            raise FileExistsError(destino)
+        os.replace(origen, destino)
+        return
+    os.remove(origen)
+
+class OutputSink:
+    """Directory where receipts are saved, in batches and never half-written.
+
+    add() keeps the document in memory and returns the path it will have; the
+    pending documents are written when there are `lote` of them or `max_bytes`
+    in memory, and on flush(). Each one is written to a temporary file in the
+    same directory and renamed when complete, so an interrupted run never
+    leaves a truncated receipt under its final name.
+
+    The directory is listed once instead of checking every file on the share.
+    If a name is taken by a file with the same contents (a reprint) nothing is
+    written again; if the contents differ, the new receipt is saved as
+    'name (2).docx', 'name (3).docx'... The rename never replaces a file, so
+    if another computer saved a receipt with the same name after the listing,
+    the clash is found when writing and the next free name is used; the path
+    returned by add() is then mapped to the one used in final_path(). Files
+    that cannot be written are kept in `errores` (path returned by add() ->
+    message) instead of stopping the others.
+    """
+
+    def __init__(self, directorio: str = '.', lote: int = 20, max_bytes: int = 16 * 1024 * 1024):
+        self.directorio = directorio
+        self.lote = lote
+        self.max_bytes = max_bytes
+        self.pendientes: Dict[str, bytes] = {}
+        self.bytes_pendientes = 0
+        self.ocupados: Optional[Set[str]] = None
+        self.errores: Dict[str, str] = {}
+        self.renombrados: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def existing_names(self) -> Set[str]:
+        """Names already used in the directory, listed the first time they are needed."""
+        if self.ocupados is None:
+            os.makedirs(self.directorio, exist_ok=True)
+            self.ocupados = set(os.listdir(self.directorio))
+        return self.ocupados
+
+    def same_contents(self, nombre: str, documento: bytes) -> bool:
+        pendiente = self.pendientes.get(nombre)
+        if pendiente is not None:
+            return same_document(pendiente, documento)
+        ruta = os.path.join(self.directorio, nombre)
+        try:
+            if os.path.getsize(ruta) != len(documento):
+                return False
+            with open(ruta, 'rb') as f:
+                return same_document(f.read(), documento)
+        except OSError:
+            return False
+
+    def free_name(self, nombre: str, documento: bytes) -> Tuple[str, bool]:
+        """Return the name for a new document and whether it still has to be written."""
+        ocupados = self.existing_names()
+        for candidato in self.candidate_names(nombre):
+            if candidato not in ocupados:
+                return candidato, True
+            if self.same_contents(candidato, documento):
+                return candidato, False
+
+    @staticmethod
+    def candidate_names(nombre: str):
+        """'name.docx', 'name (2).docx', 'name (3).docx'..."""
+        base, extension = os.path.splitext(nombre)
+        yield nombre
+        n = 2
+        while True:
+            yield f"{base} ({n}){extension}"
+            n += 1
+
+    def final_path(self, ruta: str) -> str:
+        """Path a document returned by add() was finally saved under, after flush()."""
+        return self.renombrados.get(ruta, ruta)
+
+    def add(self, nombre: str, documento: bytes) -> str:
+        """Queue a document to be saved under nombre (or a free variant of it); return its final path."""
+        with self.lock:
+            nombre, escribir = self.free_name(os.path.basename(nombre), documento)
+            if escribir:
+                self.ocupados.add(nombre)
+                self.pendientes[nombre] = documento
+                self.bytes_pendientes += len(documento)
+                if len(self.pendientes) >= self.lote or self.bytes_pendientes >= self.max_bytes:
+                    self.write_pending()
+            return os.path.join(self.directorio, nombre)
+
+    def flush(self):
+        """Write every pending document."""
+        with self.lock:
+            self.write_pending()
+
+    def write_pending(self):
+        if not self.pendientes:
+            return
+        with instrumentation.stage('guardado'):
+            pendientes = list(self.pendientes.items())
+            self.pendientes.clear()
+            self.bytes_pendientes = 0
+            for nombre, documento in pendientes:
+                ruta = os.path.join(self.directorio, nombre)
+                temporal = os.path.join(self.directorio, f".{nombre}.tmp")
+                try:
+                    with open(temporal, 'wb') as f:
+                        f.write(documento)
+                    final = self.place(temporal, nombre, documento)
+                    if final != nombre:
+                        logger.info("%s ya existía al guardarlo; se guarda como %s", ruta, final)
+                        self.renombrados[ruta] = os.path.join(self.directorio, final)
+                except OSError as e:
+                    logger.warning("No se pudo guardar %s: %s", ruta, e)
+                    self.errores[ruta] = str(e)
+                    try:
+                        os.remove(temporal)
+                    except OSError:
+                        pass
+
+    def place(self, temporal: str, nombre: str, documento: bytes) -> str:
+        """Move a written temporary file to nombre or, if that name was taken meanwhile, the next free one; return it."""
+        for candidato in self.candidate_names(nombre):
+            if candidato != nombre and candidato in self.ocupados:
+                if self.same_contents(candidato, documento):
+                    os.remove(temporal)
+                    return candidato
+                continue
+            try:
+                move_without_replacing(temporal, os.path.join(self.directorio, candidato))
+            except FileExistsError:
+                # Otro puesto ha guardado un archivo con este nombre después de listar la carpeta
+                self.ocupados.add(candidato)
+                if self.same_contents(candidato, documento):
+                    os.remove(temporal)
+                    return candidato
+                continue
+            self.ocupados.add(candidato)
+            instrumentation.add({}, len(documento))
+            return candidato
@@ -0,0 +1,171 @@
+"""Local HTTP/JSON service that generates receipts from a single warm roster index and template.
+
+    GET  /salud   -> estado del servicio (Excel cargado, beneficiarias/os, recibís generados)
+    POST /recibi  -> {"numero_siria", "codigo_ayuda", "cuantia", "profesional", "metodo_pago",
+                      "numero_siria_titular"} devuelve el DOCX del recibí
+"""
+import os
+import json
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import quote
+from typing import Tuple, Dict, Optional
+
+from recibi_motor import ReceiptEngine
+
+logger = logging.getLogger("generar_recibi")
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+MAX_REQUEST_BYTES = 64 * 1024
+
+class ReceiptService:
+    """Shared state of the service: one engine, its precompiled template and a watcher that reloads the roster."""
+
+    def __init__(self, engine: ReceiptEngine, reload_interval: float = 5.0):
+        self.engine = engine
+        self.reload_interval = reload_interval
+        self.reload_lock = threading.Lock()
+        self.generados = 0
+        self.generados_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.watcher = threading.Thread(target=self.watch_roster, daemon=True)
+
+    def start(self):
+        """Compile the template now, so the first request does not pay for it, and start watching the roster."""
+        from recibi_render import get_template_cache
+        if os.path.exists(self.engine.template_path):
+            get_template_cache(self.engine.template_path).load()
+        self.watcher.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def watch_roster(self):
+        """Apply changes to the workbook while the service runs.
+
+        The workbook is read and checked without the lock, so requests keep
+        being answered meanwhile; only applying the changes to the index
+        waits for the requests that are building a receipt.
+        """
+        while not self.stopped.wait(self.reload_interval):
+            try:
+                if os.path.getmtime(self.engine.archivo) == self.engine.archivo_mtime:
+                    continue
+                leido = self.engine.read_roster_changes()
+                with self.reload_lock:
+                    cambios = self.engine.apply_roster_changes(*leido)
+                logger.info("Excel recargado: %(nuevas)d nuevas, %(modificadas)d modificadas, %(eliminadas)d eliminadas", cambios)
+            except Exception as e:
+                # El Excel puede no estar accesible un momento (p. ej., mientras se guarda en la red)
+                logger.warning("No se pudo recargar el Excel: %s", e)
+
+    def health(self) -> Dict:
+        return {
+            'estado': 'ok',
+            'excel': self.engine.archivo,
+            'beneficiarias': len(self.engine.beneficiarios),
+            'profesionales': self.engine.valores_combined,
+            'documentos': self.generados,
+        }
+
+    def generate(self, solicitud: Dict) -> Tuple[Optional[bytes], str, str]:
+        """Build and render one receipt; return (docx bytes, filename, error_message)."""
+        campos = {campo: str(solicitud.get(campo) or '').strip() for campo in (
+            'numero_siria', 'numero_siria_titular', 'codigo_ayuda', 'cuantia', 'profesional', 'metodo_pago')}
+        numero_siria = campos['numero_siria'].replace(" ", "")
+        codigo_ayuda = campos['codigo_ayuda'].upper()
+
+        # El índice no puede cambiar mientras se leen los datos del recibí; el render ya no lo necesita
+        with self.reload_lock:
+            context, error_message = self.engine.build_unattended_context(
+                numero_siria,
+                campos['numero_siria_titular'].replace(" ", ""),
+                codigo_ayuda,
+                self.engine.default_amount(codigo_ayuda, campos['cuantia']),
+                campos['profesional'],
+                campos['metodo_pago'] or "Efectivo"
+            )
+        if context is None:
+            return None, '', error_message
+        documento = self.engine.render_bytes(context)
+        nombre = self.engine.build_output_filename(context, numero_siria)
+        self.engine.record_receipt(context, nombre)
+        with self.generados_lock:
+            self.generados += 1
+        return documento, nombre, ''
+
+class ReceiptRequestHandler(BaseHTTPRequestHandler):
+    server_version = "recibi/1.0"
+
+    def do_GET(self):
+        if self.path == '/salud':
+            self.send_json(200, self.server.service.health())
+        else:
+            self.send_json(404, {'error': "Ruta no encontrada."})
+
+    def do_POST(self):
+        if self.path != '/recibi':
+            self.send_json(404, {'error': "Ruta no encontrada."})
+            return
+
+        try:
+            longitud = int(self.headers.get('Content-Length') or 0)
+            if longitud < 0:
+                raise ValueError
+        except ValueError:
+            # Una longitud negativa haría que rfile.read esperase hasta que el cliente cierre la conexión
+            self.send_json(400, {'error': "Content-Length no válido."})
+            return
+        if longitud > MAX_REQUEST_BYTES:
+            self.send_json(413, {'error': "Solicitud demasiado grande."})
+            return
+        try:
+            solicitud = json.loads(self.rfile.read(longitud) or b'{}')
+            if not isinstance(solicitud, dict):
+                raise ValueError
+        except ValueError:
+            self.send_json(400, {'error': "El cuerpo de la solicitud debe ser un objeto JSON."})
+            return
+
+        try:
+            documento, nombre, error_message = self.server.service.generate(solicitud)
+        except Exception as e:
+            logger.exception("Error al generar el recibí")
+            self.send_json(500, {'error': f"Error al generar el documento: {str(e)}"})
+            return
+        if documento is None:
+            self.send_json(422, {'error': error_message})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', DOCX_MIME)
+        self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(nombre)}")
+        self.send_header('Content-Length', str(len(documento)))
+        self.end_headers()
+        self.wfile.write(documento)
+
+    def send_json(self, status: int, datos: Dict):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        logger.info("%s " + format, self.address_string(), *args)
+
+class ReceiptServer(ThreadingHTTPServer):
+    """HTTP server that answers each request in its own thread, all sharing one ReceiptService."""
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: ReceiptService):
+        super().__init__(address, ReceiptRequestHandler)
+        self.service = service
+
+def create_server(engine: ReceiptEngine, host: str = '127.0.0.1', port: int = 8765) -> ReceiptServer:
+    """Create the server for an engine that already has its Excel loaded; port 0 picks a free port."""
+    service = ReceiptService(engine)
+    service.start()
+    return ReceiptServer((host, port), service)
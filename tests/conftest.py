@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del programa están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def instantaneas(monkeypatch, tmp_path):
+    """Keep the workbook snapshots of each test in its tmp_path instead of the user's cache."""
+    import recibi_motor
+    directorio = tmp_path / 'instantaneas'
+    monkeypatch.setattr(recibi_motor, 'snapshot_dir', lambda: str(directorio))
+    return directorio
@@ -0,0 +1,19 @@
+"""Tests of the aid catalog file."""
+import json
+
+import pytest
+
+import recibi_motor as motor
+
+def test_cuantias_del_catalogo_como_texto(tmp_path):
+    ruta = tmp_path / 'ayudas.json'
+    ruta.write_text(json.dumps([{'codigo': 'gbi', 'descripcion': 'Gastos', 'cuantia': '56,00', 'maximo': '56,50'}]))
+    catalogo = motor.AidCatalog.from_file(str(ruta))
+    assert catalogo.get('GBI') == motor.Ayuda('GBI', 'Gastos', 56, 56.5, 0)
+    assert catalogo.validate_amount('GBI', 57.0) != ""
+
+def test_cuantia_no_numerica_en_el_catalogo(tmp_path):
+    ruta = tmp_path / 'ayudas.json'
+    ruta.write_text(json.dumps([{'codigo': 'GBI', 'descripcion': 'Gastos', 'maximo': 'cincuenta'}]))
+    with pytest.raises(ValueError, match='GBI'):
+        motor.AidCatalog.from_file(str(ruta))
@@ -0,0 +1,87 @@
+"""Tests of the roster search index."""
+import pytest
+
+import recibi_motor as motor
+from benchmarks.bench_recibi import synthetic_roster
+from recibi_busqueda import SearchIndex, edit_distance
+
+FILAS = [
+    ('1000123', 'Ana', 'García Pérez', 'X1234567L'),
+    ('1000456', 'Ana María', 'López García', 'Y7654321B'),
+    ('2099999', 'Oksana', 'Shevchenko', 'Z0099999R'),
+    ('3000001', 'Mohamed', 'El-Amrani Fernández', 'X5555555K'),
+    ('3000002', 'Luis', 'Garcés Ruiz', ''),
+]
+
+@pytest.fixture(scope='module')
+def indice():
+    return SearchIndex(FILAS)
+
+@pytest.mark.parametrize('consulta, esperado', [
+    # Por el principio de una palabra, en orden alfabético y sin importar mayúsculas ni tildes
+    ('gar', ['3000002', '1000123', '1000456']),
+    ('perez', ['1000123']),
+    ('1000', ['1000123', '1000456']),
+    ('x12', ['1000123']),
+    ('ana garcia', ['1000123', '1000456']),
+    ('maria, lopez', ['1000456']),
+    # Un SIRIA completo no trae los que solo lo contienen
+    ('1000123', ['1000123']),
+])
+def test_prefijo(indice, consulta, esperado):
+    assert indice.search(consulta) == esperado
+
+@pytest.mark.parametrize('consulta, esperado', [
+    ('chenko', ['2099999']),
+    ('99999', ['2099999']),
+    ('0012', ['1000123']),
+    ('amrani', ['3000001']),
+    ('sana', ['2099999']),
+    # Primero las que empiezan por el término y después las que lo contienen
+    ('an', ['1000123', '1000456', '3000001', '2099999']),
+    ('54321', ['1000456']),
+])
+def test_contenido(indice, consulta, esperado):
+    assert indice.search(consulta) == esperado
+
+@pytest.mark.parametrize('consulta, esperado', [
+    ('Garzia', ['1000123', '1000456']),
+    ('Lopes', ['1000456']),
+    ('Fernandes', ['3000001']),
+    ('shevhcenko', ['2099999']),
+    ('mohamed fernandes', ['3000001']),
+    ('Ana Garzia Perez', ['1000123']),
+])
+def test_errata(indice, consulta, esperado):
+    assert indice.search(consulta) == esperado
+
+@pytest.mark.parametrize('consulta', ['ZZZZ', '88888', 'ana zzzz', 'Gxxxia', ''])
+def test_sin_resultados(indice, consulta):
+    assert indice.search(consulta) == []
+
+def test_limite(indice):
+    assert indice.search('a', limite=2) == ['1000123', '1000456']
+
+@pytest.mark.parametrize('a, b, distancia', [
+    ('GARCIA', 'GARCIA', 0),
+    ('GARZIA', 'GARCIA', 1),
+    ('GRACIA', 'GARCIA', 1),
+    ('GARCA', 'GARCIA', 1),
+    ('SHEVHCENKO', 'SHEVCHENKO', 1),
+    ('LOPEZ', 'PEREZ', 2),
+    ('ANA', 'MOHAMED', 2),
+])
+def test_distancia(a, b, distancia):
+    assert edit_distance(a, b, 1) == distancia
+
+def test_sin_indice_no_se_construye(monkeypatch, tmp_path):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    excel = tmp_path / 'listado.xlsx'
+    synthetic_roster(str(excel), 10)
+    engine = motor.ReceiptEngine()
+    assert engine.load_excel_file(str(excel))
+    # La ventana no espera por el índice: mientras no esté hecho no hay resultados
+    assert engine.search_beneficiaries('nombre1000000', construir=False) is None
+    assert engine.buscador is None
+    engine.search_index()
+    assert [persona.numero_siria for persona in engine.search_beneficiaries('nombre1000000', construir=False)] == ['1000000']
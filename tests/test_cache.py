@@ -0,0 +1,88 @@
+"""Tests of the cache of rendered receipts."""
+import os
+import shutil
+from datetime import datetime
+
+import pandas as pd
+from docx import Document
+
+import recibi_motor as motor
+from recibi_motor import RenderCache
+
+def contexto(siria: str, titular: str = '') -> dict:
+    """Context with the SIRIA fields the cache reads, of a minor when titular is given."""
+    if titular:
+        return {'titular_numero_siria_beneficiaria': titular, 'menor_numero_siria_beneficiaria': siria}
+    return {'titular_numero_siria_beneficiaria': siria}
+
+def test_limite_de_bytes_lru():
+    cache = RenderCache(10)
+    cache.put('a', b'aaaa', ('1001',))
+    cache.put('b', b'bbbb', ('1002',))
+    # Usar 'a' la convierte en la más reciente: al pasarse del límite sale 'b'
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc', ('1003',))
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == (b'aaaa', None, b'cccc')
+    assert cache.bytes == 8
+
+    # Un recibí mayor que toda la caché no se guarda ni desplaza a los demás
+    cache.put('d', b'd' * 11, ('1004',))
+    assert cache.get('d') is None
+    assert list(cache.documentos) == ['a', 'c']
+
+    # Volver a guardar la misma clave no cuenta sus bytes dos veces
+    cache.put('c', b'cc', ('1003',))
+    assert cache.bytes == 6
+
+def test_cambio_de_plantilla():
+    cache = RenderCache(100)
+    cache.set_template('v1')
+    cache.put('a', b'aaaa', ('1001',))
+    cache.set_template('v1')
+    assert cache.get('a') == b'aaaa'
+    cache.set_template('v2')
+    assert cache.get('a') is None and cache.bytes == 0
+    assert RenderCache.key(contexto('1001'), 'v1') != RenderCache.key(contexto('1001'), 'v2')
+
+def test_fila_modificada_descarta_sus_recibis(monkeypatch, tmp_path):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    engine = motor.ReceiptEngine()
+    datos = {columna: [None] * 3 for columna in motor.COLUMNAS_ROSTER}
+    datos.update({
+        'NOMBRE': ['ANA', 'LUCÍA', 'LEO'],
+        'APELLIDOS': ['PÉREZ', 'PÉREZ', 'RUIZ'],
+        'Nº SIRIA BENEFICIARIA/O': ['1001', '1002', '1003'],
+        'Nº DE SIRIA TITULAR UNIDAD FAMILIAR': [None, '1001', None],
+        'FECHA NACIMIENTO': [datetime(1990, 5, 1), datetime(2015, 7, 9), datetime(1985, 1, 2)],
+    })
+    engine.build_beneficiary_index(motor.prepare_roster(pd.DataFrame(datos), 18))
+    for clave, context in (('titular', contexto('1001')), ('menor', contexto('1002', titular='1001')), ('otro', contexto('1003'))):
+        engine.render_cache.put(clave, b'x', RenderCache.context_sirias(context))
+
+    # Cambian los apellidos de la titular: se descartan su recibí y el de su hija, que los lleva impresos
+    datos['APELLIDOS'][0] = 'PÉREZ LÓPEZ'
+    df = motor.prepare_roster(pd.DataFrame(datos), 18)
+    cambios = engine.apply_roster_changes(0.0, motor.RosterStore(df, motor.roster_fingerprints(df)),
+                                          pd.DataFrame({'B': [], 'C': []}), {})
+    assert cambios == {'nuevas': 0, 'modificadas': 1, 'eliminadas': 0}
+    assert list(engine.render_cache.documentos) == ['otro']
+    assert engine.render_cache.bytes == 1
+
+def test_render_desde_la_cache_hasta_que_cambia_la_plantilla(monkeypatch, tmp_path):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    engine = motor.ReceiptEngine()
+    engine.template_path = str(tmp_path / 'plantilla_recibo.docx')
+    shutil.copyfile(os.path.join(os.path.dirname(motor.__file__), 'plantilla_recibo.docx'), engine.template_path)
+    context = {'titular_numero_siria_beneficiaria': '1001', 'titular_nombre': 'ANA'}
+
+    documento = engine.render_bytes(context)
+    assert engine.render_bytes(context) is documento
+
+    # Otra plantilla (con otra fecha de modificación) vacía la caché y se vuelve a renderizar
+    plantilla = Document(engine.template_path)
+    plantilla.add_paragraph('Versión 2')
+    plantilla.save(engine.template_path)
+    os.utime(engine.template_path, (1, 1))
+    nuevo = engine.render_bytes(context)
+    assert nuevo is not documento
+    assert list(engine.render_cache.documentos.values()) == [(nuevo, ('1001',))]
@@ -0,0 +1,34 @@
+"""Tests of the roster snapshot cache."""
+import os
+
+import openpyxl
+
+import recibi_motor as motor
+
+def write_roster(path: str):
+    """Small roster workbook with the header below four preamble rows and the hidden sheet."""
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    for fila in range(1, 5):
+        hoja.append([f"Preámbulo {fila}"])
+    hoja.append(list(motor.COLUMNAS_ROSTER))
+    for numero in range(10):
+        fila = dict.fromkeys(motor.COLUMNAS_ROSTER)
+        fila.update({'NOMBRE': f"NOMBRE {numero}", 'APELLIDOS': f"APELLIDOS {numero}", 'Nº SIRIA BENEFICIARIA/O': 1000 + numero})
+        hoja.append(list(fila.values()))
+    libro.create_sheet('LISTADOS (no tocar)')['B4'] = 'Profesional'
+    libro.save(path)
+
+def test_instantanea_fuera_de_la_carpeta_del_excel(monkeypatch, tmp_path, instantaneas):
+    excel = tmp_path / 'compartida' / 'listado.xlsx'
+    excel.parent.mkdir()
+    write_roster(str(excel))
+
+    df, _ = motor.load_roster(str(excel))
+    assert sorted(p.name for p in excel.parent.iterdir()) == ['listado.xlsx']
+    assert [p.name for p in instantaneas.iterdir()] == [os.path.basename(motor.snapshot_path(str(excel)))]
+
+    # La segunda carga sale de la instantánea, sin leer el Excel
+    monkeypatch.setattr(motor, 'read_roster_workbook', None)
+    otra, _ = motor.load_roster(str(excel))
+    assert otra.equals(df)
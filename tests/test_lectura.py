@@ -0,0 +1,65 @@
+"""Tests of the single-pass roster workbook reader."""
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+
+import recibi_motor as motor
+
+# Columnas del listado en otro orden y con columnas que no se usan entre medias
+CABECERA = ['OBSERVACIONES'] + list(reversed(motor.COLUMNAS_ROSTER)) + ['TELÉFONO']
+FILAS = [
+    {'NOMBRE': 'ANA', 'APELLIDOS': 'PÉREZ', 'NÚMERO NIE': 'X1', 'Nº SIRIA BENEFICIARIA/O': 1001,
+     'Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)': 5001.0, 'FECHA NACIMIENTO': datetime(1990, 5, 1),
+     'SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL': 'Apátrida', 'OBSERVACIONES': 'nada'},
+    {'NOMBRE': 'LUCÍA', 'APELLIDOS': 'PÉREZ', 'Nº SIRIA BENEFICIARIA/O': ' 1 002 ',
+     'Nº DE SIRIA TITULAR UNIDAD FAMILIAR': '1001', 'Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)': '5001.0',
+     'FECHA NACIMIENTO': '09/07/2015', 'CADUCIDAD NIE ': datetime(2027, 1, 31), 'Nº EXPEDIENTE OAR': 77},
+    # Una fila con datos solo en columnas que no se usan no es una beneficiaria
+    {'TELÉFONO': '600000000'},
+    {'NOMBRE': 'LEO', 'Nº SIRIA BENEFICIARIA/O': '1003', 'Nº EXPEDIENTE OAR': 'OAR-3'},
+]
+PROFESIONALES = [('Profesional B4', None), ('Profesional B5', 'Profesional C5'), (None, 'Profesional C7')]
+
+def write_roster(path: str):
+    """Roster workbook with the preamble rows above the header and the hidden sheet of professionals."""
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    for fila in range(1, motor.FILA_CABECERA):
+        hoja.append([f"Preámbulo {fila}", None, f"Entidad {fila}"])
+    hoja.append(CABECERA)
+    for fila in FILAS:
+        hoja.append([fila.get(columna) for columna in CABECERA])
+    oculta = libro.create_sheet(motor.HOJA_OCULTA)
+    oculta.sheet_state = 'hidden'
+    oculta['A1'] = 'Listas'
+    for fila, (b, c) in enumerate(PROFESIONALES, start=4):
+        oculta.cell(fila, 2, b)
+        oculta.cell(fila, 3, c)
+    oculta['B9'] = 'Fuera del rango'
+    libro.save(path)
+
+def cells(df: pd.DataFrame) -> list:
+    """Cell values by row, with every kind of empty cell as None."""
+    return [[None if pd.isna(valor) else valor for valor in fila] for fila in df.itertuples(index=False)]
+
+def test_misma_lectura_que_read_excel(tmp_path):
+    excel = str(tmp_path / 'listado.xlsx')
+    write_roster(excel)
+
+    df, df_oculta = motor.read_roster_workbook(excel)
+
+    # Lectura anterior: todo el libro con pandas y los SIRIA normalizados después
+    esperado = pd.read_excel(excel, header=motor.FILA_CABECERA - 1)[list(motor.COLUMNAS_ROSTER)]
+    esperado = esperado.dropna(how='all').reset_index(drop=True)
+    for columna in motor.COLUMNAS_SIRIA:
+        esperado[columna] = esperado[columna].map(lambda valor: motor.normalize_siria(valor) or None)
+    oculta = pd.read_excel(excel, sheet_name=motor.HOJA_OCULTA, header=None)
+
+    assert list(df.columns) == list(motor.COLUMNAS_ROSTER)
+    # Los tipos de columna que infiere pandas pueden variar; los valores de cada celda no
+    assert cells(df) == cells(esperado)
+    assert df['Nº SIRIA BENEFICIARIA/O'].tolist() == ['1001', '1002', '1003']
+    assert df['Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)'].tolist() == ['5001', '5001', None]
+    assert df_oculta['B'].dropna().tolist() == oculta.iloc[3:7, 1].dropna().tolist() == ['Profesional B4', 'Profesional B5']
+    assert df_oculta['C'].dropna().tolist() == oculta.iloc[3:7, 2].dropna().tolist() == ['Profesional C5', 'Profesional C7']
@@ -0,0 +1,151 @@
+"""Tests of the roster preparation and incremental reload."""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import recibi_motor as motor
+
+def roster(**columnas) -> pd.DataFrame:
+    """Roster frame with the given columns and every other roster column empty."""
+    filas = len(next(iter(columnas.values())))
+    datos = {columna: [None] * filas for columna in motor.COLUMNAS_ROSTER}
+    datos.update(columnas)
+    return pd.DataFrame(datos)
+
+def test_edad_nacidos_29_febrero():
+    df = roster(**{'FECHA NACIMIENTO': [datetime(2008, 2, 29), datetime(2008, 3, 1)]})
+    # En un año no bisiesto se cumplen años el 28 de febrero, como con relativedelta
+    assert motor.prepare_roster(df, 18, datetime(2026, 2, 28))['edad'].tolist() == [18, 17]
+    assert motor.prepare_roster(df, 18, datetime(2026, 2, 27))['edad'].tolist() == [17, 17]
+    assert motor.prepare_roster(df, 18, datetime(2024, 2, 28))['edad'].tolist() == [15, 15]
+
+def test_recarga_con_fecha_en_texto(monkeypatch, tmp_path):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    engine = motor.ReceiptEngine()
+    hoy = datetime(2026, 3, 15)
+    filas = {
+        'NOMBRE': ['ANA', 'LUIS'],
+        'APELLIDOS': ['PÉREZ', 'GÓMEZ'],
+        'Nº SIRIA BENEFICIARIA/O': ['1001', '1002'],
+        'Nº DE SIRIA TITULAR UNIDAD FAMILIAR': ['1001', '1001'],
+        'FECHA NACIMIENTO': [datetime(1990, 5, 1), datetime(2015, 7, 9)],
+    }
+    engine.build_beneficiary_index(motor.prepare_roster(roster(**filas), engine.EDAD_MAYORIA, hoy))
+
+    # Una fila nueva con la fecha escrita como texto deja la columna de fechas como 'object'
+    for columna, valor in zip(filas, ['EVA', 'RUIZ', '1003', '1003', '02/03/1980']):
+        filas[columna] = filas[columna] + [valor]
+    df = motor.prepare_roster(roster(**filas), engine.EDAD_MAYORIA, hoy)
+    assert df['FECHA NACIMIENTO'].dtype == object
+    huellas = motor.roster_fingerprints(df)
+    assert {siria: huellas[siria] for siria in ('1001', '1002')} == engine.beneficiarios.fingerprints()
+
+    cambios = engine.apply_roster_changes(0.0, motor.RosterStore(df, huellas), pd.DataFrame({'B': [], 'C': []}), {})
+    assert cambios == {'nuevas': 1, 'modificadas': 0, 'eliminadas': 0}
+
+def test_recibis_de_la_familia(monkeypatch, tmp_path):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    engine = motor.ReceiptEngine()
+    engine.build_beneficiary_index(motor.prepare_roster(roster(**{
+        'NOMBRE': ['ANA', 'LUIS'],
+        'APELLIDOS': ['PÉREZ', 'GÓMEZ'],
+        'NÚMERO NIE': ['X1', 'X2'],
+        'Nº SIRIA BENEFICIARIA/O': ['1001', '1002'],
+        'Nº DE SIRIA TITULAR UNIDAD FAMILIAR': [None, '1001'],
+        'FECHA NACIMIENTO': [datetime(1990, 5, 1), datetime(2015, 7, 9)],
+    }), engine.EDAD_MAYORIA))
+    hogar = engine.find_household('1002')
+
+    contextos = engine.build_household_contexts(hogar, '1FGBI', '56', 'Profesional', 'Efectivo')
+    assert [(siria, error) for siria, _, error in contextos] == [('1001', ''), ('1002', '')]
+    assert all(context is not None for _, context, _ in contextos)
+
+    for codigo, cuantia in (('NOEXISTE', '10'), ('1FGBI', '80')):
+        contextos = engine.build_household_contexts(hogar, codigo, cuantia, 'Profesional', 'Efectivo')
+        assert all(context is None and error for _, context, error in contextos)
+
+def test_listado_compacto():
+    df = motor.prepare_roster(roster(**{
+        'NOMBRE': ['ANA', None, 'EVA', 'ANA'],
+        'APELLIDOS': ['PÉREZ', 'GÓMEZ', 'RUIZ', 'OTRA'],
+        'Nº SIRIA BENEFICIARIA/O': ['1001', '1002', '1003.0', '1001'],
+        'Nº DE SIRIA TITULAR UNIDAD FAMILIAR': [None, '1001', '1001', None],
+        'Nº EXPEDIENTE OAR': [7, None, 'OAR-3', 8],
+        'FECHA NACIMIENTO': [datetime(1990, 5, 1), '02/03/2015', 'no consta', None],
+        'SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL': ['Apátrida', 'Solicitante Protección Temporal', None, 'Apátrida'],
+    }), 18, datetime(2026, 3, 15))
+    listado = motor.RosterStore(df)
+
+    # Una fila por SIRIA normalizado, la primera si está repetido, con los mismos valores que el DataFrame
+    assert list(listado) == ['1001', '1002', '1003']
+    assert '1004' not in listado and listado.get(None) is None
+    for columna, campo in (('NOMBRE', 'nombre'), ('Nº EXPEDIENTE OAR', 'oar'), ('fecha_nacimiento_str', 'fecha_nacimiento_str')):
+        assert [getattr(persona, campo) for persona in listado.values()] == df[columna].head(3).tolist()
+    assert [(p.edad, p.es_menor, p.siria_titular) for p in listado.values()] == [(35, False, None), (11, True, '1001'), (None, False, '1001')]
+    assert listado.protection_marks('1001')['apatrida'] == 'X'
+    assert listado.protection_marks('1002')['sol_ben_pt'] == 'X'
+    assert set(listado.protection_marks('1003').values()) == {''}
+
+    hogar = motor.HouseholdIndex(listado).find('1003')
+    assert (hogar.numero_siria_titular, hogar.miembros) == ('1001', ('1001', '1003', '1002'))
+
+# Listado válido: una titular adulta y su hija menor
+FILAS_VALIDAS = {
+    'NOMBRE': ['ANA', 'LUCÍA'],
+    'APELLIDOS': ['PÉREZ', 'PÉREZ'],
+    'NÚMERO NIE': ['X1', 'X2'],
+    'Nº SIRIA BENEFICIARIA/O': ['1001', '1002'],
+    'Nº DE SIRIA TITULAR UNIDAD FAMILIAR': [None, '1001'],
+    'FECHA NACIMIENTO': [datetime(1990, 5, 1), datetime(2015, 7, 9)],
+}
+
+def listado_con(cambios) -> pd.DataFrame:
+    """Prepared valid roster with the (column, row, value) changes applied."""
+    filas = {columna: list(valores) for columna, valores in FILAS_VALIDAS.items()}
+    for columna, fila, valor in cambios:
+        filas[columna][fila] = valor
+    return motor.prepare_roster(roster(**filas), 18, datetime(2026, 3, 15))
+
+@pytest.mark.parametrize('cambios, esperado', [
+    ([], {}),
+    ([('NOMBRE', 0, None)], {'1001': ('sin_nombre',)}),
+    ([('NOMBRE', 1, '   ')], {'1002': ('sin_nombre',)}),
+    ([('APELLIDOS', 1, '')], {'1002': ('sin_apellidos',)}),
+    ([('NÚMERO NIE', 0, None)], {'1001': ('sin_nie',)}),
+    ([('NOMBRE', 0, None), ('NÚMERO NIE', 0, '')], {'1001': ('sin_nombre', 'sin_nie')}),
+    ([('FECHA NACIMIENTO', 0, 'no consta')], {'1001': ('fecha_nacimiento_invalida',)}),
+    # Sin fecha no se sabe si es menor, así que tampoco se le pide titular
+    ([('FECHA NACIMIENTO', 1, None), ('Nº DE SIRIA TITULAR UNIDAD FAMILIAR', 1, None)], {'1002': ('fecha_nacimiento_invalida',)}),
+    # Un SIRIA repetido se marca y se queda con los problemas de su primera fila
+    ([('Nº SIRIA BENEFICIARIA/O', 1, '1001')], {'1001': ('siria_repetido',)}),
+    ([('Nº DE SIRIA TITULAR UNIDAD FAMILIAR', 1, None)], {'1002': ('menor_sin_titular',)}),
+    ([('Nº DE SIRIA TITULAR UNIDAD FAMILIAR', 1, '9999')], {'1002': ('titular_inexistente',)}),
+    # A una persona adulta no se le pide titular
+    ([('Nº DE SIRIA TITULAR UNIDAD FAMILIAR', 0, '9999')], {}),
+])
+def test_validacion_del_listado(cambios, esperado):
+    assert motor.validate_roster(listado_con(cambios)) == esperado
+
+@pytest.mark.parametrize('omitir, estados', [(False, ['OK', 'OK', 'OK']), (True, ['OK', 'ERROR', 'OK'])])
+def test_omitir_incompletos(monkeypatch, tmp_path, omitir, estados):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    engine = motor.ReceiptEngine()
+    filas = {
+        'NOMBRE': ['ANA', 'LUCÍA', 'LEO'],
+        'APELLIDOS': ['PÉREZ', 'PÉREZ', 'RUIZ'],
+        'NÚMERO NIE': ['X1', None, 'X3'],
+        'Nº SIRIA BENEFICIARIA/O': ['1001', '1002', '1003'],
+        'Nº DE SIRIA TITULAR UNIDAD FAMILIAR': [None, '1001', None],
+        'FECHA NACIMIENTO': [datetime(1990, 5, 1), datetime(2015, 7, 9), datetime(2016, 1, 2)],
+    }
+    engine.build_beneficiary_index(motor.prepare_roster(roster(**filas), 18))
+    ordenes = [{'numero_siria': siria, 'codigo_ayuda': '1FGBI', 'cuantia': '56', 'profesional': 'Profesional',
+                'metodo_pago': 'Efectivo', 'numero_siria_titular': titular}
+               for siria, titular in (('1001', ''), ('1002', ''), ('1003', '1001'))]
+
+    resultados = engine.generate_orders(ordenes, str(tmp_path / 'recibis'), omitir_incompletos=omitir)
+    assert [resultado['estado'] for resultado in resultados] == estados
+    # Sin omitir solo se avisa; el menor sin titular en el Excel no está incompleto si la orden lo indica
+    assert "falta el número NIE" in resultados[1]['error' if omitir else 'aviso']
+    assert not resultados[2]['error'] and not resultados[2]['aviso']
@@ -0,0 +1,15 @@
+"""Tests of the per-stage instrumentation."""
+from recibi_motor import Instrumentation, StageStats
+
+def test_memoria_acotada_por_etapa():
+    metricas = Instrumentation()
+    for i in range(1, 10001):
+        metricas.add({'render': i / 1000})
+    stats = metricas.tiempos['render']
+    assert len(stats.muestra) == StageStats.MUESTRA_MAX
+    resumen = metricas.summary()['etapas']['render']
+    assert resumen['n'] == 10000
+    assert resumen['total_s'] == round(sum(range(1, 10001)) / 1000, 4)
+    assert resumen['max_ms'] == 10000
+    # La muestra es aleatoria: la mediana estimada queda cerca de la real (5 s)
+    assert 4000 < resumen['p50_ms'] < 6000
@@ -0,0 +1,49 @@
+"""Tests of the incremental schedule runner."""
+from datetime import datetime
+
+import pandas as pd
+
+import recibi_motor as motor
+from recibi_programacion import Programacion, ScheduleRunner
+
+def listado(filas) -> pd.DataFrame:
+    """Prepared roster from (SIRIA, NIE, titular, birth date) rows."""
+    datos = {columna: [None] * len(filas) for columna in motor.COLUMNAS_ROSTER}
+    datos['NOMBRE'] = [f"NOMBRE{siria}" for siria, *_ in filas]
+    datos['APELLIDOS'] = [f"APELLIDO{siria}" for siria, *_ in filas]
+    datos['Nº SIRIA BENEFICIARIA/O'] = [siria for siria, *_ in filas]
+    datos['NÚMERO NIE'] = [nie for _, nie, _, _ in filas]
+    datos['Nº DE SIRIA TITULAR UNIDAD FAMILIAR'] = [titular for _, _, titular, _ in filas]
+    datos['FECHA NACIMIENTO'] = [nacimiento for *_, nacimiento in filas]
+    return motor.prepare_roster(pd.DataFrame(datos), 18)
+
+def test_solo_se_repiten_los_recibis_que_cambian(monkeypatch, tmp_path):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    engine = motor.ReceiptEngine()
+    filas = [('1001', 'X1', None, datetime(1990, 5, 1)), ('1002', 'X2', '1001', datetime(2015, 7, 9))]
+    engine.build_beneficiary_index(listado(filas))
+    programacion = Programacion('bolsillo', ('1FGBI',), 'todas', (), '', 'Profesional', 'Efectivo')
+    salida = str(tmp_path / 'recibis')
+
+    def recargar(filas):
+        df = listado(filas)
+        engine.apply_roster_changes(0.0, motor.RosterStore(df, motor.roster_fingerprints(df)), pd.DataFrame({'B': [], 'C': []}), {})
+
+    runner = ScheduleRunner(engine, programacion)
+    pendientes, cuentas = runner.plan()
+    assert cuentas['nuevas'] == 2
+    assert [resultado['estado'] for resultado in runner.run(pendientes, salida)] == ['OK', 'OK']
+    pendientes, cuentas = runner.plan()
+    assert (pendientes, cuentas['hechas']) == ([], 2)
+
+    # Una fila nueva con la fecha escrita como texto no cambia los recibís de las demás
+    recargar(filas + [('1003', 'X3', None, '02/03/1980')])
+    pendientes, cuentas = runner.plan()
+    assert [orden['numero_siria'] for orden, _ in pendientes] == ['1003']
+    assert (cuentas['hechas'], cuentas['nuevas']) == (2, 1)
+
+    # Un dato que sale en el recibí sí lo cambia
+    recargar([('1001', 'X1', None, datetime(1990, 5, 1)), ('1002', 'X2-B', '1001', datetime(2015, 7, 9))])
+    pendientes, cuentas = runner.plan()
+    assert [orden['numero_siria'] for orden, _ in pendientes] == ['1002']
+    assert cuentas['cambiadas'] == 1
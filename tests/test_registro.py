@@ -0,0 +1,72 @@
+"""Tests of the append-only receipt ledger and the warnings built on it."""
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import recibi_motor as motor
+from recibi_registro import ReceiptLedger
+
+def contexto(siria='1001', codigo='1FMI', cuantia='100', titular=None, dia='1 de marzo de 2026') -> dict:
+    """Context of a receipt with the fields the ledger reads."""
+    datos = {'titular_numero_siria_beneficiaria': titular or siria, 'codigo_ayuda': codigo, 'cuantia_bruta': cuantia,
+             'cuantia': cuantia, 'profesional': 'Prof', 'metodo_pago': 'Efectivo', 'fecha_actual': dia}
+    if titular:
+        datos['menor_numero_siria_beneficiaria'] = siria
+    return datos
+
+@pytest.fixture
+def registro(tmp_path):
+    registro = ReceiptLedger(str(tmp_path / 'registro.sqlite'))
+    yield registro
+    registro.close()
+
+def test_solo_se_pueden_anadir_recibis(registro):
+    assert registro.record(contexto(), 0, 'recibo.docx')
+    conexion = registro.connect()
+    with pytest.raises(sqlite3.IntegrityError):
+        conexion.execute("UPDATE recibos SET cuantia = 0")
+    with pytest.raises(sqlite3.IntegrityError):
+        conexion.execute("DELETE FROM recibos")
+    assert conexion.execute("SELECT cuantia FROM recibos").fetchall() == [(100.0,)]
+
+def test_reimprimir_no_se_anota_dos_veces(registro):
+    assert registro.record(contexto(), 0)
+    assert registro.recorded(contexto())
+    assert not registro.record(contexto(), 0)
+    # Otro día es otro recibí
+    assert not registro.recorded(contexto(dia='2 de marzo de 2026'))
+    assert registro.record(contexto(dia='2 de marzo de 2026'), 0)
+    assert registro.beneficiary_totals('1001', '1FMI', datetime.now().strftime('%Y-%m')).recibos == 2
+
+def test_totales_por_mes_y_por_persona(registro):
+    marzo, abril = datetime(2026, 3, 5), datetime(2026, 4, 5)
+    registro.record(contexto('1001', '1FMI', '100'), 0, fecha=marzo)
+    registro.record(contexto('1001', '1FMI', '50', dia='otro'), 0, fecha=marzo)
+    registro.record(contexto('1002', 'ATSANGA', '200', titular='1001'), 30, fecha=marzo)
+    registro.record(contexto('1001', '1FMI', '80', dia='abril'), 0, fecha=abril)
+
+    assert registro.beneficiary_totals('1001', '1FMI', '2026-03') == ('1FMI', 2, 150.0, 0.0, 150.0)
+    assert registro.beneficiary_totals('1002', 'ATSANGA', '2026-03') == ('ATSANGA', 1, 200.0, 30.0, 200.0)
+    assert registro.beneficiary_totals('1001', '1FMI', '2026-04').recibos == 1
+    assert registro.beneficiary_totals('1003', '1FMI', '2026-03').recibos == 0
+    assert [tuple(t) for t in registro.month_totals('2026-03')] == [
+        ('1FMI', 2, 150.0, 0.0, 150.0), ('ATSANGA', 1, 200.0, 30.0, 200.0)]
+    assert registro.issued_in_month('2026-04') == {('1001', '1FMI')}
+
+def test_avisos_del_lote(monkeypatch, tmp_path):
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    engine = motor.ReceiptEngine()
+    # Dos filas de la misma orden que solo juntas superan el máximo de 1FGBI (56 euros)
+    en_lote = {}
+    assert engine.ledger_warnings('1001', '1FGBI', '30', contexto('1001', '1FGBI', '30'), en_lote) == ''
+    aviso = engine.ledger_warnings('1001', '1FGBI', '30', contexto('1001', '1FGBI', '30', dia='otro'), en_lote)
+    assert '1 recibí(s) (1 en este lote)' in aviso
+    assert 'supera el máximo de 56 euros' in aviso
+    assert engine.ledger_warnings('1002', '1FGBI', '30', contexto('1002', '1FGBI', '30'), en_lote) == ''
+
+    # Reimprimir un recibí ya anotado no avisa; otro recibí de la misma ayuda sí
+    engine.registro.record(contexto('1003', '1FGBI', '30'), 0)
+    assert engine.ledger_warnings('1003', '1FGBI', '30', contexto('1003', '1FGBI', '30')) == ''
+    assert 'ya se han emitido 1 recibí(s) de 1FGBI' in engine.ledger_warnings('1003', '1FGBI', '30', contexto('1003', '1FGBI', '30', dia='otro'))
+    engine.registro.close()
@@ -0,0 +1,85 @@
+"""Tests of the precompiled template and of the combined document and ZIP writer."""
+import io
+import zipfile
+from datetime import datetime
+
+import openpyxl
+from docxtpl import DocxTemplate
+
+import recibi_motor as motor
+from recibi_render import MergedDocumentWriter, TemplateCache
+
+CABECERA = ['NOMBRE', 'APELLIDOS', 'NÚMERO NIE', 'CADUCIDAD NIE ', 'Nº SIRIA BENEFICIARIA/O',
+            'Nº SIRIA  UNIDAD CONVIVENCIAL (SI APLICA)', 'Nº DE SIRIA TITULAR UNIDAD FAMILIAR',
+            'Nº EXPEDIENTE OAR', 'FECHA NACIMIENTO', 'SITUACIÓN LEGAL/ADMINISTRATIVA ACTUAL']
+FILAS = [
+    ['ANA', 'PÉREZ', 'X1234567A', datetime(2027, 1, 31), 1001, 5001, None, 'OAR-1', datetime(1990, 5, 1), 'Apátrida'],
+    ['LUCÍA', 'PÉREZ', None, None, 1002, 5001, 1001, 'OAR-1', datetime(2015, 7, 9), 'Solicitante Protección Internacional'],
+    ['LEO', 'RUIZ & HIJOS <S.L.>', 'Y7654321B', None, 1003, None, None, None, None, None],
+]
+
+def write_roster(path: str):
+    """Roster workbook with the header below four preamble rows and the hidden sheet of professionals."""
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    for fila in range(1, 5):
+        hoja.append([f"Preámbulo {fila}"])
+    hoja.append(CABECERA)
+    for fila in FILAS:
+        hoja.append(fila)
+    oculta = libro.create_sheet('LISTADOS (no tocar)')
+    oculta['B4'] = 'Profesional Ñ'
+    oculta['C4'] = 'Profesional O'
+    libro.save(path)
+
+def xml_parts(documento: bytes) -> dict:
+    """XML parts of a DOCX file, which is all a render changes."""
+    with zipfile.ZipFile(io.BytesIO(documento)) as archivo:
+        return {nombre: archivo.read(nombre) for nombre in archivo.namelist() if nombre.endswith('.xml')}
+
+def test_plantilla_precompilada_igual_que_docxtpl(tmp_path):
+    excel = tmp_path / 'listado.xlsx'
+    write_roster(str(excel))
+    engine = motor.ReceiptEngine()
+    assert engine.load_excel_file(str(excel))
+    cache = TemplateCache(engine.template_path)
+
+    contextos = [engine.build_context(siria, titular, '1FGBI', '56', 'Profesional Ñ', 'Efectivo')[0]
+                 for siria, titular in (('1001', None), ('1002', '1001'), ('1003', None))]
+    assert all(contextos)
+    for context in contextos:
+        # Cada recibí usa una copia nueva de la misma plantilla precompilada, sin nada del anterior
+        precompilada = cache.new_template()
+        precompilada.render(context)
+        docxtpl = DocxTemplate(engine.template_path)
+        docxtpl.render(context)
+        salidas = []
+        for template in (precompilada, docxtpl):
+            buffer = io.BytesIO()
+            template.save(buffer)
+            salidas.append(xml_parts(buffer.getvalue()))
+        assert salidas[0] == salidas[1]
+
+def test_zip_sin_documento_combinado(tmp_path):
+    ruta = tmp_path / 'recibos.zip'
+    for carpeta, contenido in (('salida', b'uno'), ('otra', b'dos')):
+        (tmp_path / carpeta).mkdir()
+        (tmp_path / carpeta / 'recibo.docx').write_bytes(contenido)
+    writer = MergedDocumentWriter(None, str(ruta))
+    writer.add(str(tmp_path / 'salida' / 'recibo.docx'))
+    writer.add(str(tmp_path / 'otra' / 'recibo.docx'))
+    writer.close()
+    with zipfile.ZipFile(ruta) as archivo:
+        assert archivo.namelist() == ['recibo.docx', 'recibo (2).docx']
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['otra', 'recibos.zip', 'salida']
+
+def test_zip_sin_reimpresiones_repetidas(tmp_path):
+    ruta = tmp_path / 'recibos.zip'
+    recibo = tmp_path / 'recibo.docx'
+    recibo.write_bytes(b'uno')
+    writer = MergedDocumentWriter(None, str(ruta))
+    writer.add(str(recibo))
+    writer.add(str(recibo))
+    writer.close()
+    with zipfile.ZipFile(ruta) as archivo:
+        assert archivo.namelist() == ['recibo.docx']
@@ -0,0 +1,32 @@
+"""Tests of the batched output directory."""
+import os
+
+from recibi_salida import OutputSink
+
+def test_no_sobrescribe_un_archivo_guardado_despues_de_listar(tmp_path):
+    salida = OutputSink(str(tmp_path))
+    ruta = salida.add('recibo.docx', b'nuevo')
+    otro = salida.add('otro.docx', b'otro')
+    # Otro puesto guarda un recibí con el mismo nombre antes de que se escriba el lote
+    (tmp_path / 'recibo.docx').write_bytes(b'de otro puesto')
+    salida.flush()
+
+    assert salida.errores == {}
+    assert salida.final_path(ruta) == os.path.join(str(tmp_path), 'recibo (2).docx')
+    assert salida.final_path(otro) == otro
+    assert (tmp_path / 'recibo.docx').read_bytes() == b'de otro puesto'
+    assert (tmp_path / 'recibo (2).docx').read_bytes() == b'nuevo'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['otro.docx', 'recibo (2).docx', 'recibo.docx']
+
+def test_mismo_recibi_guardado_por_otro_puesto(tmp_path):
+    salida = OutputSink(str(tmp_path))
+    ruta = salida.add('recibo.docx', b'igual')
+    (tmp_path / 'recibo.docx').write_bytes(b'igual')
+    salida.flush()
+
+    assert salida.final_path(ruta) == ruta
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['recibo.docx']
+    # Volver a imprimirlo tampoco crea otro archivo
+    assert salida.add('recibo.docx', b'igual') == ruta
+    salida.flush()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['recibo.docx']
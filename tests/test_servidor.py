@@ -0,0 +1,75 @@
+"""Tests of the local HTTP service."""
+import io
+import json
+import http.client
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import pytest
+from docx import Document
+
+import recibi_motor as motor
+from benchmarks.bench_recibi import synthetic_roster
+from recibi_servidor import create_server
+
+@pytest.fixture
+def servidor(monkeypatch, tmp_path):
+    """Server on a free port for a 10-person roster, with its ledger in tmp_path."""
+    monkeypatch.setattr(motor, 'program_dir', lambda: str(tmp_path))
+    excel = tmp_path / 'listado.xlsx'
+    synthetic_roster(str(excel), 10)
+    engine = motor.ReceiptEngine()
+    assert engine.load_excel_file(str(excel))
+    server = create_server(engine, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.service.stop()
+    server.server_close()
+
+def post_json(url: str, datos: dict):
+    solicitud = urllib.request.Request(url, data=json.dumps(datos).encode('utf-8'),
+                                       headers={'Content-Type': 'application/json'})
+    return urllib.request.urlopen(solicitud, timeout=30)
+
+def test_salud_y_recibi(servidor):
+    host, puerto = servidor.server_address[:2]
+    url = f"http://{host}:{puerto}"
+
+    with urllib.request.urlopen(f"{url}/salud", timeout=30) as respuesta:
+        salud = json.load(respuesta)
+    assert salud['estado'] == 'ok'
+    assert salud['beneficiarias'] == 10
+    assert salud['documentos'] == 0
+
+    with post_json(f"{url}/recibi", {'numero_siria': '1000000', 'codigo_ayuda': '1fgbi',
+                                     'profesional': 'Profesional B4'}) as respuesta:
+        assert respuesta.headers['Content-Type'].startswith('application/vnd.openxmlformats')
+        documento = respuesta.read()
+    texto = "\n".join(parrafo.text for parrafo in Document(io.BytesIO(documento)).paragraphs)
+    assert 'Nombre1000000' in texto
+    assert ('1000000', '1FGBI') in servidor.service.engine.registro.issued_in_month(datetime.now().strftime('%Y-%m'))
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post_json(f"{url}/recibi", {'numero_siria': '1000000', 'codigo_ayuda': 'NOEXISTE', 'cuantia': '10'})
+    assert error.value.code == 422
+    assert 'NOEXISTE' in json.load(error.value)['error']
+
+    with urllib.request.urlopen(f"{url}/salud", timeout=30) as respuesta:
+        assert json.load(respuesta)['documentos'] == 1
+
+@pytest.mark.parametrize('longitud, estado', [('-1', 400), ('abc', 400), (str(64 * 1024 + 1), 413)])
+def test_content_length_no_valido(servidor, longitud, estado):
+    host, puerto = servidor.server_address[:2]
+    conexion = http.client.HTTPConnection(host, puerto, timeout=30)
+    try:
+        conexion.putrequest('POST', '/recibi')
+        conexion.putheader('Content-Length', longitud)
+        conexion.endheaders()
+        respuesta = conexion.getresponse()
+        assert respuesta.status == estado
+        assert 'error' in json.load(respuesta)
+    finally:
+        conexion.close()